@@ -34,9 +34,14 @@ class Session():
     def configure(self, d):
         from .models.base import SONScrub
         self._config = d
-        mongoengine.connect(self.database, **self.mongo)
+        if self.mongo.get('mim'):
+            # "mongo": { "mim": 1 } runs against ming's in-memory mongo
+            connect_mim(self.database)
+        else:
+            mongoengine.connect(self.database, **self.mongo)
         db = mongoengine.connection.get_db()
-        db.add_son_manipulator(SONScrub())
+        if hasattr(db, 'add_son_manipulator'):
+            db.add_son_manipulator(SONScrub())
         self.log = logging.getLogger(__name__)
 
     def get_config(self):
@@ -48,6 +53,30 @@ class Session():
     def __repr__(self):
         return "SimpleSeer Session Object"
 
+def connect_mim(database = None):
+    """
+    Point mongoengine's default connection at ming's in-memory mongo, for
+    "mongo": { "mim": 1 } (perftest --mim) and the tests.  Calling it again
+    for the same database keeps the data already there; a different one
+    replaces the connection, and the database mongoengine had cached.
+
+    mongoengine has no public way to register a connection object, so this
+    is the one place that fills in its connection tables.
+    """
+    from ming import mim
+    connection = mongoengine.connection
+    alias = connection.DEFAULT_CONNECTION_NAME
+    settings = connection._connection_settings.get(alias) or {}
+    if (isinstance(connection._connections.get(alias), mim.Connection)
+        and settings.get('name') == database):
+        return
+    connection._connections[alias] = mim.Connection()
+    connection._connection_settings[alias] = dict(
+        name=database,
+        username=None,
+        password=None)
+    connection._dbs.pop(alias, None)
+
 #code to convert unicode to string
 # http://stackoverflow.com/questions/956867/how-to-get-string-objects-instead-unicode-ones-from-json-in-python
 def _decode_list(lst):
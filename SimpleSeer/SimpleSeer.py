@@ -1,10 +1,14 @@
 import os
 import gc
+import json
 import time
+import atexit
 import logging
 import warnings
 import threading
 from datetime import datetime
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 from . import models as M
 from .Controls import Controls as Controls
@@ -18,6 +22,14 @@ import numpy as np
 from glob import glob
 from cStringIO import StringIO
 from .models.OLAP import RealtimeOLAP
+from .pipeline import Pipeline
+from .executor import InspectionExecutor
+from .plan import InspectionPlan
+from .framebuffer import FrameBuffer
+from .metrics import Metrics
+from .overload import OverloadPolicy
+from .persistence import FrameWriter
+from . import overlay
 import realtime as realtime
 
 
@@ -25,18 +37,126 @@ import realtime as realtime
 log = logging.getLogger(__name__)
 
 class DirectoryCamera(FrameSource):
+    """
+    Replays a glob of image files, in name order, as if they came from a
+    camera.  It loops forever unless loop is false, in which case getImage
+    returns None once every file has been replayed.  For soak testing at
+    faster than line rate:
+
+      - prefetch: decode the next N files ahead on a thread pool
+      - cache: keep up to N decoded images (LRU) for looped playback
+      - rawfile: convert the directory once into a raw, memory-mapped frame
+        file, so replay does no decoding at all
+
+    { "directory": "/data/line1/*.jpg", "name": "Replay",
+      "prefetch": 4, "cache": 64 }
+    """
     filelist = []
     counter = 0
 
-    def __init__(self, path):
-        self.filelist = glob(path)
+    def __init__(self, path, prefetch = 0, cache = 0, rawfile = None,
+                 loop = True):
+        self.filelist = sorted(glob(path))
         self.counter = 0
+        self.loop = loop
+        self.done = False
+        self.prefetch = prefetch
+        self.cachesize = cache
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._pool = None
+        self.raw = None
+        if prefetch:
+            self._pool = ThreadPool(prefetch)
+        if rawfile:
+            self.raw = RawFrameFile(rawfile, self.filelist)
         
     def getImage(self):
-        i = Image(self.filelist[self.counter])
+        if self.done:
+            return None
+        index = self.counter
         self.counter = (self.counter + 1) % len(self.filelist)
+        if self.counter == 0 and not self.loop:
+            self.done = True
+        
+        i = self._cache.pop(index, None)
+        if i is not None:
+            #keep LRU order; hand out a copy so drawing on it can't
+            #leak into the next loop
+            self._cache[index] = i
+            i = i.copy()
+        else:
+            pending = self._pending.pop(index, None)
+            if pending is not None:
+                i = pending.get()
+            else:
+                i = self._load(index)
+            if self.cachesize:
+                self._cache[index] = i.copy()
+                while len(self._cache) > self.cachesize:
+                    self._cache.popitem(last=False)
+        
+        self._prefetch()
         return i
 
+    def _load(self, index):
+        if self.raw is not None:
+            return self.raw.image(index)
+        return Image(self.filelist[index])
+
+    def _prefetch(self):
+        if self._pool is None or self.done:
+            return
+        for offset in range(self.prefetch):
+            index = self.counter + offset
+            if index >= len(self.filelist) and not self.loop:
+                break
+            index %= len(self.filelist)
+            if index in self._pending or index in self._cache:
+                continue
+            self._pending[index] = self._pool.apply_async(self._load, (index,))
+
+class RawFrameFile(object):
+    """
+    Decoded frames for a list of image files, stored back to back as raw RGB
+    in one file and read through a memory map.  An index of
+    (source path, offset, width, height) is kept next to it in path.idx; if
+    that index doesn't match the file list the raw file is rebuilt.
+    """
+
+    def __init__(self, path, filelist):
+        self.path = path
+        self.index = self._read_index()
+        if [ entry[0] for entry in self.index ] != list(filelist):
+            self.index = self._build(filelist)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+
+    def _read_index(self):
+        try:
+            return json.load(open(self.path + '.idx'))
+        except (IOError, ValueError):
+            return []
+
+    def _build(self, filelist):
+        log.info('Converting %d images to raw frame file %s',
+                 len(filelist), self.path)
+        index = []
+        offset = 0
+        with open(self.path, 'wb') as fp:
+            for fn in filelist:
+                arr = Image(fn).getNumpy()
+                fp.write(arr.tostring())
+                width, height = arr.shape[:2]
+                index.append((fn, offset, width, height))
+                offset += arr.nbytes
+        json.dump(index, open(self.path + '.idx', 'w'))
+        return index
+
+    def image(self, i):
+        fn, offset, width, height = self.index[i]
+        size = width * height * 3
+        return Image(self._map[offset:offset + size].reshape((width, height, 3)))
+
 
 class SimpleSeer(object):
     """
@@ -64,6 +184,8 @@ class SimpleSeer(object):
 
         #read config file
         self.config = Session()
+        # keep what inspections draw as vectors, so overlays save small
+        overlay.install()
 
         self.cameras = []
        
@@ -72,7 +194,12 @@ class SimpleSeer(object):
             if camerainfo.has_key('virtual'):
                 self.cameras.append(VirtualCamera(camerainfo['source'], camerainfo['virtual']))
             elif camerainfo.has_key('directory'):
-                self.cameras.append(DirectoryCamera(camerainfo['directory']))
+                self.cameras.append(DirectoryCamera(
+                    camerainfo['directory'],
+                    prefetch=camerainfo.get('prefetch', 0),
+                    cache=camerainfo.get('cache', 0),
+                    rawfile=camerainfo.get('rawfile'),
+                    loop=camerainfo.get('loop', True)))
             elif camerainfo.has_key('kinect'):
                 k = Kinect()
                 k._usedepth = 0
@@ -95,11 +222,24 @@ class SimpleSeer(object):
         
         util.initialize_slave()
 			
+        self.executor = None
         self.reloadInspections() #initialize inspections so they get saved to redis
          
         self.loadPlugins()
-        self.lastframes = []
+        if self.config.inspection_processes:
+            self.executor = InspectionExecutor(self.config.inspection_processes)
+        self.lastframes = FrameBuffer(
+            self.config.max_frames or 100, self.config.max_frames_bytes)
         self.framecount = 0
+        self.capture_latency = {}
+        self.capture_skew = 0.0
+        self._capture_pool = None
+        self._previousframes = None
+        self.overload = OverloadPolicy(self.config.overload)
+        self.writer = None
+        if self.config.writer:
+            self.writer = FrameWriter.from_config(self.config.writer)
+            atexit.register(self.writer.stop)
         
         #log display started
         self.initialized = True
@@ -140,6 +280,12 @@ class SimpleSeer(object):
         self.inspections = i
         self.measurements = m
         self.watchers = w
+        #only rebuilt here, so anything that changes inspections, measurements
+        #or watchers has to call reloadInspections()
+        self.plan = InspectionPlan(i, m, w)
+        self.plan_queries_saved = 0.0
+        if self.executor is not None:
+            self.executor.invalidate()
 
     @classmethod
     def get_plugin_types(cls):
@@ -172,13 +318,10 @@ class SimpleSeer(object):
             frame = M.Frame(capturetime = datetime.utcnow(), 
                 camera = self.cameras[-1])
             frame.image = img            
-             
-            while len(self.lastframes) > self.config.max_frames:
-                self.lastframes.pop(0)
                             
             self.framecount = self.framecount + 1
 #            Session().redis.set("framecount", self.framecount)
-            self.lastframes.append(frame)
+            self.lastframes.append([frame])
 
     def loadImageDirectory(self, path = None):
       '''
@@ -189,7 +332,7 @@ class SimpleSeer(object):
       >>> ss = SimpleSeer()
       >>> ss.loadImageDirectory('/path/to/imgs/')
       >>> ss.lastframes
-      >>> ss.lastframes[-1].image.show()
+      >>> ss.lastframes[-1][0].image.show()
 
       '''
 
@@ -197,13 +340,52 @@ class SimpleSeer(object):
       self.loadImageSet(imgs)
       
         
-    def capture(self):
-        count = 0
+    def capture(self, record = True):
+        """
+        Grab a frameset from every camera.  It is appended to lastframes
+        unless record is False (the pipelined loop appends it itself, once
+        the frameset is through the pipeline).  Cameras that are out of
+        frames (a directory replayed without loop), or that failed, are left
+        out of it.
+        """
         currentframes = []
         self.framecount = self.framecount + 1
 
-        for c in self.cameras:
-            img = ""
+        if self.config.concurrent_capture and len(self.cameras) > 1:
+            if self._capture_pool is None:
+                self._capture_pool = ThreadPool(len(self.cameras))
+            grabbed = self._capture_pool.map(
+                self._grab, range(len(self.cameras)))
+        else:
+            grabbed = [ self._grab(count) for count in range(len(self.cameras)) ]
+
+        for frame, latency in grabbed:
+            if frame is None:
+                continue
+            currentframes.append(frame)
+            self.capture_latency[frame.camera] = latency
+                            
+#            Session().redis.set("framecount", self.framecount)
+
+        if currentframes:
+            times = [ f.capturetime for f in currentframes ]
+            self.capture_skew = (max(times) - min(times)).total_seconds()
+                    
+        if record:
+            self.lastframes.append(currentframes)
+            
+        return currentframes
+
+    def _grab(self, count):
+        """
+        Take a frame from camera number count, returning the Frame (None
+        if the camera had no image, or failed) and how long (in seconds) the
+        camera took to deliver it.
+        """
+        c = self.cameras[count]
+        timer_start = time.time()
+        img = ""
+        try:
             if c.__class__.__name__ == "Kinect" and c._usedepth == 1: 
                 img = c.getDepth()
             elif c.__class__.__name__ == "Kinect" and c._usematrix == 1:
@@ -211,58 +393,113 @@ class SimpleSeer(object):
                 img = Image(np.clip(mat - np.min(mat), 0, 255))
             else:
                 img = c.getImage()
-            if self.config.cameras[0].has_key('crop'):
-                img = img.crop(*self.config.cameras[0]['crop'])
-            frame = M.Frame(capturetime = datetime.utcnow(), 
-                camera= self.config.cameras[count]['name'])
-            frame.image = img
-            currentframes.append(frame)
-            
-            while len(self.lastframes) > self.config.max_frames:
-                self.lastframes.pop(0)
-            # log.info('framecount is %s', len(self.lastframes))
-                            
-#            Session().redis.set("framecount", self.framecount)
-            count = count + 1
-            
-                    
-        self.lastframes.append(currentframes)            
-            
-        return currentframes
+        except Exception:
+            # one camera failing mustn't cost the others their frames
+            log.exception('Capture from %s failed',
+                          self.config.cameras[count]['name'])
+            Metrics().incr('capture.errors')
+            img = None
+        capturetime = datetime.utcnow()
+        latency = time.time() - timer_start
+        if img is None:
+            return None, latency
+        if self.config.cameras[0].has_key('crop'):
+            img = img.crop(*self.config.cameras[0]['crop'])
+        frame = M.Frame(capturetime = capturetime, 
+            camera= self.config.cameras[count]['name'])
+        frame.image = img
+        return frame, latency
+
+    def _no_frames(self):
+        '''Halt once every camera is out of frames; else wait for them'''
+        if all(getattr(c, 'done', False) for c in self.cameras):
+            log.info('Cameras are out of frames, halting')
+            self.halt = True
+        else:
+            time.sleep(Session().poll_interval)
+
+    def capture_stats(self):
+        """
+        How long each camera took to deliver its last frame, and how far
+        apart (in seconds) the frames of the last frameset were taken.
+        """
+        return dict(
+            latency=dict(self.capture_latency),
+            skew=self.capture_skew)
             
-    def inspect(self, frames = []):
+    def inspect(self, frames = [], skip = ()):
         if not len(frames) and not len(self.lastframes):
             frames = self.capture()
         elif not len(frames):
             frames = self.lastframes[-1]
         
-        for frame in frames:
-            frame.features = []
-            frame.results = []
-            for inspection in self.inspections:
-                if inspection.parent:  #root parents only
-                    continue
-                
-                if inspection.camera and frame.camera != inspection.camera:
-                    #this camera, or all cameras if no camera is specified
-                    continue
-                
-                feats = inspection.execute(frame.image)
-                frame.features.extend(feats)
-                for m in inspection.measurements:
-                    m.execute(frame, feats)
-                    
-            for watcher in self.watchers:
-                watcher.check(frame.results)
-        
-
+        self.inspect_frames(frames, skip)
+        self.check_frames(frames)
         return 
 
+    def previous_frames(self):
+        """
+        The frameset captured before the one being inspected, or None.
+        In the pipelined loop that is the one the inspect stage handled
+        last, which may not have reached lastframes yet.
+        """
+        if getattr(self, 'pipeline', None) is not None:
+            return self._previousframes
+        if len(self.lastframes) > 1:
+            return self.lastframes[-2]
+        return None
+
+    def inspect_frames(self, frames, skip = ()):
+        """
+        Run the root inspections for each frame's camera, and their
+        measurements, filling in frame.features and frame.results.
+        Inspections whose method is in skip are left out.
+        """
+        plan = self.plan
+        saved = plan.queries_saved
+        workers_saved = 0
+        if self.executor is not None:
+            workers_saved = self.executor.inspect(frames, plan, skip)
+        else:
+            for frame in frames:
+                frame.features = []
+                frame.results = []
+                for inspection in plan.roots_for(frame.camera):
+                    if inspection.method in skip:
+                        continue
+                    feats = inspection.execute(frame.image, plan = plan)
+                    frame.features.extend(feats)
+                    for m in plan.measurements(inspection):
+                        m.execute(frame, feats, plan)
+        #how many mongo round trips the plans answered from memory, per
+        #frame; check_frames adds the watchers' share
+        saved = plan.queries_saved - saved + workers_saved
+        Metrics().incr('plan.queries_saved', saved)
+        if frames:
+            self.plan_queries_saved = float(saved) / len(frames)
+
+    def check_frames(self, frames):
+        """
+        Run every watcher against each frame's results
+        """
+        plan = self.plan
+        saved = plan.queries_saved
+        for frame in frames:
+            fired = False
+            for watcher in plan.watchers:
+                if watcher.check(frame.results, plan):
+                    fired = True
+            frame.passed = not fired
+        saved = plan.queries_saved - saved
+        Metrics().incr('plan.queries_saved', saved)
+        if frames:
+            self.plan_queries_saved += float(saved) / len(frames)
+
     def frame(self, index = 0):
         if len(self.lastframes):    
             return self.lastframes[-1][index]
         else:
-            frames = M.Frame.objects.order_by("-capturetime").skip(index)
+            total, frames = M.Frame.search({}, [('capturetime', -1)], index, 1)
             if len(frames):
                 return frames[0]
             else:
@@ -275,18 +512,18 @@ class SimpleSeer(object):
 
     def get_last_frame_ids(self):
         return [ [ f.id for f in frames ]
-                 for frames in self.lastframes ]
+                 for frames in self.lastframes.snapshot() ]
 
     def get_frame_id(self, index, camera):
         return self.lastframes[index][camera].id
     
     def get_image(self, width, index, camera):
         frame = self.lastframes[index][camera]
-        image = frame.image
-        
-        if (width):
-            image = image.scale(width / float(image.width))
-        
+        if width:
+            image = frame.image_at(int(width))
+        else:
+            image = frame.render()
+
         s = StringIO()
         image.save(s, "jpeg", quality=60)
         
@@ -323,7 +560,7 @@ class SimpleSeer(object):
     @property
     def results(self):
         ret = []
-        for frameset in self.lastframes:
+        for frameset in self.lastframes.snapshot():
             results = []
             for f in frameset:
                 results += [f.results for f in frameset]
@@ -333,6 +570,9 @@ class SimpleSeer(object):
         return ret
     
     def run(self):
+        if self.config.pipeline_depth:
+            return self.run_pipelined(self.config.pipeline_depth)
+        metrics = Metrics()
         iteration = 0
         while True:
             time.sleep(0)
@@ -342,27 +582,165 @@ class SimpleSeer(object):
                 if iteration % 100 == 0: gc.collect()
                 iteration += 1
                 
-                self.capture()
+                with metrics.timer('run.capture'):
+                    frames = self.capture(record = False)
+                if not frames:
+                    self._no_frames()
+                    continue
                 realtime.ChannelManager().publish('capture.', { "capture": 1})
 
-                self.inspect()
-                self.check()
-                if self.config.record_all:
-                    for frame in self.lastframes[-1]:
-                        frame.save(safe = False)
+                # dropped framesets never reach lastframes, so nothing
+                # shows (or compares against) frames that weren't inspected
+                if not self.overload.drop_frame(Session().poll_interval):
+                    self.lastframes.append(frames)
+                    with metrics.timer('run.inspect'):
+                        self.inspect_frames(frames,
+                            self.overload.skip_inspections(self.framecount))
+                    with metrics.timer('run.check'):
+                        self.check_frames(frames)
+                    if self.config.record_all:
+                        with metrics.timer('run.save'):
+                            self.persist_frames(frames)
+                metrics.observe('run.frame', time.time() - timer_start)
+                metrics.incr('frames')
+                metrics.maybe_publish()
                 # TODO: I put this back under control of result
                 # Need to talk with Nate
                 #check any OLAPs
                 #o = RealtimeOLAP()
                 #o.realtime()
                 
-                timeleft = Session().poll_interval - (time.time() - timer_start)
+                elapsed = time.time() - timer_start
+                self.overload.record(elapsed, Session().poll_interval)
+                timeleft = Session().poll_interval - elapsed
                 if timeleft > 0:
                     time.sleep(timeleft)
                 else:
                     time.sleep(0)
             time.sleep(0.1)
 
+    def run_pipelined(self, depth = 4):
+        """
+        Same loop as run(), but inspection, watcher checks and persistence
+        each get their own thread, joined by queues holding at most depth
+        framesets.  Capture still happens here in order, one frameset per
+        poll_interval; a slow save or inspection only blocks capture once
+        its queue is full.  Framesets are appended to lastframes by the
+        last stage, so lastframes only holds inspected (and saved) frames,
+        as it does after each pass of run().
+        """
+        self.pipeline = Pipeline(depth)
+        self.pipeline.add_stage('inspect', self._inspect_stage)
+        self.pipeline.add_stage('check', self._check_stage)
+        self.pipeline.add_stage('persist', self._persist_stage)
+        self.pipeline.start()
+        
+        metrics = Metrics()
+        iteration = 0
+        while True:
+            time.sleep(0)
+            while not self.halt:
+                timer_start = time.time()
+                
+                if iteration % 100 == 0:
+                    gc.collect()
+                    realtime.ChannelManager().publish(
+                        'pipeline.', self.pipeline_stats())
+                iteration += 1
+                
+                with metrics.timer('run.capture'):
+                    frames = self.capture(record = False)
+                if not frames:
+                    self._no_frames()
+                    continue
+                realtime.ChannelManager().publish('capture.', { "capture": 1})
+                if not self.overload.drop_frame(Session().poll_interval):
+                    self.pipeline.put(frames, time.time() - timer_start)
+                metrics.incr('frames')
+                metrics.maybe_publish()
+                
+                elapsed = time.time() - timer_start
+                self.overload.record(elapsed, Session().poll_interval)
+                timeleft = Session().poll_interval - elapsed
+                if timeleft > 0:
+                    time.sleep(timeleft)
+                else:
+                    time.sleep(0)
+            time.sleep(0.1)
+
+    def _inspect_stage(self, frames):
+        with Metrics().timer('run.inspect'):
+            self.inspect_frames(frames,
+                self.overload.skip_inspections(self.framecount))
+        self._previousframes = frames
+        return frames
+
+    def _check_stage(self, frames):
+        with Metrics().timer('run.check'):
+            self.check_frames(frames)
+        return frames
+
+    def _persist_stage(self, frames):
+        try:
+            if self.config.record_all:
+                with Metrics().timer('run.save'):
+                    self.persist_frames(frames)
+        finally:
+            self.lastframes.append(frames)
+        return frames
+
+    def persist_frames(self, frames):
+        '''Save a frameset, applying any overload policy that is in force'''
+        for frame in frames:
+            if self.overload.skip_save(frame):
+                continue
+            self.overload.degrade(frame)
+            if self.writer is not None:
+                self.writer.put(frame)
+            else:
+                frame.save(safe = False)
+
+    def overload_stats(self):
+        '''Overrun count and how often each overload policy fired'''
+        return self.overload.stats()
+
+    def writer_stats(self):
+        '''Queue depth and write latency of the background frame writer'''
+        if self.writer is None:
+            return {}
+        return self.writer.stats()
+
+    def get_metrics(self):
+        """
+        Hot path timers and counters for this process, and the state of
+        capture, the overload policy and the frame writer, as text
+        """
+        capture = self.capture_stats()
+        overload = self.overload_stats()
+        # overruns, policies fired and frames written are counters already
+        gauges = {
+            'capture.skew': capture['skew'],
+            'overload.overloaded': int(overload['overloaded']),
+            'overload.behind': overload['behind'],
+            'plan.queries_saved_per_frame': float(self.plan_queries_saved) }
+        for camera, latency in capture['latency'].items():
+            gauges['capture.latency{camera="%s"}' % camera] = latency
+        writer = self.writer_stats()
+        for name in ('queued', 'depth', 'last_write'):
+            if name in writer:
+                gauges['writer.' + name] = writer[name]
+        return Metrics().render(gauges)
+
+    def pipeline_stats(self):
+        """
+        Queue occupancy and per-stage latency (in seconds) for each stage
+        of the pipelined run loop, keyed by stage name.
+        """
+        pipeline = getattr(self, 'pipeline', None)
+        if pipeline is None:
+            return {}
+        return pipeline.stats()
+
     def start(self):
         self.thread = threading.Thread(target=self.run)
         self.thread.daemon = True
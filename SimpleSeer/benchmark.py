@@ -0,0 +1,473 @@
+import os
+import glob
+import time
+import random
+import logging
+import cPickle as pickle
+from binascii import b2a_base64
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+import bson
+
+from SimpleCV import Image
+
+from . import models as M
+from . import realtime
+from .imagecodec import get_codec
+from .models.base import SONScrub
+
+log = logging.getLogger(__name__)
+
+TESTDATA = os.path.join(os.path.dirname(__file__), 'plugins', 'testdata', '*')
+
+# used when the database has no inspections of its own
+DEFAULT_INSPECTIONS = [
+    dict(name='perftest blobs', method='blobs', parameters={},
+         measurements=[
+            dict(name='perftest blob area', method='area',
+                 featurecriteria=dict(index=0)) ]) ]
+
+STAGES = ('capture', 'publish', 'inspect', 'check', 'save')
+
+# (name, params) pairs compared by codec_benchmark
+CODECS = [
+    ('jpeg', dict(quality=100)),
+    ('jpeg', dict(quality=90)),
+    ('jpeg', dict(quality=75)),
+    ('png', dict(compress_level=1)),
+    ('webp', dict(quality=80)),
+    ('raw', dict(compress=None)),
+    ('raw', dict(compress='zlib')),
+    ('raw', dict(compress='lz4')) ]
+
+def percentile(values, pct):
+    '''Nearest-rank percentile of an already sorted list'''
+    if not values:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+def summarize(timings):
+    '''count/mean/p50/p95/p99/max (in ms) for a list of durations in seconds'''
+    values = sorted(t * 1000.0 for t in timings)
+    count = len(values)
+    return dict(
+        count=count,
+        mean=count and sum(values) / count or 0.0,
+        p50=percentile(values, 50),
+        p95=percentile(values, 95),
+        p99=percentile(values, 99),
+        max=count and values[-1] or 0.0)
+
+def load_inspections(specs):
+    """
+    Create inspections (and their measurements) from a list of dicts like
+    DEFAULT_INSPECTIONS.  Children can be nested under 'children'.
+    """
+    created = []
+    def _create(spec, parent=None):
+        spec = dict(spec)
+        measurements = spec.pop('measurements', [])
+        children = spec.pop('children', [])
+        insp = M.Inspection(parent=parent, **spec)
+        insp.save()
+        created.append(insp)
+        for m in measurements:
+            M.Measurement(inspection=insp.id, **m).save()
+        for child in children:
+            _create(child, insp.id)
+    for spec in specs:
+        _create(spec)
+    return created
+
+def run_pipeline_benchmark(seer, frames, save=True):
+    """
+    Push frames framesets through capture, publish, inspect, check and
+    save, timing each stage on its own.  Returns a JSON-friendly dict.
+    """
+    timings = dict((stage, []) for stage in STAGES)
+    cm = realtime.ChannelManager()
+
+    def timed(stage, func, *args, **kwargs):
+        timer_start = time.time()
+        result = func(*args, **kwargs)
+        timings[stage].append(time.time() - timer_start)
+        return result
+
+    bench_start = time.time()
+    for i in xrange(frames):
+        frameset = timed('capture', seer.capture)
+        timed('publish', cm.publish, 'capture.', { "capture": 1 })
+        timed('inspect', seer.inspect_frames, frameset)
+        timed('check', seer.check_frames, frameset)
+        if save:
+            for frame in frameset:
+                timed('save', frame.save, safe=False)
+    elapsed = time.time() - bench_start
+
+    return dict(
+        frames=frames,
+        seconds=elapsed,
+        fps=elapsed and frames / elapsed or 0.0,
+        cameras=len(seer.cameras),
+        inspections=len(seer.inspections),
+        measurements=len(seer.measurements),
+        stages=dict(
+            (stage, summarize(values))
+            for stage, values in timings.items()))
+
+def codec_benchmark(images, rounds=10, codecs=CODECS):
+    """
+    Encode and decode each image rounds times with every codec.  Reports
+    encode/decode timings and the mean bytes per frame for each; codecs
+    that aren't available here (no WebP in PIL, say) report the error.
+    """
+    images = [ Image(path) for path in sorted(glob.glob(images)) ]
+    report = {}
+    for name, params in codecs:
+        key = name + ''.join(
+            ' %s=%s' % item for item in sorted(params.items()))
+        encode_times, decode_times, sizes = [], [], []
+        try:
+            codec = get_codec(name, **params)
+            for i in xrange(rounds):
+                for img in images:
+                    timer_start = time.time()
+                    data = codec.encode(img)
+                    encode_times.append(time.time() - timer_start)
+                    sizes.append(len(data))
+                    timer_start = time.time()
+                    codec.decode(data)
+                    decode_times.append(time.time() - timer_start)
+        except Exception, e:
+            log.warning('Codec %s failed: %s', key, e)
+            report[key] = dict(error=str(e))
+            continue
+        report[key] = dict(
+            encode=summarize(encode_times),
+            decode=summarize(decode_times),
+            bytes=sizes and sum(sizes) / len(sizes) or 0)
+    return dict(images=len(images), rounds=rounds, codecs=report)
+
+def results_benchmark(frames=100, per_frame=40, batch=10):
+    """
+    Results written per second, saving frames' results one at a time (a
+    get_or_create and a save each, as Frame.save used to), one bulk save
+    per frame, one bulk save per batch of frames, and (resave) the batches
+    saved again, as when frames are re-inspected.
+    """
+    def make_frames():
+        made = []
+        for i in xrange(frames):
+            frame = M.Frame(
+                id=bson.ObjectId(), camera='perftest',
+                capturetime=datetime.utcnow())
+            frame.results = [
+                M.ResultEmbed(
+                    result_id=bson.ObjectId(), numeric=float(j), string=str(j),
+                    inspection_id=bson.ObjectId(), measurement_id=bson.ObjectId())
+                for j in xrange(per_frame) ]
+            made.append(frame)
+        return made
+
+    def one_by_one(frames):
+        for frame in frames:
+            for doc in frame._result_docs():
+                M.Result.objects.get_or_create(auto_save=False, id=doc.id)
+                doc.save(safe=False)
+
+    def per_frame_bulk(frames):
+        for frame in frames:
+            frame._save_results(safe=False)
+
+    def batched(frames):
+        for i in xrange(0, len(frames), batch):
+            M.Result.bulk_save(
+                [ r for frame in frames[i:i + batch]
+                  for r in frame._result_docs() ],
+                safe=False)
+
+    def resaved(frames):
+        batched(frames)
+        timer_start = time.time()
+        batched(frames)
+        return timer_start
+
+    report = dict(frames=frames, per_frame=per_frame, batch=batch)
+    for name, func in (('per_result', one_by_one),
+                       ('per_frame', per_frame_bulk),
+                       ('batch', batched),
+                       ('resave', resaved)):
+        made = make_frames()
+        timer_start = time.time()
+        timer_start = func(made) or timer_start
+        elapsed = time.time() - timer_start
+        M.Result.objects(frame__in=[ f.id for f in made ]).delete()
+        report[name] = dict(
+            seconds=elapsed,
+            results_per_second=elapsed and frames * per_frame / elapsed or 0.0)
+    return report
+
+def _unwind_search(filters, sorts, skip, limit):
+    '''Frame.search as it was, unwinding features and results, for comparison'''
+    db = M.Frame._get_db()
+    pipeline = [
+        {'$match': filters },
+        {'$unwind': '$features'},
+        {'$unwind': '$results' },
+        {'$match': filters },
+        {'$sort': sorts },
+        {'$project': {'_id': 1} }]
+    cmd = db.command('aggregate', 'frame', pipeline=pipeline)
+    seen = set()
+    ids = []
+    for doc in cmd['result']:
+        if doc['_id'] in seen: continue
+        seen.add(doc['_id'])
+        if skip > 0:
+            skip -= 1
+            continue
+        ids.append(doc['_id'])
+        if len(ids) >= limit: break
+    return len(cmd['result']), list(M.Frame.objects(id__in=ids))
+
+def search_benchmark(frames=10000, features=5, results=5, rounds=5):
+    """
+    Insert frames synthetic frames (camera 'searchbench', an hour apart
+    going back from now), then time a few typical /frames searches with the
+    old unwinding search and Frame.search.  The frames are removed after.
+    """
+    collection = M.Frame._get_collection()
+    inspections = [ bson.ObjectId() for i in xrange(3) ]
+    now = datetime.utcnow()
+    for start in xrange(0, frames, 1000):
+        docs = []
+        for i in xrange(start, min(frames, start + 1000)):
+            docs.append(dict(
+                camera='searchbench',
+                capturetime=now - timedelta(hours=i),
+                features=[
+                    dict(featuretype=random.choice(['Blob', 'Line', 'Circle']),
+                         area=random.random() * 1000)
+                    for j in xrange(features) ],
+                results=[
+                    dict(inspection_id=random.choice(inspections),
+                         numeric=random.random() * 100,
+                         string='r%d' % j)
+                    for j in xrange(results) ]))
+        collection.insert(docs)
+    M.Frame.ensure_indexes()
+
+    queries = dict(
+        camera=({'camera': 'searchbench'}, {'capturetime': -1}),
+        results=({'camera': 'searchbench',
+                  'results.inspection_id': inspections[0],
+                  'results.numeric': {'$gt': 50}}, {'capturetime': -1}),
+        timerange=({'camera': 'searchbench',
+                    'capturetime': {'$gte': now - timedelta(days=7)},
+                    'features.featuretype': 'Blob'}, {'capturetime': -1}))
+    report = dict(frames=frames, features=features, results=results)
+    try:
+        for name, (filters, sorts) in queries.items():
+            entry = {}
+            for impl, func in (('unwind', _unwind_search),
+                               ('search', M.Frame.search)):
+                timings = []
+                try:
+                    for i in xrange(rounds):
+                        timer_start = time.time()
+                        total, found = func(filters, sorts, 20, 20)
+                        timings.append(time.time() - timer_start)
+                except Exception, e:
+                    entry[impl] = dict(error=str(e))
+                    continue
+                entry[impl] = dict(total=total, timings=summarize(timings))
+            report[name] = entry
+    finally:
+        collection.remove({'camera': 'searchbench'})
+    return report
+
+def _legacy_feature_son(data):
+    '''A feature as setFeature saved it before it was compacted'''
+    image, data.image = data.image, ''
+    featurepickle = pickle.dumps(data)
+    data.image = image
+    featuredata = dict(
+        (k, getattr(data, k)) for k in data.__getstate__()
+        if k not in M.FrameFeature.featuredata_mask
+        and not hasattr(M.FrameFeature, k) and k[0] != '_')
+    return dict(
+        featuretype=data.__class__.__name__,
+        x=float(int(data.x)), y=float(int(data.y)),
+        points=[ list(p) for p in data.points ],
+        area=float(data.area()), width=float(data.width()),
+        height=float(data.height()), angle=float(data.angle()),
+        meancolor=[ float(c) for c in data.meanColor() ],
+        featuredata=featuredata,
+        featurepickle_b64=b2a_base64(featurepickle),
+        children=[])
+
+def features_benchmark(images, rounds=10):
+    """
+    Bytes and CPU per frame for the blobs found in each image, stored the
+    old way (pickle + base64 and a full featuredata), compacted, and
+    compacted with the pickle kept.  encode is setFeature through to BSON;
+    decode is BSON back to the rebuilt SimpleCV features.  No database is
+    needed.
+    """
+    scrub = SONScrub()
+    blobsets = []
+    for path in sorted(glob.glob(images)):
+        img = Image(path)
+        blobs = img.findBlobs() or []
+        blobsets.append(list(blobs))
+
+    def legacy(blobs):
+        return [ _legacy_feature_son(b) for b in blobs ]
+
+    def compact(keep_pickle):
+        def encode(blobs):
+            sons = []
+            for b in blobs:
+                ff = M.FrameFeature()
+                ff.setFeature(b, keep_pickle=keep_pickle)
+                sons.append(ff.to_mongo())
+            return sons
+        return encode
+
+    report = dict(images=len(blobsets), rounds=rounds,
+                  features=sum(len(blobs) for blobs in blobsets))
+    for name, encode in (('pickle+base64', legacy),
+                         ('compact', compact(False)),
+                         ('compact+pickle', compact(True))):
+        encode_times, decode_times, sizes = [], [], []
+        for i in xrange(rounds):
+            for blobs in blobsets:
+                timer_start = time.time()
+                doc = scrub.transform_incoming(dict(features=encode(blobs)), None)
+                data = bson.BSON.encode(doc)
+                encode_times.append(time.time() - timer_start)
+                sizes.append(len(data))
+                timer_start = time.time()
+                doc = scrub.transform_outgoing(bson.BSON(data).decode(), None)
+                for son in doc['features']:
+                    M.FrameFeature._from_son(son).feature
+                decode_times.append(time.time() - timer_start)
+        report[name] = dict(
+            encode=summarize(encode_times),
+            decode=summarize(decode_times),
+            bytes=sizes and sum(sizes) / len(sizes) or 0)
+    return report
+
+def _copying_incoming(scrubber, son, collection):
+    '''SONScrub.transform_incoming as it was: every dict and list rebuilt'''
+    if isinstance(son, scrubber._bson_primitive_types):
+        pass
+    elif isinstance(son, (list, tuple)):
+        son = [ _copying_incoming(scrubber, v, collection) for v in son ]
+        son = [ v for v in son if v is not scrubber.Missing ]
+    elif isinstance(son, dict):
+        son = [
+            (k, _copying_incoming(scrubber, v, collection))
+            for k,v in son.items()]
+        son = dict((k,v) for k,v in son if v is not scrubber.Missing)
+    else:
+        serializer, type_id = None, None
+        for test_type in type(son).__mro__:
+            result = scrubber._serializers.get(test_type, None)
+            if result is not None:
+                serializer, type_id = result
+                break
+        if serializer is not None:
+            son = serializer(son, collection)
+            if type_id is not None:
+                son = bson.Binary(son, type_id)
+    return son
+
+def _copying_outgoing(scrubber, son, collection):
+    '''SONScrub.transform_outgoing as it was'''
+    if isinstance(son, (list, tuple)):
+        son = [ _copying_outgoing(scrubber, v, collection) for v in son ]
+    elif isinstance(son, dict):
+        son = dict(
+            (k, _copying_outgoing(scrubber, v, collection))
+            for k,v in son.items())
+    elif isinstance(son, bson.Binary) and son.subtype & 0x80:
+        deserializer = scrubber._deserializers.get(son.subtype)
+        if deserializer is not None:
+            son = deserializer(son, collection)
+    return son
+
+def scrub_benchmark(features=200, rounds=10):
+    """
+    SONScrub's walk of a frame with features (each with points, a contour
+    and an image to scrub), against the old walk that copied every dict and
+    list.  No database is needed.
+    """
+    scrub = SONScrub()
+    frame = dict(
+        camera='perftest', capturetime=datetime.utcnow(),
+        features=[
+            dict(featuretype='Blob', x=float(i), y=float(i),
+                 points=[ [j, j] for j in range(4) ],
+                 featuredata=dict(
+                    mArea=100.0,
+                    mContour=[ [j, j + 1] for j in range(50) ],
+                    mImg=Image((1, 1))))
+            for i in range(features) ])
+    son = scrub.transform_incoming(frame, None)
+
+    def timing(func, doc):
+        timer_start = time.time()
+        for i in xrange(rounds):
+            func(doc, None)
+        return (time.time() - timer_start) / rounds * 1000.0
+
+    return dict(
+        features=features, rounds=rounds,
+        same=son == _copying_incoming(scrub, frame, None),
+        incoming_ms=timing(scrub.transform_incoming, frame),
+        incoming_old_ms=timing(
+            lambda s, c: _copying_incoming(scrub, s, c), frame),
+        outgoing_ms=timing(scrub.transform_outgoing, son),
+        outgoing_old_ms=timing(
+            lambda s, c: _copying_outgoing(scrub, s, c), son))
+
+BLISTER = os.path.join(os.path.dirname(__file__), 'plugins', 'testdata', 'blister.jpg')
+
+def extract_benchmark(path=BLISTER, rounds=10):
+    """
+    Features converted per second by setFeature, for the blobs the Blobs
+    plugin finds in path, against the old conversion (deepcopied points,
+    a walk of __getstate__ with a hasattr per attribute, and a pickle).
+    """
+    if not getattr(M.Inspection, '_plugins', None):
+        M.Inspection.register_plugins('seer.plugins.inspection')
+    image = Image(path)
+    blobs = M.Inspection(name='extract', method='blobs', parameters={}).execute(image)
+    blobs = [ ff.feature for ff in blobs ]
+
+    def legacy(blob):
+        son = _legacy_feature_son(blob)
+        son['points'] = deepcopy(blob.points)
+        return son
+
+    def compact(keep_pickle):
+        def extract(blob):
+            M.FrameFeature().setFeature(blob, keep_pickle=keep_pickle)
+        return extract
+
+    report = dict(image=path, blobs=len(blobs), rounds=rounds)
+    for name, extract in (('legacy', legacy),
+                          ('setFeature', compact(False)),
+                          ('setFeature+pickle', compact(True))):
+        timer_start = time.time()
+        for i in xrange(rounds):
+            for blob in blobs:
+                extract(blob)
+        elapsed = time.time() - timer_start
+        report[name] = dict(
+            seconds=elapsed,
+            features_per_second=elapsed and len(blobs) * rounds / elapsed or 0.0)
+    return report
@@ -7,6 +7,7 @@ from werkzeug import exceptions
 from .base import jsonencode
 from . import models as M
 from . import validators as V
+from . import util
 
 # SERIALIZERS expects and 'encode' property in its encoders
 jsonencode.encode = jsonencode
@@ -30,9 +31,11 @@ def register(app):
 
     handlers = [
         ModelHandler(M.Inspection, M.InspectionSchema,
-                     'inspection', '/inspection'),
+                     'inspection', '/inspection',
+                     on_change=_reload_inspections),
         ModelHandler(M.OLAP, M.OLAPSchema, 'olap', '/olap'),
-        ModelHandler(M.Measurement, M.MeasurementSchema, 'measurement', '/measurement'),
+        ModelHandler(M.Measurement, M.MeasurementSchema, 'measurement', '/measurement',
+                     on_change=_reload_inspections),
         ModelHandler(M.Frame, M.FrameSchema, 'frame', "/frame", ["delete", "get"]),
         ModelHandler(M.FrameSet, M.FrameSetSchema, 'frameset', '/frameset')        
        ]
@@ -45,21 +48,37 @@ def register(app):
 
     app.register_blueprint(bp)
 
+def _reload_inspections():
+    # the seer's InspectionPlan is only rebuilt on reload
+    util.get_seer().reloadInspections()
+
 class ModelHandler(object):
 
     def __init__(self, cls, schema, name, route,
-                 actions = ("list", "add", "update", "delete", "get")):
+                 actions = ("list", "add", "update", "delete", "get"),
+                 on_change = None):
         self._cls = cls
         self.schema = schema()
         self.name = name
         self.route = route
         self.actions = actions
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
 
-    def _get_object(self, id):
+    def _get_object(self, id, projection=None):
         try:
             id = bson.ObjectId(id)
         except bson.errors.InvalidId:
             raise exceptions.NotFound('Invalid ObjectId')
+        if hasattr(self._cls, 'by_id'):
+            # frames may be in any time partition
+            obj = self._cls.by_id(id, projection or 'full')
+            if obj is None:
+                raise exceptions.NotFound('Object not found')
+            return obj
         objs = self._cls.objects(id=id)
         if not objs:
             raise exceptions.NotFound('Object not found')
@@ -80,6 +99,7 @@ class ModelHandler(object):
         values = self._get_body(flask.request.json)
         obj = self._cls(**values)
         obj.save()
+        self._changed()
         return 201, obj
 
     def update(self, **kwargs):
@@ -88,6 +108,7 @@ class ModelHandler(object):
         values = self._get_body(flask.request.json)
         obj.update_from_json(values)
         obj.save()
+        self._changed()
         return 200, obj
 
     def delete(self, **kwargs):
@@ -97,13 +118,20 @@ class ModelHandler(object):
         obj = self._get_object(id)
         d = obj.__getstate__()
         obj.delete()
+        self._changed()
         return 200, d
 
     def get(self, **kwargs):
         id = kwargs.values()[0]
-
-        obj = self._get_object(id)
-        return 200, obj
+        projection = flask.request.args.get('projection')
+        if projection is None or not hasattr(self._cls, 'PROJECTIONS'):
+            return 200, self._get_object(id)
+        # e.g. /api/frame/<id>?projection=summary
+        try:
+            self._cls.projection_fields(projection)
+        except ValueError, e:
+            raise exceptions.BadRequest(str(e))
+        return 200, self._get_object(id, projection).state(projection)
 
     def list(self):
         objs = self._cls.objects()
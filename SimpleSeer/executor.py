@@ -0,0 +1,161 @@
+import os
+import logging
+import tempfile
+import multiprocessing
+
+import numpy as np
+import mongoengine
+
+from SimpleCV import Image
+
+from . import models as M
+from .Session import Session
+from .plan import InspectionPlan
+
+log = logging.getLogger(__name__)
+
+# /dev/shm is a tmpfs on linux, so files there never touch the disk
+if os.path.isdir('/dev/shm'):
+    SHM_DIR = '/dev/shm'
+else: # pragma no cover
+    SHM_DIR = tempfile.gettempdir()
+
+class SharedImage(object):
+    """
+    A frame's pixels copied once into a shared memory file, so that every
+    worker process can map the same buffer instead of unpickling its own
+    copy of the SimpleCV Image.  Instances are cheap to pickle: they only
+    carry the path, dtype and shape.
+    """
+
+    def __init__(self, image):
+        arr = image.getNumpy()
+        fd, self.path = tempfile.mkstemp(prefix='seer-', dir=SHM_DIR)
+        os.close(fd)
+        self.dtype = arr.dtype.str
+        self.shape = arr.shape
+        mm = np.memmap(self.path, dtype=arr.dtype, mode='w+', shape=arr.shape)
+        mm[:] = arr
+        mm.flush()
+        del mm
+
+    def image(self):
+        return Image(np.memmap(
+                self.path, dtype=np.dtype(self.dtype), mode='r', shape=self.shape))
+
+    def unlink(self):
+        try:
+            os.unlink(self.path)
+        except OSError: # pragma no cover
+            pass
+
+class InspectionExecutor(object):
+    """
+    Runs root inspections (and their measurements) in a pool of worker
+    processes.  Work items are (frame, inspection) pairs; the features and
+    results that come back are merged into each frame in the same order a
+    serial SimpleSeer.inspect() would have produced them.
+
+    Inspections whose plugin is not marked parallel (e.g. motion, which
+    needs the seer's lastframes) are still executed in this process.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.version = 0
+        self.pool = multiprocessing.Pool(
+            processes, _init_worker, (Session().get_config(),))
+
+    def invalidate(self):
+        '''Inspections or measurements changed; workers must reload them'''
+        self.version += 1
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def inspect(self, frames, plan, skip = ()):
+        """
+        Inspect frames, as SimpleSeer.inspect_frames does.  Returns how many
+        queries the workers' plans answered from memory (the local plan
+        counts its own).
+        """
+        pending = []
+        shared = []
+        local = {}
+        saved = 0
+        try:
+            for fi, frame in enumerate(frames):
+                frame.features = []
+                frame.results = []
+                shm = None
+                for ii, inspection in enumerate(plan.roots_for(frame.camera)):
+                    if inspection.method in skip:
+                        continue
+                    if not _is_parallel(inspection, plan):
+                        local[fi, ii] = _execute(frame, inspection, plan)
+                        continue
+                    if shm is None:
+                        shm = SharedImage(frame.image)
+                        shared.append(shm)
+                    pending.append(((fi, ii), self.pool.apply_async(
+                                _worker_execute,
+                                (self.version, shm, frame.camera,
+                                 frame.capturetime, inspection.id))))
+            for key, async_result in pending:
+                features, results, queries_saved = async_result.get()
+                saved += queries_saved
+                local[key] = (
+                    [ M.FrameFeature._from_son(f) for f in features ],
+                    [ M.ResultEmbed._from_son(r) for r in results ])
+        finally:
+            for shm in shared:
+                shm.unlink()
+        # merge in (frame, inspection) order so output is deterministic
+        for key in sorted(local.keys()):
+            features, results = local[key]
+            frame = frames[key[0]]
+            frame.features.extend(features)
+            frame.results.extend(results)
+        return saved
+
+def _is_parallel(inspection, plan):
+    return getattr(plan.plugin(inspection), 'parallel', False)
+
+def _execute(frame, inspection, plan):
+    '''Run one inspection and its measurements against frame, returning
+    the (features, results) it produced.'''
+    results = frame.results
+    frame.results = []
+    try:
+        features = inspection.execute(frame.image, plan = plan)
+        for m in plan.measurements(inspection):
+            m.execute(frame, features, plan)
+        return features, list(frame.results)
+    finally:
+        frame.results = results
+
+# Worker process state
+_worker = dict(version=None, plan=None)
+
+def _init_worker(config):
+    # connections inherited across fork() are not safe to share
+    mongoengine.connection.disconnect()
+    Session().configure(config)
+    M.Inspection.register_plugins('seer.plugins.inspection')
+    M.Measurement.register_plugins('seer.plugins.measurement')
+
+def _worker_execute(version, shm, camera, capturetime, inspection_id):
+    if version != _worker['version']:
+        _worker['version'] = version
+        _worker['plan'] = InspectionPlan.load()
+    plan = _worker['plan']
+    inspection = plan.inspection(inspection_id)
+    frame = M.Frame(camera=camera, capturetime=capturetime)
+    frame.image = shm.image()
+    saved = plan.queries_saved
+    features, results = _execute(frame, inspection, plan)
+    return (
+        [ f.to_mongo() for f in features ],
+        [ r.to_mongo() for r in results ],
+        plan.queries_saved - saved)
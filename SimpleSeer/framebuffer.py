@@ -0,0 +1,91 @@
+import threading
+
+class FrameBuffer(object):
+    """
+    A fixed-capacity ring of framesets (one list of Frames per capture), used
+    for SimpleSeer.lastframes.  Appending and indexing are O(1); once the
+    buffer is full each append overwrites the oldest frameset.
+
+    Besides the frameset count, the buffer can be limited to max_bytes of
+    (uncompressed) image data, in which case the oldest framesets are
+    evicted until the total fits.  The newest frameset is always kept.
+
+    Readers on other threads (the web process via Pyro, the motion plugin)
+    can index it directly, or call snapshot() for a stable tuple that won't
+    change under them while the capture thread keeps appending.
+
+    >>> buf = FrameBuffer(100)
+    >>> buf.append(SS.capture())
+    >>> buf[-1][0].image.show()
+    """
+
+    def __init__(self, capacity, max_bytes = 0):
+        if capacity < 1:
+            raise ValueError, 'FrameBuffer capacity must be at least 1'
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._slots = [None] * self.capacity
+            self._sizes = [0] * self.capacity
+            self._start = 0
+            self._len = 0
+            self.nbytes = 0
+
+    def append(self, frameset):
+        size = 0
+        if self.max_bytes:
+            size = frameset_bytes(frameset)
+        with self._lock:
+            if self._len == self.capacity:
+                self._evict()
+            slot = (self._start + self._len) % self.capacity
+            self._slots[slot] = frameset
+            self._sizes[slot] = size
+            self._len += 1
+            self.nbytes += size
+            while self.max_bytes and self.nbytes > self.max_bytes and self._len > 1:
+                self._evict()
+
+    def _evict(self):
+        self._slots[self._start] = None
+        self.nbytes -= self._sizes[self._start]
+        self._sizes[self._start] = 0
+        self._start = (self._start + 1) % self.capacity
+        self._len -= 1
+
+    def snapshot(self):
+        '''The framesets currently held, oldest first, as a tuple'''
+        with self._lock:
+            end = self._start + self._len
+            if end <= self.capacity:
+                return tuple(self._slots[self._start:end])
+            return tuple(
+                self._slots[self._start:] + self._slots[:end - self.capacity])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.snapshot()[index])
+        with self._lock:
+            if index < 0:
+                index += self._len
+            if index < 0 or index >= self._len:
+                raise IndexError, 'FrameBuffer index out of range'
+            return self._slots[(self._start + index) % self.capacity]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __repr__(self):
+        return '<FrameBuffer %d/%d framesets, %d bytes>' % (
+            self._len, self.capacity, self.nbytes)
+
+def frameset_bytes(frameset):
+    '''Approximate uncompressed size of a frameset's images (RGB)'''
+    return sum(f.width * f.height * 3 for f in frameset)
@@ -0,0 +1,207 @@
+import zlib
+import struct
+import logging
+from cStringIO import StringIO
+
+import numpy as np
+
+from SimpleCV import Image
+
+from .base import pil
+from .Session import Session
+
+log = logging.getLogger(__name__)
+
+try:
+    from turbojpeg import TurboJPEG
+    _turbojpeg = TurboJPEG()
+except Exception:
+    _turbojpeg = None
+
+try:
+    import lz4.block as _lz4
+except ImportError:
+    try:
+        import lz4 as _lz4
+    except ImportError:
+        _lz4 = None
+
+class Codec(object):
+    """
+    Turns a SimpleCV Image into bytes for storage and back, through PIL in
+    the image format called name (also what gets recorded on the Frame as
+    imgcodec).  The keyword parameters are passed to PIL's save, and kept in
+    self.params so the frame can record how it was encoded.  Subclasses set
+    name and content_type, and override encode and decode for what PIL
+    doesn't do (or does slowly).
+    """
+    name = None
+    content_type = 'application/octet-stream'
+    extension = 'bin'
+
+    def __init__(self, **params):
+        self.params = params
+
+    def encode(self, image):
+        s = StringIO()
+        image.getPIL().save(s, self.name, **self.params)
+        return s.getvalue()
+
+    def decode(self, data):
+        return Image(pil.open(StringIO(data)))
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.params)
+
+class JpegCodec(Codec):
+    '''JPEG, through libjpeg-turbo (PyTurboJPEG) when it is installed'''
+    name = 'jpeg'
+    content_type = 'image/jpeg'
+    extension = 'jpg'
+
+    def __init__(self, quality = 100, **params):
+        super(JpegCodec, self).__init__(quality = quality, **params)
+        self.quality = quality
+
+    def encode(self, image):
+        if _turbojpeg is not None:
+            # SimpleCV numpy arrays are RGB, indexed [x, y]; turbojpeg wants BGR [y, x]
+            bgr = np.ascontiguousarray(image.getNumpy()[:, :, ::-1].transpose(1, 0, 2))
+            return _turbojpeg.encode(bgr, quality = self.quality)
+        return super(JpegCodec, self).encode(image)
+
+    def decode(self, data):
+        if _turbojpeg is not None:
+            try:
+                bgr = _turbojpeg.decode(data)
+                return Image(bgr[:, :, ::-1].transpose(1, 0, 2))
+            except Exception:
+                # not a jpeg after all (frames saved before imgcodec existed
+                # may be anything PIL can read)
+                pass
+        return super(JpegCodec, self).decode(data)
+
+class PngCodec(Codec):
+    name = 'png'
+    content_type = 'image/png'
+    extension = 'png'
+
+    def __init__(self, compress_level = 6, **params):
+        super(PngCodec, self).__init__(compress_level = compress_level, **params)
+
+class WebpCodec(Codec):
+    '''WebP, if the installed PIL was built with it (KeyError if not)'''
+    name = 'webp'
+    content_type = 'image/webp'
+    extension = 'webp'
+
+    def __init__(self, quality = 80, **params):
+        super(WebpCodec, self).__init__(quality = quality, **params)
+
+class RawCodec(Codec):
+    '''The raw numpy pixels, optionally compressed with lz4 or zlib'''
+    name = 'raw'
+    content_type = 'application/x-seer-raw'
+    extension = 'raw'
+
+    def __init__(self, compress = 'lz4', **params):
+        if compress == 'lz4' and _lz4 is None:
+            log.warning('lz4 is not installed, using zlib for raw frames')
+            compress = 'zlib'
+        super(RawCodec, self).__init__(compress = compress, **params)
+        self.compress = compress
+
+    def encode(self, image):
+        return pack_array(image.getNumpy(), self.compress)
+
+    def decode(self, data):
+        return Image(unpack_array(data))
+
+CODECS = dict(
+    (cls.name, cls) for cls in (JpegCodec, PngCodec, WebpCodec, RawCodec))
+
+def get_codec(name, **params):
+    try:
+        cls = CODECS[name]
+    except KeyError:
+        raise ValueError, ('Codec not found: %s. Valid codecs: %r' %
+                           (name, CODECS.keys()))
+    return cls(**params)
+
+_camera_codecs = {}
+_codecs_cameras = None #the cameras config _camera_codecs was made from
+
+def codec_for_camera(camera):
+    """
+    The codec configured for the named camera, e.g.
+
+    "cameras": [ { "id": 0, "name": "Default Camera",
+                   "codec": { "name": "jpeg", "quality": 90 } } ]
+
+    Cameras without a codec keep the old behaviour, JPEG at quality 100.
+    Codecs are made once per camera, and again if the config is reloaded.
+    """
+    global _codecs_cameras
+    cameras = Session().cameras
+    if cameras is not _codecs_cameras:
+        _camera_codecs.clear()
+        _codecs_cameras = cameras
+    codec = _camera_codecs.get(camera)
+    if codec is None:
+        config = {}
+        for c in cameras or []:
+            if c.get('name') == camera:
+                config = dict(c.get('codec', {}))
+        codec = get_codec(config.pop('name', 'jpeg'), **config)
+        _camera_codecs[camera] = codec
+    return codec
+
+# Raw array format: magic, flags, dtype, shape, then the (maybe compressed)
+# buffer.  Decoding uncompressed data is a np.frombuffer, with no copy.
+_MAGIC = 'SSNP'
+_COMPRESSORS = { None: 0, 'zlib': 1, 'lz4': 2 }
+_DECOMPRESSORS = dict((v, k) for k, v in _COMPRESSORS.items())
+# the quickest compressor installed here
+FAST_COMPRESS = _lz4 is not None and 'lz4' or 'zlib'
+
+def pack_array(arr, compress = None):
+    arr = np.ascontiguousarray(arr)
+    dtype = arr.dtype.str
+    # the compressors read the array's buffer, without a copy
+    if compress == 'zlib':
+        data = zlib.compress(buffer(arr), 1)
+    elif compress == 'lz4':
+        data = _lz4.compress(buffer(arr))
+    else:
+        data = arr.tostring()
+    header = struct.pack(
+        '<4sBB%dsB%dQ' % (len(dtype), arr.ndim),
+        _MAGIC, _COMPRESSORS[compress], len(dtype), dtype, arr.ndim, *arr.shape)
+    return header + data
+
+def unpack_array(data):
+    '''The packed array, read-only and over data itself if not compressed'''
+    if not isinstance(data, str):
+        data = str(data)
+    try:
+        magic, compress, dtlen = struct.unpack_from('<4sBB', data)
+        if magic != _MAGIC:
+            raise ValueError, 'Not a packed array'
+        offset = 6
+        dtype = data[offset:offset + dtlen]
+        offset += dtlen
+        ndim, = struct.unpack_from('<B', data, offset)
+        offset += 1
+        shape = struct.unpack_from('<%dQ' % ndim, data, offset)
+    except struct.error:
+        raise ValueError, 'Not a packed array (too short)'
+    offset += 8 * ndim
+    compress = _DECOMPRESSORS[compress]
+    if compress is None:
+        return np.frombuffer(data, dtype, offset = offset).reshape(shape)
+    payload = data[offset:]
+    if compress == 'zlib':
+        payload = zlib.decompress(payload)
+    else:
+        payload = _lz4.decompress(payload)
+    return np.frombuffer(payload, dtype).reshape(shape)
@@ -0,0 +1,158 @@
+import os
+import mmap
+import errno
+import time
+import logging
+import threading
+
+from .Session import Session
+
+log = logging.getLogger(__name__)
+
+class SegmentStore(object):
+    """
+    Frame files (images, overlays, thumbnails) appended to segment files on
+    local disk, as an alternative to GridFS.  put() returns a ref, a dict of
+    (segment, offset, length, content_type) that the Frame keeps, so the
+    frame documents are the index; get() reads it back through a memory
+    map of the segment.
+
+    Segments are only ever appended to; once one is over segment_bytes a
+    new one is started.  Retention deletes whole segments (delete_before),
+    which is an unlink rather than a delete per frame.  Files are put in
+    segments of their kind (thumbnails apart from images and overlays, say)
+    so that segments can be deleted as soon as everything of their kind in
+    them is past retention, while other kinds are kept longer.
+
+    Configured with:
+
+    "image_store": { "backend": "segments", "path": "/var/lib/seer/segments",
+                     "segment_bytes": 268435456 }
+
+    Only one process (the core) should put(); any process can get().
+    """
+    name = 'segments'
+
+    def __init__(self, path, segment_bytes = 256 * 1024 * 1024):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._open = {} #kind -> (segment, file) being written to
+        self._sequence = 0
+
+    def _new_segment(self, kind):
+        segment, fp = self._open.get(kind, (None, None))
+        if fp is not None:
+            fp.close()
+        # named by creation time, so they sort oldest first, then by pid and
+        # a sequence number so that no two puts ever share a new segment
+        while True:
+            self._sequence += 1
+            segment = '%013d-%d-%d%s.seg' % (
+                int(time.time() * 1000), os.getpid(), self._sequence,
+                kind and '.' + kind)
+            try:
+                fd = os.open(os.path.join(self.path, segment),
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                continue
+            break
+        self._open[kind] = segment, os.fdopen(fd, 'ab')
+        return self._open[kind]
+
+    def put(self, data, content_type = None, kind = ''):
+        '''Append data to the current segment of kind, returning its ref'''
+        with self._lock:
+            segment, fp = self._open.get(kind, (None, None))
+            if fp is None or fp.tell() >= self.segment_bytes:
+                segment, fp = self._new_segment(kind)
+            offset = fp.tell()
+            fp.write(data)
+            fp.flush()
+            return dict(
+                store = self.name, segment = segment, offset = offset,
+                length = len(data), content_type = content_type)
+
+    def get(self, ref):
+        '''The bytes for ref, or None if its segment has been deleted'''
+        end = ref['offset'] + ref['length']
+        with self._lock:
+            mm = self._maps.get(ref['segment'])
+            if mm is None or len(mm) < end:
+                # not mapped yet, or mapped before this was appended
+                if mm is not None:
+                    mm.close()
+                try:
+                    with open(os.path.join(self.path, ref['segment']), 'rb') as fp:
+                        mm = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+                except (IOError, OSError, ValueError):
+                    self._maps.pop(ref['segment'], None)
+                    return None
+                self._maps[ref['segment']] = mm
+            return mm[ref['offset']:end]
+
+    def segments(self, kind = None):
+        '''(name, bytes, modified time) of each segment (of kind), oldest first'''
+        result = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith('.seg'):
+                continue
+            if kind is not None and segment_kind(name) != kind:
+                continue
+            st = os.stat(os.path.join(self.path, name))
+            result.append((name, st.st_size, st.st_mtime))
+        return result
+
+    def delete_before(self, cutoff, kind = ''):
+        """
+        Delete every segment of kind last written before cutoff (a unix
+        time), except the one being written to.  Returns the deleted
+        segments' names and the bytes reclaimed.
+        """
+        deleted, reclaimed = [], 0
+        writing = set(segment for segment, fp in self._open.values())
+        for name, size, mtime in self.segments(kind):
+            if mtime >= cutoff or name in writing:
+                continue
+            with self._lock:
+                mm = self._maps.pop(name, None)
+                if mm is not None:
+                    mm.close()
+            os.unlink(os.path.join(self.path, name))
+            deleted.append(name)
+            reclaimed += size
+        if deleted:
+            log.info('Deleted %d segments, %d bytes', len(deleted), reclaimed)
+        return deleted, reclaimed
+
+def segment_kind(name):
+    '''The kind of file a segment holds, from its name ('' for images)'''
+    parts = name[:-len('.seg')].split('.')
+    return len(parts) > 1 and parts[1] or ''
+
+_store = None
+
+def get_store():
+    """
+    The SegmentStore under the configured image_store path, for reading
+    frames that were saved to it, or None if there isn't one
+    """
+    global _store
+    config = Session().image_store or {}
+    if not config.get('path'):
+        return None
+    if _store is None:
+        _store = SegmentStore(
+            config['path'], config.get('segment_bytes', 256 * 1024 * 1024))
+    return _store
+
+def write_store():
+    '''The SegmentStore new frames go to, or None when they go to GridFS'''
+    if (Session().image_store or {}).get('backend', 'gridfs') != 'segments':
+        return None
+    return get_store()
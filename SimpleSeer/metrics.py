@@ -0,0 +1,154 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from .Session import Session
+
+class Histogram(object):
+    """
+    A fixed-bucket latency histogram.  Observing a value is a bisect and a
+    few additions, so it is cheap enough to leave on in the capture loop.
+    """
+    # bucket upper bounds, in seconds
+    buckets = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+        0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        '''Upper bound of the bucket holding the q-th quantile'''
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                if i < len(self.buckets):
+                    return self.buckets[i]
+                return self.max
+        return self.max
+
+    def __json__(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p95=self.quantile(0.95),
+            p99=self.quantile(0.99))
+
+class Metrics(object):
+    """
+    Process-wide timers and counters for the hot path.  Timers are
+    aggregated into Histograms; everything is published on the 'metrics.'
+    channel every metrics_interval seconds (see maybe_publish) and rendered
+    as text for the /metrics route.
+
+    with Metrics().timer('frame.save'):
+        frame.save()
+    Metrics().incr('frames')
+    """
+    __shared_state = { "initialized": False }
+
+    def __init__(self):
+        '''Yeah, it's a borg'''
+        self.__dict__ = self.__shared_state
+        if self.initialized: return
+        self.initialized = True
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.started = time.time()
+        self._last_publish = time.time()
+
+    def observe(self, name, seconds):
+        hist = self.timers.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self.timers.setdefault(name, Histogram())
+        hist.observe(seconds)
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        timer_start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - timer_start)
+
+    def snapshot(self):
+        return dict(
+            uptime=time.time() - self.started,
+            timers=dict(
+                (name, hist.__json__()) for name, hist in self.timers.items()),
+            counters=dict(self.counters))
+
+    def render(self, gauges=None):
+        """
+        The current metrics as text, one value per line, followed by
+        gauges: current values the caller has (queue depths, say), by name,
+        which may end in labels, as in 'capture.latency{camera="a"}'
+        """
+        lines = []
+        for name in sorted(self.timers):
+            hist = self.timers[name]
+            name = 'seer_' + name.replace('.', '_')
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append('%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (name, hist.count))
+            lines.append('%s_sum %f' % (name, hist.sum))
+            lines.append('%s_count %d' % (name, hist.count))
+        for name in sorted(self.counters):
+            lines.append('seer_%s %s' % (
+                    name.replace('.', '_'), self.counters[name]))
+        for name in sorted(gauges or {}):
+            base, brace, labels = name.partition('{')
+            lines.append('seer_%s%s%s %s' % (
+                    base.replace('.', '_'), brace, labels, gauges[name]))
+        return '\n'.join(lines) + '\n'
+
+    def maybe_publish(self):
+        '''Publish a snapshot if metrics_interval seconds have passed'''
+        interval = Session().metrics_interval or 10
+        now = time.time()
+        if now - self._last_publish < interval:
+            return
+        self._last_publish = now
+        from .realtime import ChannelManager
+        ChannelManager().publish('metrics.', self.snapshot())
+
+def timed(name):
+    '''Decorator that records every call of the function under name'''
+    def decorator(func):
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            timer_start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                Metrics().observe(name, time.time() - timer_start)
+        return decorated_function
+    return decorator
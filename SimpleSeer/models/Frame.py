@@ -1,6 +1,12 @@
+import time
+import threading
 from cStringIO import StringIO
+from collections import OrderedDict
 
+import bson
+import gridfs
 import mongoengine
+from mongoengine.fields import GridFSProxy
 
 from SimpleSeer.base import Image, pil, pygame
 from SimpleSeer import util
@@ -13,9 +19,20 @@ from .base import SimpleDoc
 from .FrameFeature import FrameFeature
 from .Result import Result, ResultEmbed
 from .. import realtime
+from ..Session import Session
 from ..util import LazyProperty
+from ..metrics import timed
+from ..imagecodec import get_codec, codec_for_camera
+from .. import overlay
+from .. import imagestore
+from ..partition import get_router, register_indexes
+from ..spatial import FeatureIndex
 
 
+# (frame id, width) -> scaled Image, for Frame.image_at
+_scaled_cache = OrderedDict()
+_scaled_lock = threading.Lock()
+
 class FrameSchema(fes.Schema):	
     camera = fev.UnicodeString(not_empty=True)
 	#TODO, make this feasible as a formencode schema for upload
@@ -23,6 +40,13 @@ class FrameSchema(fes.Schema):
 
 
 
+FRAME_INDEXES = [
+    "capturetime", ('camera', '-capturetime'),
+    # for Frame.search
+    ('results.inspection_id', '-capturetime'),
+    ('results.measurement_id', '-capturetime'),
+    ('features.featuretype', '-capturetime')]
+
 class Frame(SimpleDoc, mongoengine.Document):
     """
         Frame Objects are a mongo-friendly wrapper for SimpleCV image objects,
@@ -33,30 +57,57 @@ class Frame(SimpleDoc, mongoengine.Document):
         >>> f = SimpleSeer.capture()[0]  #get a frame from the SimpleSeer module
         >>> f.image.dl().line((0,0),(100,100))
         >>> f.save()
-        >>> 
+        >>> f.render().show() #the image with its drawing layers
     """
     capturetime = mongoengine.DateTimeField()
     camera = mongoengine.StringField()
     features = mongoengine.ListField(mongoengine.EmbeddedDocumentField(FrameFeature))
     results = mongoengine.ListField(mongoengine.EmbeddedDocumentField(ResultEmbed))
+    passed = mongoengine.BooleanField(default = True) #False if any watcher fired
     #features     
     
     height = mongoengine.IntField(default = 0)
     width = mongoengine.IntField(default = 0)
     imgfile = mongoengine.FileField()
+    imgcodec = mongoengine.StringField() #None for frames saved as JPEG before codecs
+    imgcodec_params = mongoengine.DictField()
+    #the stored image is this fraction of width x height (the overload
+    #thumbnails policy); unset if it was saved full size
+    imgscale = mongoengine.FloatField()
     layerfile = mongoengine.FileField()
+    imgref = mongoengine.DictField() #set instead of imgfile with the segment store
+    layerref = mongoengine.DictField()
     thumbnail_file = mongoengine.FileField()
+    thumbnails = mongoengine.DictField() #width -> GridFS id or segment ref, built in save
+    partition = mongoengine.StringField() #time partition holding the frame, if any
     _imgcache = ''
+    _encoded = None
+    _save_width = None #save the image scaled down to this width, if set
+    _inserting = False #given an id by bulk_save, but not yet written
+    _rendered = False
+    _feature_index = None
+
+    # what the frame listings load: summary is enough for a gallery (and
+    # never touches the features), results adds the results, full is
+    # everything
+    PROJECTIONS = dict(
+        summary = ('camera', 'capturetime', 'passed', 'thumbnails'),
+        results = ('camera', 'capturetime', 'passed', 'thumbnails', 'results'),
+        full = None)
 
     meta = {
-        'indexes': ["capturetime", ('camera', '-capturetime')]
+        'indexes': FRAME_INDEXES
     }
 
     @LazyProperty
     def thumbnail(self):
+        if self.thumbnails:
+            smallest = min(int(w) for w in self.thumbnails)
+            return Image(pil.open(StringIO(self.thumbnail_data(smallest))))
         if self.thumbnail_file.grid_id is None:
-            img = self.image
-            thumbnail_img = img.scale(140.0 / img.height)
+            thumbnail_img = self.image_at(self.height and 140 * self.width / self.height)
+            if thumbnail_img.height > 140:
+                thumbnail_img = thumbnail_img.scale(140.0 / thumbnail_img.height)
             img_data = StringIO()
             thumbnail_img.save(img_data, "jpeg", quality = 25)
             self.thumbnail_file.put(img_data.getvalue(), content_type='image/jpeg')
@@ -70,118 +121,463 @@ class Frame(SimpleDoc, mongoengine.Document):
         if self._imgcache != '':
             return self._imgcache
 
-        self.imgfile.get().seek(0,0) #hackity hack, make sure the FP is at 0
-        if self.imgfile != None:
+        data = self.image_data()
+        if data is not None:
             try:
-                self._imgcache = Image(pil.open(StringIO(self.imgfile.read())))
+                self._imgcache = self.codec.decode(data)
             except (IOError, TypeError): # pragma no cover
                 self._imgcache = None
+            img = self._imgcache
+            if (self.imgscale and img is not None and self.width
+                and img.width != self.width):
+                # back to the size features and overlays were drawn at
+                self._imgcache = img.resize(self.width, self.height)
         else: # pragma no cover
             self._imgcache = None
 
+        return self._imgcache
 
-        if self.layerfile:
-            self.layerfile.get().seek(0,0)
-            self._imgcache.dl()._mSurface = pygame.image.fromstring(self.layerfile.read(), self._imgcache.size(), "RGBA")
+    def _fs(self):
+        '''The GridFS bucket for this frame's files'''
+        if self.partition:
+            return gridfs.GridFS(self._get_db(), 'fs_' + self.partition)
+        return self.imgfile.fs
 
-        return self._imgcache
+    def _grid_file(self, gridfile):
+        if not gridfile:
+            return None
+        return self._fs().get(gridfile.grid_id)
+
+    def _read(self, ref, gridfile):
+        '''The bytes at a segment store ref, or else in the GridFS file'''
+        if ref:
+            store = imagestore.get_store()
+            return store and store.get(ref)
+        grid_out = self._grid_file(gridfile)
+        return grid_out and grid_out.read()
+
+    def image_data(self):
+        '''The encoded image, from whichever store it was saved to'''
+        return self._read(self.imgref, self.imgfile)
 
     @image.setter
     def image(self, value):
         self.width, self.height = value.size()
         self._imgcache = value
+        self._rendered = True
+
+    def image_at(self, max_width):
+        '''
+        The image (without drawing layers) scaled down to at most max_width.
+        JPEGs are decoded straight to about that size with PIL's draft mode
+        instead of decoding the whole frame and scaling it.  The last
+        scaled_cache_size results are kept, so display paths asking for the
+        same frame at the same size don't decode it again.
+        '''
+        if not max_width or (self.width and max_width >= self.width):
+            return self.image
+        key = (self.id, max_width)
+        if self.id is not None:
+            with _scaled_lock:
+                img = _scaled_cache.pop(key, None)
+                if img is not None:
+                    _scaled_cache[key] = img
+                    return img
+
+        data = None
+        if self._imgcache == '':
+            data = self.image_data()
+        if data is None:
+            img = self.image
+        elif (self.imgcodec or 'jpeg') == 'jpeg':
+            pil_img = pil.open(StringIO(data))
+            pil_img.draft('RGB', (max_width, max_width * pil_img.size[1] / pil_img.size[0]))
+            img = Image(pil_img)
+        else:
+            img = self.codec.decode(data)
+        if img is None:
+            return None
+        if img.width > max_width:
+            img = img.scale(max_width / float(img.width))
+
+        if self.id is not None:
+            size = Session().scaled_cache_size or 16
+            with _scaled_lock:
+                _scaled_cache[key] = img
+                while len(_scaled_cache) > size:
+                    _scaled_cache.popitem(last = False)
+        return img
+
+    def render(self):
+        '''
+        The image with its drawing layers.  Saved overlays are only
+        rasterized here, the first time they are asked for.
+        '''
+        img = self.image
+        if not self._rendered and img is not None:
+            if self.layerref:
+                data = self._read(self.layerref, None)
+                content_type = self.layerref['content_type']
+            else:
+                grid_out = self._grid_file(self.layerfile)
+                data = grid_out and grid_out.read()
+                content_type = grid_out and grid_out.content_type
+            if data is not None:
+                for layer in overlay.layers(data, img.size(), content_type):
+                    img.addDrawingLayer(layer)
+        self._rendered = True
+        return img
+
+    def thumbnail_data(self, width):
+        '''
+        JPEG bytes of the stored thumbnail closest to width (the smallest
+        one at least that wide, else the largest), or None if there are none
+        '''
+        if not self.thumbnails:
+            return None
+        widths = sorted(int(w) for w in self.thumbnails)
+        fits = [ w for w in widths if w >= width ]
+        width = fits and fits[0] or widths[-1]
+        ref = self.thumbnails[str(width)]
+        if isinstance(ref, dict):
+            return self._read(ref, None)
+        return self._fs().get(ref).read()
+
+    def __getstate__(self):
+        ret = super(Frame, self).__getstate__()
+        ret['thumbnails'] = dict(
+            (w, '/grid/thumbnails/%s/%s' % (self.id, w))
+            for w in self.thumbnails or {})
+        return ret
+
+    def state(self, projection = 'full'):
+        """
+        The frame's JSON state with only the fields of the named projection
+        (see PROJECTIONS), plus the URL of its smallest thumbnail.
+        """
+        fields = self.projection_fields(projection)
+        if fields is None:
+            return self.__getstate__()
+        width = min([ int(w) for w in self.thumbnails or {} ] or [ 140 ])
+        ret = dict(
+            id = self.id, camera = self.camera,
+            capturetime = self.capturetime and int(
+                time.mktime(self.capturetime.timetuple())
+                + self.capturetime.microsecond / 1e6),
+            passed = self.passed,
+            thumbnail = '/grid/thumbnails/%s/%d' % (self.id, width))
+        if 'results' in fields:
+            ret['results'] = [ r.__getstate__() for r in self.results ]
+        return ret
+
+    @property
+    def codec(self):
+        '''The codec imgfile was encoded with'''
+        return get_codec(self.imgcodec or 'jpeg', **(self.imgcodec_params or {}))
        
     def __repr__(self): # pragma no cover
        return "<SimpleSeer Frame Object %d,%d captured with '%s' at %s>" % (
             self.width, self.height, self.camera, self.capturetime.ctime()) 
         
+    @timed('frame.save')
     def save(self, *args, **kwargs):
         #TODO: sometimes we want a frame with no image data, basically at this
         #point we're trusting that if that were the case we won't call .image
         realtime.ChannelManager().publish('frame.', self)
 
-        if self._imgcache != '':
-            s = StringIO()
-            img = self._imgcache
-            img.getPIL().save(s, "jpeg", quality = 100)
-            self.imgfile.delete()
-            self.imgfile.put(s.getvalue(), content_type = "image/jpg")
-          
-            if len(img._mLayers):
-                if len(img._mLayers) > 1:
-                    mergedlayer = DrawingLayer(img.size())
-                    for layer in img._mLayers[::-1]:
-                        layer.renderToOtherLayer(mergedlayer)
-                else:
-                    mergedlayer = img.dl()
-                self.layerfile.delete()
-                self.layerfile.put(pygame.image.tostring(mergedlayer._mSurface, "RGBA"))
-                #TODO, make layerfile a compressed object
-            #self._imgcache = ''
-
-        super(Frame, self).save(*args, **kwargs)
+        if self._encoded is None:
+            self._encode()
+        self._set_partition()
+        self._put_files()
+
+        if self.partition:
+            if self.id is None:
+                self.id = bson.ObjectId()
+            self._collection().save(self.to_mongo(), safe = kwargs.get('safe', True))
+        else:
+            super(Frame, self).save(*args, **kwargs)
         
-        #TODO, this is sloppy -- we should handle this with cascading saves
-        #or some other mechanism
-        for r in self.results:
-            result,created = Result.objects.get_or_create(auto_save=False, id=r.result_id)
-            result.capturetime = self.capturetime
-            result.camera = self.camera
-            result.frame = self.id
-            result.inspection = r.inspection_id
-            result.measurement = r.measurement_id
-            result.string = r.string
-            result.numeric = r.numeric
-            result.save(*args, **kwargs)
+        self._save_results(*args, **kwargs)
+        self._encoded = None
+
+    def _encode(self, max_width = None):
+        """
+        Encode the in-memory image (and any drawing layers) ready for
+        _put_files.  This is pure CPU work, with no database access, so
+        FrameWriter runs it on a pool.
+
+        With max_width (or _save_width, which the overload thumbnails
+        policy sets), the image is saved scaled down to at most that wide
+        and imgscale records by how much; width, height and the overlay
+        stay at full size.  The frame's own image, which lastframes may
+        still be showing, is left as it is.
+        """
+        self._encoded = None
+        if self._imgcache == '':
+            return
+        max_width = max_width or self._save_width
+        img = self.render() #so a reloaded frame keeps its layers
+        saved = img
+        self.imgscale = None
+        if max_width and img.width > max_width:
+            saved = img.scale(max_width / float(img.width))
+            self.imgscale = saved.width / float(img.width)
+        codec = codec_for_camera(self.camera)
+        self.imgcodec = codec.name
+        self.imgcodec_params = dict(codec.params)
+        self._encoded = dict(
+            img = codec.encode(saved), content_type = codec.content_type,
+            layer = overlay.encode(img),
+            thumbnails = self._encode_thumbnails(img))
+
+    def _encode_thumbnails(self, img):
+        '''JPEGs of the image scaled to each of the configured thumbnail widths'''
+        thumbnails = {}
+        jpeg = get_codec('jpeg', quality = Session().thumbnail_quality or 75)
+        for width in Session().thumbnails or []:
+            if width < img.width:
+                thumbnails[str(width)] = jpeg.encode(img.scale(width / float(img.width)))
+        return thumbnails
+
+    def _set_partition(self):
+        '''New frames go to the time partition for their capturetime, if any'''
+        router = get_router()
+        if router is not None and self.id is None and not self.partition:
+            self.partition = router.suffix(self.capturetime)
+
+    def _put_files(self):
+        """
+        Store what _encode() made.  The encoding is kept, marked as stored,
+        until the frame itself has been written, so saving again after a
+        failed write doesn't store the files a second time.
+        """
+        encoded = self._encoded
+        if not encoded or encoded.get('stored'):
+            return
+        store = imagestore.write_store()
+        if store is not None:
+            self._put_grid('imgfile')
+            self.imgref = store.put(encoded['img'], encoded['content_type'])
+        else:
+            self.imgref = {}
+            self._put_grid('imgfile', encoded['img'], encoded['content_type'])
+        if encoded['layer'] is not None:
+            if store is not None:
+                self._put_grid('layerfile')
+                self.layerref = store.put(encoded['layer'], overlay.CONTENT_TYPE)
+            else:
+                self.layerref = {}
+                self._put_grid('layerfile', encoded['layer'], overlay.CONTENT_TYPE)
+        self.delete_thumbnails()
+        for width, data in encoded['thumbnails'].items():
+            if store is not None:
+                # apart from the images, which retention deletes sooner
+                self.thumbnails[width] = store.put(data, 'image/jpeg', 'thumbnails')
+            else:
+                self.thumbnails[width] = self._fs().put(data, content_type = 'image/jpeg')
+        encoded['stored'] = True
+        #self._imgcache = ''
+
+    def _put_grid(self, field, data = None, content_type = None):
+        '''Replace the GridFS file in field (imgfile, layerfile) with data, if any'''
+        fs = self._fs()
+        proxy = getattr(self, field)
+        if proxy:
+            fs.delete(proxy.grid_id)
+        grid_id = None
+        if data is not None:
+            grid_id = fs.put(data, content_type = content_type)
+        setattr(self, field, GridFSProxy(
+                grid_id = grid_id, key = field, instance = self,
+                collection_name = self.partition and 'fs_' + self.partition or 'fs'))
+
+    def _collection(self):
+        '''The collection holding this frame: its partition's, or the usual one'''
+        if self.partition:
+            router = get_router()
+            if router is not None:
+                return router.collection('frame', self.partition)
+            return self._get_db()['frame_' + self.partition]
+        return self._get_collection()
+
+    def delete(self, safe = False):
+        if self.partition:
+            self._collection().remove({ '_id': self.id }, safe = safe)
+        else:
+            super(Frame, self).delete(safe = safe)
+
+    def delete_thumbnails(self):
+        for ref in self.thumbnails.values():
+            if not isinstance(ref, dict): #segments go with retention
+                self._fs().delete(ref)
+        self.thumbnails = {}
+
+    def _save_results(self, *args, **kwargs):
+        Result.bulk_save(self._result_docs(), safe = kwargs.get('safe', True))
+
+    def _result_docs(self):
+        '''A Result document for each of the frame's ResultEmbeds'''
+        results = [
+            Result(
+                id = r.result_id,
+                capturetime = self.capturetime,
+                camera = self.camera,
+                frame = self.id,
+                inspection = r.inspection_id,
+                measurement = r.measurement_id,
+                string = r.string,
+                numeric = r.numeric)
+            for r in self.results ]
+        for result in results:
+            result._partition = self.partition
+        return results
+
+    @classmethod
+    def bulk_save(cls, frames):
+        """
+        Save a batch of frames with one insert for all the new ones.  Images
+        are encoded here unless _encode() has already been run on them.
+
+        If the save fails part way it can be run again on the same frames:
+        files already stored aren't stored again, and new frames are still
+        inserted, not saved one by one (any that made it in the first time
+        are skipped).
+        """
+        new = {}
+        for frame in frames:
+            realtime.ChannelManager().publish('frame.', frame)
+            if frame._encoded is None:
+                frame._encode()
+            frame._set_partition()
+            frame._put_files()
+            if frame.id is None:
+                frame.id = bson.ObjectId()
+                frame._inserting = True
+            if frame._inserting:
+                new.setdefault(frame.partition, []).append(frame)
+            elif frame.partition:
+                frame._collection().save(frame.to_mongo(), safe = False)
+            else:
+                super(Frame, frame).save(safe = False)
+        for batch in new.values():
+            batch[0]._collection().insert(
+                [ frame.to_mongo() for frame in batch ], safe = False,
+                continue_on_error = True)
+        Result.bulk_save(
+            [ r for frame in frames for r in frame._result_docs() ], safe = False)
+        for frame in frames:
+            frame._encoded = None
+            frame._inserting = False
         
     def serialize(self):
         s = StringIO()
         try:
-            self.image.save(s, "webp", quality = 80)
+            self.render().save(s, "webp", quality = 80)
             return dict(
                 content_type='image/webp',
                 data=s.getvalue())
         except KeyError:
-            self.image.save(s, "jpeg", quality = 80)
+            self.render().save(s, "jpeg", quality = 80)
             return dict(
                 content_type='image/jpeg',
                 data=s.getvalue())
 
-    @classmethod
-    def search(cls, filters, sorts, skip, limit):
-        db = cls._get_db()
-        # Use the agg fmwk to generate frame ids
-        pipeline = [
-            # initial match to reduce number of frames to search
-            {'$match': filters },
-            # unwind features and results so we can do complex queries
-            # against a *single* filter/result
-            {'$unwind': '$features'},
-            {'$unwind': '$results' },
-            # Re-run the queries
-            {'$match': filters },
-            {'$sort': sorts },
-            {'$project': {'_id': 1} }]
-        cmd = db.command('aggregate', 'frame', pipeline=pipeline)
-        total_frames = len(cmd['result'])
-        seen = set()
-        ids = []
-        # We have to do skip/limit in Python so we can skip over duplicate frames
-        for doc in cmd['result']:
-            id = doc['_id']
-            if id in seen: continue
-            seen.add(id)
-            if skip > 0:
-                skip -= 1
+    def feature_index(self, cell = 64):
+        """
+        A spatial.FeatureIndex over this frame's features, for finding the
+        features at a point (a click) or in a region without testing every
+        one.  Built once and kept until the features change.
+        """
+        index = self._feature_index
+        if (index is None or index.cell != cell
+            or len(index.features) != len(self.features)
+            or any(a is not b for a, b in zip(index.features, self.features))):
+            index = self._feature_index = FeatureIndex(self.features, cell)
+        return index
+
+    @staticmethod
+    def search_query(filters):
+        """
+        The /frames filters as a frame query.  Conditions on the fields of
+        features (or of results) are gathered into one $elemMatch, so they
+        must all hold for the same feature, as they did when search unwound
+        the lists.  An empty capturetime range is dropped.
+        """
+        query, elems = {}, {}
+        for key, value in (filters or {}).items():
+            head, _, rest = key.partition('.')
+            if head in ('features', 'results') and rest:
+                elems.setdefault(head, {})[rest] = value
+            elif key == 'capturetime' and not value:
                 continue
-            ids.append(id)
-            if len(ids) >= limit: break
-        frames = cls.objects.filter(id__in=ids)
-        frame_index = dict(
-            (f.id, f) for f in frames)
-        chosen_frames = []
-        for id in ids:
-            frame = frame_index.get(id)
-            if frame is None: continue
-            chosen_frames.append(frame)
+            else:
+                query[key] = value
+        for head, match in elems.items():
+            query[head] = { '$elemMatch': match }
+        return query
+
+    @classmethod
+    def by_id(cls, id, projection = 'full'):
+        '''The frame with this id, from whichever partition holds it'''
+        return cls.by_ids([ id ], projection)[0]
+
+    @classmethod
+    def by_ids(cls, ids, projection = 'full'):
+        """
+        The frames with these ids, in the same order (None for any that
+        aren't there), from whichever partitions hold them
+        """
+        ids = [ bson.ObjectId(id) for id in ids ]
+        fields = cls.projection_fields(projection)
+        router = get_router()
+        if router is None:
+            found = cls.objects(id__in = ids)
+            if fields is not None:
+                found = found.only(*fields)
+            index = dict((f.id, f) for f in found)
+        else:
+            docs = router.find_ids('frame', ids, fields)
+            index = dict((id, cls._from_son(doc)) for id, doc in docs.items())
+        return [ index.get(id) for id in ids ]
+
+    @classmethod
+    def projection_fields(cls, projection):
+        '''The fields a named projection loads, None for all of them'''
+        try:
+            return cls.PROJECTIONS[projection]
+        except KeyError:
+            raise ValueError, ('Unknown projection %s, use one of %r' %
+                               (projection, sorted(cls.PROJECTIONS)))
+
+    @classmethod
+    def search(cls, filters, sorts, skip, limit, projection = 'full'):
+        """
+        Frames matching filters, with the sort, skip and limit done by
+        mongo.  Each frame matches once, so the total is the number of
+        distinct frames.  Only the fields of the named projection are
+        loaded.  Returns (total, frames).
+        """
+        query = cls.search_query(filters)
+        fields = cls.projection_fields(projection)
+        if isinstance(sorts, dict):
+            sorts = sorts.items()
+        router = get_router()
+        if router is not None:
+            if fields is not None:
+                fields = list(fields) + [ key for key, direction in sorts ]
+            total_frames, docs = router.find(
+                'frame', query, list(sorts), skip, limit, fields)
+            return total_frames, [ cls._from_son(doc) for doc in docs ]
+        cursor = cls._get_collection().find(query, fields=['_id'])
+        if sorts:
+            cursor = cursor.sort(list(sorts))
+        total_frames = cursor.count()
+        ids = [ doc['_id'] for doc in cursor.skip(skip).limit(limit) ]
+        found = cls.objects(id__in=ids)
+        if fields is not None:
+            found = found.only(*fields)
+        frame_index = dict((f.id, f) for f in found)
+        chosen_frames = [ frame_index[id] for id in ids if id in frame_index ]
         return total_frames, chosen_frames
+
+register_indexes('frame', FRAME_INDEXES)
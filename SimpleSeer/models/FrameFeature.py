@@ -1,9 +1,10 @@
+import logging
 import cPickle as pickle
 from cStringIO import StringIO
 from binascii import b2a_base64, a2b_base64
-from copy import deepcopy
 
 import cv
+import bson
 import numpy as np
 import mongoengine
 import mongoengine.base
@@ -12,13 +13,33 @@ import SimpleCV
 
 from .base import SimpleEmbeddedDoc, SONScrub
 from SimpleSeer.base import mebasedict_handle, mebaselist_handle
+from SimpleSeer.imagecodec import pack_array, unpack_array, FAST_COMPRESS
+from SimpleSeer.spatial import points_in_polygon
+
+log = logging.getLogger(__name__)
+
+# arrays bigger than this are compressed when saved
+NUMPY_COMPRESS_BYTES = 64 * 1024
 
 def _numpy_save(son, collection):
-    sio = StringIO()
-    np.save(sio, son)
-    return sio.getvalue()
+    if son.dtype.hasobject:
+        # no raw buffer to save; np.save pickles them
+        sio = StringIO()
+        np.save(sio, son)
+        return sio.getvalue()
+    if son.nbytes > NUMPY_COMPRESS_BYTES:
+        return pack_array(son, FAST_COMPRESS)
+    return pack_array(son)
 
 def _numpy_load(son, collection):
+    """
+    Packed arrays are read-only views of the saved bytes; anything else
+    was saved with np.save, as arrays used to be.
+    """
+    try:
+        return unpack_array(son)
+    except ValueError:
+        pass
     sio = StringIO(son)
     return np.load(sio)
 
@@ -30,14 +51,93 @@ SONScrub.register_bintype(np.ndarray, _numpy_save, _numpy_load)
 # matrices are instances of np.ndarray, no need to register them again
 # SONScrub.register_bintype(np.matrix, _numpy_save, _numpy_load)
 
+def _pack(value):
+    """
+    Numeric lists and lists of points (1-d, or N x 2) as a packed array in
+    a BSON Binary.  Other lists (of contours, even if they all happen to
+    be the same length) are packed item by item, and anything else is
+    returned as it is.
+    """
+    if isinstance(value, bson.Binary):
+        return value
+    try:
+        arr = np.asarray(value)
+    except ValueError:
+        arr = None
+    if arr is not None and not (
+        arr.ndim <= 1 or (arr.ndim == 2 and arr.shape[1] == 2)):
+        arr = None
+    if arr is not None and arr.dtype.kind in 'iuf':
+        if (arr.dtype.kind in 'iu' and arr.size
+            and arr.min() >= -2**31 and arr.max() < 2**31):
+            arr = arr.astype(np.int32)
+        return bson.Binary(pack_array(arr))
+    if isinstance(value, (list, tuple)):
+        return [ _pack(v) for v in value ]
+    return value
+
+def _aslist(arr):
+    '''An array as a list, of point tuples if it is 2-d'''
+    if arr.ndim == 1:
+        return arr.tolist()
+    return [ tuple(row) for row in arr.tolist() ]
+
+def _plain(value):
+    '''value with packed arrays unpacked and numpy scalars as numbers'''
+    if isinstance(value, bson.Binary):
+        try:
+            return _aslist(unpack_array(value))
+        except ValueError:
+            return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, list):
+        return [ _plain(v) for v in value ]
+    if isinstance(value, tuple):
+        return tuple(_plain(v) for v in value)
+    if isinstance(value, dict):
+        return dict((k, _plain(v)) for k, v in value.items())
+    return value
+
+def _feature_class(name):
+    '''The SimpleCV.Feature subclass (plugins' included) called name'''
+    classes = [ SimpleCV.Feature ]
+    while classes:
+        cls = classes.pop()
+        if cls.__name__ == name:
+            return cls
+        classes.extend(cls.__subclasses__())
+    return None
+
+class PackedArrayField(mongoengine.base.BaseField):
+    """
+    A numeric array (a list of points, say), stored as a packed array in
+    a BSON Binary and read back as a numpy array over the stored bytes.
+    Plain lists, as saved before, are read back as they are.
+    """
+
+    def to_mongo(self, value):
+        if value is None:
+            return None
+        return _pack(value)
+
+    def to_python(self, value):
+        if isinstance(value, bson.Binary):
+            return unpack_array(value)
+        return value
+
+    def validate(self, value):
+        pass
+
 class FrameFeature(SimpleEmbeddedDoc, mongoengine.EmbeddedDocument):
 
     featuretype = mongoengine.StringField()
     featuredata = mongoengine.DictField()  #this holds any type-specific feature data
-    # featurepickle = mongoengine.BinaryField() #a pickle of the feature, for
-    # rendering out
-    featurepickle_b64 = mongoengine.StringField() #a pickle of the feature, for rendering out
-    _featurebuffer = ''
+    #a pickle of the feature, only kept if the plugin asks for it
+    featurepickle = mongoengine.BinaryField()
+    #how the pickle was kept before migrate_features
+    featurepickle_b64 = mongoengine.StringField()
+    _featurecache = None
     #this is incredibly sloppy, really -- but we're going to get away with it
     #because features are essentially immutable
     
@@ -46,7 +146,7 @@ class FrameFeature(SimpleEmbeddedDoc, mongoengine.EmbeddedDocument):
     
     #feature attributes need to be in this list to be queryable
     #note that plugins can inject into this
-    points = mongoengine.ListField()
+    points = PackedArrayField()
     x = mongoengine.FloatField()
     y = mongoengine.FloatField()
     area = mongoengine.FloatField()
@@ -58,75 +158,140 @@ class FrameFeature(SimpleEmbeddedDoc, mongoengine.EmbeddedDocument):
     #these are feature properties which are not saved
     #note that plugins can inject into this
     featuredata_mask = set(['image'])
-    
+
+    #these are saved as packed arrays
+    #note that plugins can inject into this
     cleanse_mask = set([
         'mContour', 'mContourAppx', 'mConvexHull', 'mHoleContour',
         'mVertEdgeHist'])
 
-    @property
-    def featurepickle(self):
-        return a2b_base64(self.featurepickle_b64)
-    
-    @featurepickle.setter
-    def featurepickle(self, value):
-        self.featurepickle_b64 = b2a_base64(value)
-    
+    #feature class -> { attribute: converter, or None to skip it }, made by
+    #setFeature as it meets each class, so the masks above must be
+    #injected before features are set
+    _plans = {}
+
     #this converts a SimpleCV Feature object into a FrameFeature
     #clean this up a bit
-    def setFeature(self, data):
+    def setFeature(self, data, keep_pickle = False):
+        """
+        Copy a SimpleCV feature onto this FrameFeature.  Points and the
+        cleanse_mask contours are kept as packed arrays, numpy scalars as
+        plain numbers.  The feature is only pickled with keep_pickle, for
+        plugins whose features can't be rebuilt from their attributes.
+
+        Which attributes go to featuredata is planned once per feature
+        class (see _extend_plan); points are kept as they are, and only
+        packed when the frame is saved.
+        """
         self._featurecache = data
         self.x = int(data.x)
         self.y = int(data.y)
-        self.points = deepcopy(data.points)
+        self.points = data.points
 
         self.area = data.area()
         self.width = data.width()
         self.height = data.height()
         self.angle = data.angle()
 
-        self.meancolor = data.meanColor()
+        self.meancolor = _plain(data.meanColor())
         self.featuretype = data.__class__.__name__
-        
-        data.image = ''
-        self.featurepickle = pickle.dumps(data)
 
-        
+        if keep_pickle:
+            image, data.image = data.image, ''
+            try:
+                self.featurepickle = pickle.dumps(data, protocol = -1)
+            finally:
+                data.image = image
+
+        plan = self._plans.get(data.__class__)
+        if plan is None:
+            plan = self._plans[data.__class__] = {}
+        attrs = data.__dict__
+        for k in attrs:
+            if k not in plan:
+                self._extend_plan(plan, data)
+                break
+
+        featuredata = {}
+        for k, v in attrs.iteritems():
+            convert = plan[k]
+            if convert is not None:
+                featuredata[k] = convert(v)
+        self.featuredata = featuredata
 
-        datadict = {}
+    def _extend_plan(self, plan, data):
+        """
+        Work out where each of data's attributes not yet in plan goes: a
+        converter (_pack for the cleanse_mask contours, _plain for the rest
+        of featuredata) or None to skip it.  Attributes the class leaves out
+        of its __getstate__, the featuredata_mask, our own fields and
+        underscored ones are skipped.
+        """
+        state = data.__dict__
         if hasattr(data, "__getstate__"):
-            datadict = data.__getstate__()
-        else:
-            datadict = data.__dict__
-        
-        for k in datadict:
-            if k in self.featuredata_mask or hasattr(self, k) or k[0] == "_":
+            state = data.__getstate__()
+        for k in data.__dict__:
+            if k in plan:
                 continue
-                            
-            value = getattr(data, k)
-            if k in self.cleanse_mask:
-                self.featuredata[k] = value
-                continue
-            
-            #here we need to handle all the cases for odd bits of data
-            self.featuredata[k] = value
+            if (k not in state or k in self.featuredata_mask
+                or hasattr(self, k) or k[0] == "_"):
+                plan[k] = None
+            elif k in self.cleanse_mask:
+                plan[k] = _pack
+            else:
+                #here we need to handle all the cases for odd bits of data
+                plan[k] = _plain
             
     @property
     def feature(self):
-        if not self._featurebuffer:
-            self._featurebuffer = pickle.loads(self.featurepickle)
-        return self._featurebuffer
+        """
+        The SimpleCV feature: the one given to setFeature, else its pickle,
+        else one rebuilt from featuredata (without an image)
+        """
+        if self._featurecache is None:
+            self._featurecache = self._rehydrate()
+        return self._featurecache
+
+    def _rehydrate(self):
+        data = self.featurepickle
+        if not data and self.featurepickle_b64:
+            data = a2b_base64(self.featurepickle_b64)
+        if data:
+            return pickle.loads(str(data))
+        cls = _feature_class(self.featuretype)
+        if cls is None:
+            raise ValueError, 'Unknown feature type %s' % self.featuretype
+        state = dict(
+            (str(k), _plain(v)) for k, v in self.featuredata.items())
+        state.update(
+            x = self.x, y = self.y, points = self.plainpoints, image = None)
+        feature = cls.__new__(cls)
+        if hasattr(feature, '__setstate__'):
+            feature.__setstate__(state)
+        else:
+            feature.__dict__.update(state)
+        return feature
+
+    @property
+    def plainpoints(self):
+        '''points as a list of tuples, however they were loaded'''
+        if isinstance(self.points, np.ndarray):
+            return _aslist(self.points)
+        return self.points
     
 
     def __getstate__(self):
         ret = {}
-        skipfields = ["featurepickle", "children"]
+        skipfields = ["featurepickle", "featurepickle_b64", "children"]
         
         #handle all the normal fields
         for k in self._data.keys():
             if k in skipfields:
                 continue
             
-            ret[k] = self._data[k]
+            ret[k] = _plain(self._data[k])
+            if k == "points":
+                ret[k] = self.plainpoints
             if k == "inspection":
                 ret[k] = str(self._data[k])
         
@@ -134,26 +299,55 @@ class FrameFeature(SimpleEmbeddedDoc, mongoengine.EmbeddedDocument):
         ret["children"] = [c.__getstate__() for c in self.children]
         return ret
 
-    #cribbed from http://www.ariel.com.au/a/python-point-int-poly.html
-    #should be moved to SimpleCV/Features
+    #ray casting, as http://www.ariel.com.au/a/python-point-int-poly.html
+    #see spatial.points_in_polygons for many points and features at once
     def contains(self, point):
-        x, y  = point
-        poly = self.points
-        n = len(poly)
-        inside = False
-        if n < 3:
+        if self.points is None:
             return False
-    
-        p1x,p1y = poly[0]
-        for i in range(n+1):
-            p2x,p2y = poly[i % n]
-            if y > min(p1y,p2y):
-                if y <= max(p1y,p2y):
-                    if x <= max(p1x,p2x):
-                        if p1y != p2y:
-                            xinters = (y-p1y)*(p2x-p1x)/(p2y-p1y)+p1x
-                        if p1x == p2x or x <= xinters:
-                            inside = not inside
-            p1x,p1y = p2x,p2y
-
-        return inside  
+        return bool(points_in_polygon([point], self.points)[0])
+
+    def contains_points(self, points):
+        '''A boolean array: which of points are inside this feature'''
+        return points_in_polygon(points, self.points)
+
+def _compact_son(son, keep_pickle):
+    '''Rewrite a feature saved by the old setFeature (and its children)'''
+    if isinstance(son.get('points'), list):
+        son['points'] = _pack(son['points'])
+    featuredata = son.get('featuredata') or {}
+    for k in FrameFeature.cleanse_mask:
+        if isinstance(featuredata.get(k), list):
+            featuredata[k] = _pack(featuredata[k])
+    b64 = son.pop('featurepickle_b64', None)
+    if b64 and keep_pickle:
+        son['featurepickle'] = bson.Binary(a2b_base64(b64))
+    for child in son.get('children') or []:
+        _compact_son(child, keep_pickle)
+    return son
+
+def migrate_features(collection, keep_pickles = True, batch = 500):
+    """
+    Compact the features of every frame in collection saved before
+    setFeature packed them: points and contours become packed arrays, and
+    base64 pickles become binary (or are dropped, without keep_pickles;
+    the features are then rebuilt from featuredata).  Returns the number
+    of frames rewritten and their size before and after, in bytes.
+    """
+    query = { 'features.featurepickle_b64': { '$exists': True } }
+    frames, before, after = 0, 0, 0
+    while True:
+        # raw documents: we write them back as they are, without SONScrub
+        docs = list(collection.find(
+                query, fields = ['features'], manipulate = False).limit(batch))
+        if not docs:
+            break
+        for doc in docs:
+            before += len(bson.BSON.encode(doc))
+            doc['features'] = [
+                _compact_son(f, keep_pickles) for f in doc['features'] ]
+            after += len(bson.BSON.encode(doc))
+            collection.update(
+                { '_id': doc['_id'] }, { '$set': { 'features': doc['features'] } })
+        frames += len(docs)
+        log.info('Migrated features of %d frames', frames)
+    return frames, before, after
@@ -8,6 +8,7 @@ import formencode as fe
 
 from SimpleSeer import validators as V
 from SimpleSeer import util
+from SimpleSeer.metrics import Metrics
 
 
 from .base import SimpleDoc, WithPlugins
@@ -76,11 +77,14 @@ class Inspection(SimpleDoc, WithPlugins, mongoengine.Document):
     def __repr__(self):
       return "[%s Object <%s> ]" % (self.__class__.__name__, self.name)
                                            
-    def execute(self, image, parents = {}):
+    def execute(self, image, parents = {}, plan = None):
         """
         The execute method takes in a frame object, executes the method
         and sends the samples to each measurement object.  The results are returned
         as a multidimensional array [ samples ][ measurements ] = result
+
+        If an InspectionPlan is given, children and plugins come from the
+        plan instead of the database.
         """
         
         #execute the morphs?
@@ -89,11 +93,15 @@ class Inspection(SimpleDoc, WithPlugins, mongoengine.Document):
         if parents.has_key(self.id):
             return []
         
-        method_ref = self.get_plugin(self.method)
+        if plan is not None:
+            method_ref = plan.plugin(self)
+        else:
+            method_ref = self.get_plugin(self.method)
         #get the ROI function that we want
         #note that we should validate/roi method
  
-        featureset = method_ref(image)
+        with Metrics().timer('inspection.' + self.method):
+            featureset = method_ref(image)
         
         if not featureset:
             return []
@@ -108,7 +116,10 @@ class Inspection(SimpleDoc, WithPlugins, mongoengine.Document):
         for r in featureset:
             r.inspection = self.id
         
-        children = self.children
+        if plan is not None:
+            children = plan.children(self)
+        else:
+            children = self.children
         
         if not children:
             return featureset
@@ -122,7 +133,7 @@ class Inspection(SimpleDoc, WithPlugins, mongoengine.Document):
                 roi = f.crop()
             
                 for child in children:    
-                    r.children.extend(child.execute(roi, newparents))
+                    r.children.extend(child.execute(roi, newparents, plan))
                 
         
         return featureset
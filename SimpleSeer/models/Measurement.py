@@ -9,6 +9,7 @@ from formencode import schema as fes
 import formencode as fe
 
 from SimpleSeer import validators as V
+from SimpleSeer.metrics import Metrics
 
 class MeasurementSchema(fes.Schema):
     name = fev.UnicodeString(not_empty=True) #TODO, validate on unique name
@@ -48,7 +49,11 @@ class Measurement(SimpleDoc, WithPlugins, mongoengine.Document):
     inspection = mongoengine.ObjectIdField()
     featurecriteria = mongoengine.DictField()
 
-    def execute(self, frame, features):
+    def execute(self, frame, features, plan = None):
+        with Metrics().timer('measurement.' + self.method):
+            return self._execute(frame, features, plan)
+
+    def _execute(self, frame, features, plan):
         featureset = self.findFeatureset(features)
         #this will catch nested features
 
@@ -72,20 +77,16 @@ class Measurement(SimpleDoc, WithPlugins, mongoengine.Document):
         else:        
             function_ref = ""
             try:
-                function_ref = self.get_plugin(self.method)
+                if plan is not None:
+                    function_ref = plan.plugin(self)
+                else:
+                    function_ref = self.get_plugin(self.method)
             except ValueError:
                 print "Can't fetch measurement plugin " + self.method
                 return []
             
             values = function_ref(frame, featureset)
-        return self.toResults(frame, values)
-            
-        
-        values = []
-        
-        
-        
-        return self.toResults(frame, values)
+        return self.toResults(frame, values, plan)
         
     def findFeatureset(self, features):
         
@@ -99,7 +100,7 @@ class Measurement(SimpleDoc, WithPlugins, mongoengine.Document):
             
         return fs
         
-    def toResults(self, frame, values):
+    def toResults(self, frame, values, plan = None):
         from .Inspection import Inspection
         if not values or not len(values):
             return []
@@ -113,14 +114,17 @@ class Measurement(SimpleDoc, WithPlugins, mongoengine.Document):
                 except:
                     return None
 
-        inspection = Inspection.objects.get(id=self.inspection)
+        if plan is not None:
+            inspection_name = plan.inspection_name(self.inspection)
+        else:
+            inspection_name = Inspection.objects.get(id=self.inspection).name
         results = [
             ResultEmbed(
                 result_id=bson.ObjectId(),
                 numeric=numeric(v),
                 string=str(v),
                 inspection_id=self.inspection,
-                inspection_name=inspection.name,
+                inspection_name=inspection_name,
                 measurement_id=self.id,
                 measurement_name=self.name)
             for v in values ]
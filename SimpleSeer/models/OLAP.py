@@ -696,32 +696,44 @@ class DescriptiveStatistic:
 class RealtimeOLAP:
 
     def realtime(self, res):
-        
-        log.info('Talkin bout ' + str(res.id))
-        
+        self.realtime_batch([res])
+
+    def realtime_batch(self, results):
+        # Like realtime, but for a batch of results (usually those of one or
+        # more frames being saved together): each OLAP is looked up, queried
+        # and notified once for the whole batch rather than once per result
+
+        if not results:
+            return
+        log.info('Talkin bout %d results' % len(results))
+
+        lastTime = None
+        ordered = None
         olaps = OLAP.objects
         for o in olaps:
             
-            # First test if this result is related to the OLAP
+            # First test which results are related to the OLAP
             # Can match on measurements or inspection
-            match = False
             if (o.queryInfo['objType'] == 'measurement'):
                 m = Measurement.objects(name=o.queryInfo['objName'])
-                if m[0].id == res.measurement:
-                    match = True
+                if not len(m): continue
+                matches = [ r for r in results if r.measurement == m[0].id ]
             else:
                 i = Inspection.objects(name=o.queryInfo['objName'])
-                if i[0].id == res.inspection:
-                    match = True
+                if not len(i): continue
+                matches = [ r for r in results if r.inspection == i[0].id ]
                 
             
-            if match:
+            if matches:
+                res = matches[-1]
                 # First, check for entries that just want the raw data
                 # (If no descInfo is set or if descInfo lacks a formula field)
                 if (o.descInfo is None) or (not o.descInfo.has_key('formula')):
                     r = ResultSet()
-                    rset = r.resultToResultSet(o.queryInfo, res)
-                    self.sendMessage(o, rset['data'])
+                    data = []
+                    for match in matches:
+                        data.extend(r.resultToResultSet(o.queryInfo, match)['data'])
+                    self.sendMessage(o, data)
 
                 elif o.descInfo['formula'] == 'moving':
                     # Special case for the moving average
@@ -736,25 +748,40 @@ class RealtimeOLAP:
                     # This is a stupid hack for gumball                    
                     if o.queryInfo.has_key('filter'):
                         filt = o.queryInfo['filter']
-                        if filt['val'] == res.string:
+                        counted = [ match for match in matches if filt['val'] == match.string ]
+                        if counted:
+                            res = counted[-1]
                             rset = o.execute()
                             if len(rset['data']) > 0:
                                 rset['data'] = rset['data'][-1]
-                                rset['data'][1] += 1
+                                rset['data'][1] += len(counted)
                             else:
-                                rset['data'] = [res.capturetimeEpochMS, 1, res.inspection, res.frame, res.measurement, res.id]
+                                rset['data'] = [res.capturetimeEpochMS, len(counted), res.inspection, res.frame, res.measurement, res.id]
                             
                             self.sendMessage(o, [rset['data']])
                             
                             
                 else:
-                    # Trigger a descriptive if the previous record was on the other side of a group by window/interval
+                    # Trigger a descriptive for each matching result whose previous record
+                    # (earlier in the batch, or already saved) was on the other side of a
+                    # group by window/interval
                     window = o.descInfo['window']
-                    thisTime = calendar.timegm(res.capturetime.timetuple())
-                    previousTime = self.lastResult()
-                    border = thisTime - (thisTime % window)
+                    if lastTime is None:
+                        lastTime = self.lastResult()
+                    if ordered is None:
+                        ordered = sorted(
+                            [ (calendar.timegm(r.capturetime.timetuple()), r) for r in results ],
+                            key = lambda (t, r): t)
+                    matched = set(id(match) for match in matches)
+                    borders = []
+                    previousTime = lastTime
+                    for thisTime, r in ordered:
+                        border = thisTime - (thisTime % window)
+                        if id(r) in matched and previousTime < border and border not in borders:
+                            borders.append(border)
+                        previousTime = max(previousTime, thisTime)
                     
-                    if (previousTime < border):
+                    for border in borders:
                         # This does the unnecessary step of creating chart info.  Could optimize this.
                         # log.info('Sending descriptive for ' + o.name)
                         o.descInfo['trim'] = 0
@@ -765,7 +792,7 @@ class RealtimeOLAP:
                 
     def lastResult(self):
         # Show the timestamp of the last entry in the result table
-        rs = Result.objects.order_by('-capturetime')
+        rs = Result.latest(limit = 1)
         if len(rs) > 0: 
             return calendar.timegm(rs[0].capturetime.timetuple())
         else:
@@ -852,9 +879,9 @@ class ResultSet:
         # Get the results
         # Only truncate if a limit was set
         if (queryInfo['limit']):
-            rs = list(Result.objects(**query).order_by('-capturetime')[:queryInfo['limit']])
+            rs = Result.latest(queryInfo['limit'], **query)
         else:
-            rs = list(Result.objects(**query).order_by('-capturetime'))
+            rs = Result.latest(**query)
             
         
         # When performing some computations, require additional data
@@ -862,7 +889,7 @@ class ResultSet:
         if (len(rs) > 0) and (queryInfo.has_key('required')) and (len(rs) < queryInfo['required']):
             # If not, relax the capture time but only take the num records required
             del(query['capturetime__gt'])
-            rs = list(Result.objects(**query).order_by('-capturetime')[:queryInfo['required']])
+            rs = Result.latest(queryInfo['required'], **query)
         
         
         # Setup the list of fields to retrieve
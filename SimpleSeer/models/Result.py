@@ -1,7 +1,14 @@
+import bson
 import mongoengine
+from pymongo.errors import DuplicateKeyError
 import calendar
 
 from .base import SimpleDoc, SimpleEmbeddedDoc
+from ..partition import get_router, register_indexes
+
+RESULT_INDEXES = ["capturetime", ('camera', '-capturetime'), "frame", "inspection", "measurement"]
+# mongoengine keyword operators that latest() and purge() take
+OPERATORS = ('ne', 'lt', 'lte', 'gt', 'gte', 'in', 'nin', 'exists')
 
 class ResultEmbed(SimpleEmbeddedDoc, mongoengine.EmbeddedDocument):
     _jsonignore = ('result_id', 'inspection_id', 'measurement_id')
@@ -33,8 +40,9 @@ class Result(SimpleDoc, mongoengine.Document):
     measurement = mongoengine.ObjectIdField()
     
     meta = {
-        'indexes': ["capturetime", ('camera', '-capturetime'), "frame", "inspection", "measurement"]
+        'indexes': RESULT_INDEXES
     }
+    _partition = None #set by Frame for results of a time partitioned frame
 
     
     def capEpochMS(self):
@@ -55,3 +63,107 @@ class Result(SimpleDoc, mongoengine.Document):
         
         super(Result, self).save(*args, **kwargs)
 
+    @classmethod
+    def bulk_save(cls, results, safe = True):
+        """
+        Save a batch of results with one OLAP notification and one insert
+        (per time partition), instead of a get_or_create and a save each.
+        The insert is always acknowledged: if some of the results were saved
+        before, it fails on their ids, and then every result in the batch is
+        upserted by id, so an earlier copy is only ever replaced, never
+        missing.  safe applies to those upserts.
+        """
+        if not results:
+            return
+        from .OLAP import RealtimeOLAP
+        RealtimeOLAP().realtime_batch(results)
+
+        partitions = {}
+        for result in results:
+            if result.id is None:
+                result.id = bson.ObjectId()
+            partitions.setdefault(result._partition, []).append(result)
+        for partition, batch in partitions.items():
+            if partition:
+                collection = cls._partition_collection(partition)
+            else:
+                collection = cls._get_collection()
+            docs = [ result.to_mongo() for result in batch ]
+            try:
+                collection.insert(docs, safe = True, continue_on_error = True)
+            except DuplicateKeyError:
+                for doc in docs:
+                    collection.update(
+                        { '_id': doc['_id'] }, doc, upsert = True, safe = safe)
+
+    @classmethod
+    def _partition_collection(cls, partition):
+        router = get_router()
+        if router is not None:
+            return router.collection('result', partition)
+        return cls._get_db()['result_' + partition]
+
+    @classmethod
+    def latest(cls, limit = 0, **query):
+        """
+        Results matching query (mongoengine keywords, e.g. capturetime__gt),
+        newest first, from every time partition the query's range overlaps
+        """
+        found = cls.objects(**query).order_by('-capturetime')
+        router = get_router()
+        if router is None:
+            if limit:
+                found = found[:limit]
+            return list(found)
+        total, docs = router.find(
+            'result', cls.mongo_query(**query), [('capturetime', -1)], 0, limit)
+        results = []
+        for doc in docs:
+            partition = doc.pop('partition')
+            result = cls._from_son(doc)
+            result._partition = partition
+            results.append(result)
+        return results
+
+    @classmethod
+    def purge(cls, **query):
+        '''Delete the results matching query, from every time partition'''
+        found = cls.objects(**query)
+        router = get_router()
+        if router is None:
+            found.delete()
+            return
+        spec = cls.mongo_query(**query)
+        for suffix, collection in router.collections('result'):
+            collection.remove(spec)
+
+    @classmethod
+    def mongo_query(cls, **query):
+        """
+        The pymongo query for mongoengine style keywords, for querying the
+        time partitions directly:
+
+        >>> Result.mongo_query(measurement = m.id, capturetime__gt = t)
+        {'measurement': m.id, 'capturetime': {'$gt': t}}
+        """
+        spec = {}
+        for key, value in query.items():
+            parts = key.split('__')
+            op = None
+            if len(parts) > 1 and parts[-1] in OPERATORS:
+                op = parts.pop()
+            field = cls._fields.get(parts[0])
+            if field is not None and len(parts) == 1:
+                if op in ('in', 'nin'):
+                    value = [ field.to_mongo(v) for v in value ]
+                elif op != 'exists':
+                    value = field.to_mongo(value)
+                parts[0] = field.db_field
+            name = '.'.join(parts)
+            if op is None:
+                spec[name] = value
+            else:
+                spec.setdefault(name, {})['$' + op] = value
+        return spec
+
+register_indexes('result', RESULT_INDEXES)
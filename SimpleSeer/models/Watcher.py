@@ -3,6 +3,7 @@ import mongoengine
 from .base import SimpleDoc, SimpleEmbeddedDoc, WithPlugins
 from .Measurement import Measurement
 from .Alert import Alert
+from ..metrics import timed
 
 class Handler(SimpleEmbeddedDoc, mongoengine.EmbeddedDocument):
     name = mongoengine.StringField()
@@ -38,12 +39,16 @@ class Watcher(SimpleDoc, WithPlugins, mongoengine.Document):
     def __repr__(self):
         return "<Watcher object '%s' conditions: %d, handlers: %s>" % (self.name, len(self.conditions), ", ".join(self.handlers))
     
-    def check(self, results):
+    @timed('watcher.check')
+    def check(self, results, plan = None):
         # Create a dict of lists of results keyed by measurement name
         result_dict = {}
         for r in results:
-            m = Measurement.objects.get(_id=r.measurement)
-            lst = result_dict.setdefault(m.name, [])
+            if plan is not None:
+                name = plan.measurement_name(r.measurement_id)
+            else:
+                name = Measurement.objects.get(_id=r.measurement).name
+            lst = result_dict.setdefault(name, [])
             lst.append(r)
         user_namespace = dict(
             results=result_dict)
@@ -59,6 +64,7 @@ class Watcher(SimpleDoc, WithPlugins, mongoengine.Document):
                 if function_ref is None:
                     function_ref = self.get_plugin(handler)
                 function_ref(results)
+        return outcome
 
     @classmethod
     def info_handler(cls, results, message='info'):
@@ -85,13 +85,27 @@ class WithPlugins(object):
         return plugins
 
 class SONScrub(SONManipulator):
+    """
+    Turns the types registered here into something BSON can store on the
+    way in, and registered Binary subtypes back on the way out.
+
+    Documents are copied only where something changes, so a subtree with
+    nothing to convert is passed through as it is, both ways.  Serializer
+    lookups are memoized per type.
+    """
     _bson_primitive_types = (
         int, float, basestring, datetime,
         type(None),
         bson.RE_TYPE, bson.Code, bson.Binary,
         bson.DBRef, bson.ObjectId)
+    # exactly these types are passed through without a call either way
+    _native_types = frozenset([
+        int, long, float, bool, str, unicode, datetime, type(None),
+        bson.ObjectId])
     _serializers = {}
     _deserializers = {0x80: lambda v,c: loads(v)}
+    # type -> (serializer, type_id), filled in by _find_serializer
+    _serializer_cache = {}
 
     class Missing(object): pass
 
@@ -100,19 +114,23 @@ class SONScrub(SONManipulator):
         result = cls._serializers, cls._deserializers
         cls._serializers = {}
         cls._deserializers = {0x80: lambda v,c: loads(v)}
+        cls._serializer_cache = {}
         return result
 
     @classmethod
     def restore_registry(cls, registry):
         cls._serializers, cls._deserializers = registry
+        cls._serializer_cache = {}
 
     @classmethod
     def scrub_type(cls, type):
         cls._serializers[type] = (cls._scrub, None)
+        cls._serializer_cache = {}
 
     @classmethod
     def register_bsonifier(cls, type, serialize):
         cls._serializers[type] = (serialize, None)
+        cls._serializer_cache = {}
 
     @classmethod
     def register_bintype(cls, type, serialize, deserialize, type_id=None):
@@ -131,39 +149,90 @@ class SONScrub(SONManipulator):
                 type)
         cls._serializers[type] = (serialize, type_id)
         cls._deserializers[type_id] = deserialize
+        cls._serializer_cache = {}
         return type_id
 
     @classmethod
     def register_pickled_type(cls, type):
         cls._serializers[type] = (cls._pickle, 0x80)
+        cls._serializer_cache = {}
 
     def transform_incoming(self, son, collection):
+        if type(son) in self._native_types:
+            return son
+        if isinstance(son, dict):
+            changed = None
+            for k, v in son.iteritems():
+                if type(v) in self._native_types:
+                    continue
+                v1 = self.transform_incoming(v, collection)
+                if v1 is not v:
+                    if changed is None:
+                        changed = {}
+                    changed[k] = v1
+            if changed is None:
+                return son
+            son = son.copy()
+            for k, v in changed.iteritems():
+                if v is self.Missing:
+                    del son[k]
+                else:
+                    son[k] = v
+            return son
+        if isinstance(son, (list, tuple)):
+            result = None
+            for i, v in enumerate(son):
+                if type(v) not in self._native_types:
+                    v1 = self.transform_incoming(v, collection)
+                    if v1 is not v and result is None:
+                        result = list(son[:i])
+                    v = v1
+                if result is not None and v is not self.Missing:
+                    result.append(v)
+            if result is None:
+                return son
+            return result
         if isinstance(son, self._bson_primitive_types):
-            pass
-        elif isinstance(son, (list, tuple)):
-            son = [ self.transform_incoming(v, collection) for v in son ]
-            son = [ v for v in son if v is not self.Missing ]
-        elif isinstance(son, dict):
-            son = [
-                (k, self.transform_incoming(v, collection))
-                for k,v in son.items()]
-            son = dict((k,v) for k,v in son if v is not self.Missing)
-        else:
-            (serializer, type_id) = self._find_serializer(type(son))
-            if serializer is not None:
-                son = serializer(son, collection)
-                if type_id is not None:
-                    son = bson.Binary(son, type_id)
+            return son
+        (serializer, type_id) = self._find_serializer(type(son))
+        if serializer is not None:
+            son = serializer(son, collection)
+            if type_id is not None:
+                son = bson.Binary(son, type_id)
         return son
 
     def transform_outgoing(self, son, collection):
+        if type(son) in self._native_types:
+            return son
+        if isinstance(son, dict):
+            changed = None
+            for k, v in son.iteritems():
+                if type(v) in self._native_types:
+                    continue
+                v1 = self.transform_outgoing(v, collection)
+                if v1 is not v:
+                    if changed is None:
+                        changed = {}
+                    changed[k] = v1
+            if changed is None:
+                return son
+            son = son.copy()
+            son.update(changed)
+            return son
         if isinstance(son, (list, tuple)):
-            son = [ self.transform_outgoing(v, collection) for v in son ]
-        elif isinstance(son, dict):
-            son = dict(
-                (k, self.transform_outgoing(v, collection))
-                for k,v in son.items())
-        elif isinstance(son, bson.Binary) and son.subtype & 0x80:
+            result = None
+            for i, v in enumerate(son):
+                if type(v) not in self._native_types:
+                    v1 = self.transform_outgoing(v, collection)
+                    if v1 is not v and result is None:
+                        result = list(son[:i])
+                    v = v1
+                if result is not None:
+                    result.append(v)
+            if result is None:
+                return son
+            return result
+        if isinstance(son, bson.Binary) and son.subtype & 0x80:
             deserializer = self._deserializers.get(son.subtype)
             if deserializer is not None:
                 son = deserializer(son, collection)
@@ -171,10 +240,18 @@ class SONScrub(SONManipulator):
 
     @classmethod
     def _find_serializer(cls, sontype):
+        try:
+            return cls._serializer_cache[sontype]
+        except KeyError:
+            pass
+        result = (None, None)
         for test_type in sontype.__mro__:
-            result = cls._serializers.get(test_type, None)
-            if result is not None: return result
-        return (None, None)
+            found = cls._serializers.get(test_type, None)
+            if found is not None:
+                result = found
+                break
+        cls._serializer_cache[sontype] = result
+        return result
 
     @classmethod
     def _scrub(cls, son, collection):
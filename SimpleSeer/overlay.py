@@ -0,0 +1,147 @@
+import zlib
+import logging
+from functools import wraps
+
+import bson
+import numpy as np
+import pygame
+from SimpleCV import DrawingLayer
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/x-seer-overlay'
+
+# DrawingLayer calls that can be saved as they were made and replayed later
+VECTOR_METHODS = (
+    'line', 'lines', 'rectangle', 'rectangle2pts', 'centeredRectangle',
+    'polygon', 'circle', 'ellipse', 'bezier', 'text', 'ezViewText',
+    'setDefaultAlpha', 'setDefaultColor', 'setLayerAlpha', 'setFontBold',
+    'setFontItalic', 'setFontUnderline', 'selectFont', 'setFontSize')
+# ...and those that draw pixels we can't keep as a call
+RASTER_METHODS = ('sprite', 'blit', 'replaceOverlay', 'clear')
+# a layer drawn on more times than this is saved as pixels instead
+MAX_OPS = 1000
+
+def _plain(value):
+    '''Arguments as BSON-friendly lists, dicts and python scalars'''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [ _plain(v) for v in value ]
+    if isinstance(value, dict):
+        return dict((k, _plain(v)) for k, v in value.items())
+    return value
+
+def _record(name, method):
+    @wraps(method)
+    def recorded(self, *args, **kwargs):
+        # only the outermost call is recorded (lines() calls line(), etc.)
+        depth = self.__dict__.get('_seer_depth', 0)
+        if not depth:
+            ops = self.__dict__.setdefault('_seer_ops', [])
+            if name == 'clear':
+                # a blank layer again, whatever was drawn before
+                self._seer_ops = []
+            elif ops is not None:
+                if name in RASTER_METHODS or len(ops) >= MAX_OPS:
+                    self._seer_ops = None
+                else:
+                    ops.append([ name, _plain(args), _plain(kwargs) ])
+        self._seer_depth = depth + 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._seer_depth = depth
+    return recorded
+
+def install():
+    """
+    Wrap the DrawingLayer drawing methods so every layer keeps a list of
+    the primitives drawn on it, for encode().  The seer calls this when it
+    starts; other processes leave DrawingLayer alone, and their frames'
+    overlays are saved as pixels.
+    """
+    if getattr(DrawingLayer, '_seer_recording', False):
+        return
+    for name in VECTOR_METHODS + RASTER_METHODS:
+        setattr(DrawingLayer, name, _record(name, getattr(DrawingLayer, name)))
+    DrawingLayer._seer_recording = True
+
+def _raster(layer):
+    '''The non-empty part of the layer, zlib compressed, or None if blank'''
+    surface = layer._mSurface
+    rect = surface.get_bounding_rect()
+    if not rect.width or not rect.height:
+        return None
+    rgba = pygame.image.tostring(surface.subsurface(rect), "RGBA")
+    return dict(
+        x=rect.x, y=rect.y, w=rect.width, h=rect.height,
+        rgba=bson.Binary(zlib.compress(rgba, 1)))
+
+def _replay(layer, ops):
+    for name, args, kwargs in ops:
+        getattr(layer, name)(*args, **dict(
+                (str(k), v) for k, v in kwargs.items()))
+
+def _replays(layer, ops):
+    """
+    Whether replaying ops onto a blank layer gives this layer's pixels.
+    They don't if the surface was drawn on some other way (blitting onto
+    _mSurface, renderToOtherLayer, adding layers), which the recorder never
+    sees.
+    """
+    surface = layer._mSurface
+    copy = DrawingLayer(surface.get_size())
+    _replay(copy, ops)
+    return (pygame.image.tostring(copy._mSurface, "RGBA")
+            == pygame.image.tostring(surface, "RGBA"))
+
+def _entry(layer, vector=True):
+    ops = layer.__dict__.get('_seer_ops')
+    if vector and ops and _replays(layer, ops):
+        return dict(ops=ops)
+    # layers drawn with sprite/blit, or whose surface was set directly
+    return _raster(layer)
+
+def encode(image):
+    """
+    The image's drawing layers as a BSON document: each layer is either
+    the list of primitives drawn on it or, if that isn't known (or doesn't
+    reproduce the layer), the compressed bounding box of its pixels.
+    Returns None if there is nothing to save.
+    """
+    for vector in (True, False):
+        layers = [ _entry(layer, vector) for layer in image._mLayers ]
+        layers = [ l for l in layers if l is not None ]
+        if not layers:
+            return None
+        doc = dict(size=list(image.size()), layers=layers)
+        try:
+            return bson.BSON.encode(doc)
+        except (bson.errors.InvalidDocument, TypeError), e:
+            log.warning('Overlay not storable as vectors (%s), saving pixels', e)
+    return None
+
+def layers(data, size, content_type=CONTENT_TYPE):
+    """
+    Rebuild DrawingLayers from what encode() returned.  Anything else is
+    taken to be a full-size RGBA bitmap, as layerfile used to hold.
+    """
+    if content_type != CONTENT_TYPE:
+        layer = DrawingLayer(size)
+        layer.replaceOverlay(pygame.image.fromstring(data, size, "RGBA"))
+        return [ layer ]
+    doc = bson.BSON(data).decode()
+    result = []
+    for entry in doc['layers']:
+        layer = DrawingLayer(size)
+        if 'ops' in entry:
+            _replay(layer, entry['ops'])
+        else:
+            pixels = pygame.image.fromstring(
+                zlib.decompress(entry['rgba']), (entry['w'], entry['h']), "RGBA")
+            layer._mSurface.blit(pixels, (entry['x'], entry['y']))
+        result.append(layer)
+    return result
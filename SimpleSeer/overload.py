@@ -0,0 +1,109 @@
+import logging
+
+from .metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+class OverloadPolicy(object):
+    """
+    Decides what the run loop sheds once it starts overrunning
+    poll_interval, instead of just falling further and further behind.
+
+    Configured under "overload" in the config file; only the policies that
+    are listed are ever applied:
+
+    "overload": {
+        "policies": ["drop_frames", "every_nth", "skip_passing_saves", "thumbnails"],
+        "every_nth": 5,
+        "expensive": ["blobs", "ocr"],
+        "thumbnail_width": 320,
+        "recover": 10
+    }
+
+      - drop_frames: while more than a poll_interval behind, capture but
+        don't inspect or save frames, until caught up
+      - every_nth: run the "expensive" inspection methods on every Nth frame only
+      - skip_passing_saves: with record_all, don't save frames that passed
+      - thumbnails: save a thumbnail_width image instead of the full frame
+        (the frame in memory, and in lastframes, keeps its full image)
+
+    The loop counts as overloaded from its first overrun until it has made
+    "recover" frames in a row on time.  Overruns, and each time a policy
+    fires, are counted in Metrics (overload.*) and so published with them.
+    """
+
+    def __init__(self, config = None):
+        config = config or {}
+        self.policies = set(config.get('policies', []))
+        self.every_nth = config.get('every_nth', 5)
+        self.expensive = set(config.get('expensive', []))
+        self.thumbnail_width = config.get('thumbnail_width', 320)
+        self.recover = config.get('recover', 10)
+        self.overloaded = False
+        self.behind = 0.0
+        self.overruns = 0
+        self.fired = dict((p, 0) for p in self.policies)
+        self._on_time = 0
+
+    def record(self, elapsed, interval):
+        '''Called once per run loop iteration with how long it took'''
+        if not interval or not self.policies:
+            return
+        if elapsed > interval:
+            self.overruns += 1
+            self.behind += elapsed - interval
+            self._on_time = 0
+            Metrics().incr('overload.overruns')
+            if not self.overloaded:
+                log.warning('Run loop overran poll_interval, shedding load')
+                self.overloaded = True
+        else:
+            self.behind = max(0.0, self.behind - (interval - elapsed))
+            self._on_time += 1
+            if self.overloaded and self._on_time >= self.recover:
+                log.info('Run loop caught up, no longer shedding load')
+                self.overloaded = False
+
+    def _fire(self, policy):
+        self.fired[policy] += 1
+        Metrics().incr('overload.' + policy)
+        return True
+
+    def drop_frame(self, interval):
+        if 'drop_frames' not in self.policies or self.behind <= interval:
+            return False
+        self.behind -= interval
+        return self._fire('drop_frames')
+
+    def skip_inspections(self, framecount):
+        '''Inspection methods to leave out of this frame'''
+        if ('every_nth' not in self.policies or not self.overloaded
+            or framecount % self.every_nth == 0):
+            return ()
+        self._fire('every_nth')
+        return self.expensive
+
+    def skip_save(self, frame):
+        if ('skip_passing_saves' not in self.policies or not self.overloaded
+            or not frame.passed):
+            return False
+        return self._fire('skip_passing_saves')
+
+    def degrade(self, frame):
+        """
+        Have the frame's image saved shrunk to thumbnail_width.  This only
+        marks the frame; the encoding is left to whoever saves it (the
+        FrameWriter's encoders, with one).
+        """
+        if 'thumbnails' not in self.policies or not self.overloaded:
+            return False
+        if frame.width > self.thumbnail_width:
+            frame._save_width = self.thumbnail_width
+        return self._fire('thumbnails')
+
+    def stats(self):
+        return dict(
+            overloaded=self.overloaded,
+            behind=self.behind,
+            overruns=self.overruns,
+            fired=dict(self.fired))
@@ -0,0 +1,215 @@
+import logging
+from datetime import datetime, timedelta
+
+import gridfs
+import mongoengine
+
+from .Session import Session
+
+log = logging.getLogger(__name__)
+
+PERIODS = dict(day=timedelta(days=1), week=timedelta(days=7))
+
+# base collection name -> the indexes its partitions get, as pymongo specs
+INDEXES = {}
+
+def register_indexes(base, indexes):
+    """
+    Give base's partitions the same indexes as base, from a mongoengine
+    meta['indexes'] list ("field", "-field" or a tuple of them)
+    """
+    specs = []
+    for index in indexes:
+        if isinstance(index, basestring):
+            index = (index,)
+        specs.append([ (f.lstrip('-+'), f.startswith('-') and -1 or 1)
+                       for f in index ])
+    INDEXES[base] = specs
+
+class Partitioner(object):
+    """
+    Routes frames, results and their GridFS files to one collection per
+    day or week of capturetime, e.g. frame_d20120601, result_d20120601 and
+    the fs_d20120601 bucket (weeks are named by their Monday, w20120528).
+    Configured with:
+
+    "partitions": { "period": "day" }
+
+    Writes go to the partition of the document's capturetime.  Time range
+    queries (find) go only to the partitions overlapping the range, plus
+    the original unpartitioned collection, so data saved before
+    partitioning was turned on is still found.  Retention drops whole
+    partitions (drop_before).
+    """
+
+    def __init__(self, period = 'day'):
+        if period not in PERIODS:
+            raise ValueError, ('Partition period must be one of %r' %
+                               PERIODS.keys())
+        self.period = period
+        self.length = PERIODS[period]
+        self.prefix = period[0]
+        self._indexed = set()
+
+    def _db(self):
+        return mongoengine.connection.get_db()
+
+    def start(self, when):
+        '''Start of the partition holding when'''
+        start = datetime(when.year, when.month, when.day)
+        if self.period == 'week':
+            start -= timedelta(days=start.weekday())
+        return start
+
+    def suffix(self, when):
+        return self.prefix + self.start(when).strftime('%Y%m%d')
+
+    def bounds(self, suffix):
+        '''(start, end) of a partition; ValueError if suffix isn't one'''
+        if suffix[:1] != self.prefix:
+            raise ValueError, suffix
+        start = datetime.strptime(suffix[1:], '%Y%m%d')
+        return start, start + self.length
+
+    def collection(self, base, suffix):
+        '''A partition of base, given base's indexes the first time it's used'''
+        name = '%s_%s' % (base, suffix)
+        collection = self._db()[name]
+        if name not in self._indexed:
+            for spec in INDEXES.get(base, []):
+                collection.ensure_index(spec)
+            self._indexed.add(name)
+        return collection
+
+    def bucket(self, suffix):
+        return gridfs.GridFS(self._db(), 'fs_' + suffix)
+
+    def suffixes(self, base, start = None, end = None):
+        '''Existing partitions of base overlapping start..end, newest first'''
+        result = []
+        for name in self._db().collection_names():
+            if not name.startswith(base + '_'):
+                continue
+            suffix = name[len(base) + 1:]
+            try:
+                lo, hi = self.bounds(suffix)
+            except ValueError:
+                continue
+            if (start is not None and hi <= start) or (end is not None and lo > end):
+                continue
+            result.append(suffix)
+        return sorted(result, reverse = True)
+
+    def collections(self, base, start = None, end = None):
+        '''(suffix, collection) to query for start..end; None is the original'''
+        result = [ (s, self.collection(base, s))
+                   for s in self.suffixes(base, start, end) ]
+        result.append((None, self._db()[base]))
+        return result
+
+    def find(self, base, query, sort = None, skip = 0, limit = 0, fields = None):
+        """
+        Run query over the partitions its capturetime range overlaps, and
+        merge the results.  Returns (total, docs), each doc with its
+        partition's suffix in 'partition'.  fields, if given, are the only
+        ones loaded (and must include the sort keys).
+        """
+        start, end = time_range(query)
+        total = 0
+        docs = []
+        for suffix, collection in self.collections(base, start, end):
+            cursor = collection.find(query, fields = fields)
+            if sort:
+                cursor = cursor.sort(sort)
+            total += cursor.count()
+            if limit:
+                cursor = cursor.limit(skip + limit)
+            for doc in cursor:
+                doc['partition'] = suffix
+                docs.append(doc)
+        # stable sorts, least significant key first
+        for key, direction in reversed(sort or []):
+            docs.sort(key = lambda doc: doc.get(key), reverse = direction < 0)
+        if limit:
+            return total, docs[skip:skip + limit]
+        return total, docs[skip:]
+
+    def find_id(self, base, id, fields = None):
+        '''The document with this ObjectId, wherever it is, or None'''
+        return self.find_ids(base, [ id ], fields).get(id)
+
+    def find_ids(self, base, ids, fields = None):
+        """
+        The documents with these ObjectIds, as a dict by id.  Each is looked
+        for in the partitions around the id's time first (frames are
+        usually saved as they are captured), then the original collection,
+        then every other partition.
+        """
+        missing = set(ids)
+        found = {}
+        existing = self.suffixes(base)
+        likely = set()
+        for id in missing:
+            when = id.generation_time.replace(tzinfo = None)
+            likely.update(self.suffix(t) for t in
+                          (when - self.length, when, when + self.length))
+        order = ([ s for s in existing if s in likely ] + [ None ]
+                 + [ s for s in existing if s not in likely ])
+        for suffix in order:
+            if not missing:
+                break
+            if suffix is None:
+                collection = self._db()[base]
+            else:
+                collection = self.collection(base, suffix)
+            for doc in collection.find(
+                    { '_id': { '$in': list(missing) } }, fields = fields):
+                doc['partition'] = suffix
+                found[doc['_id']] = doc
+                missing.discard(doc['_id'])
+        return found
+
+    def drop_before(self, cutoff):
+        """
+        Drop every partition (frames, results and files) that ended before
+        cutoff.  Returns their suffixes and the bytes they took.
+        """
+        db = self._db()
+        dropped, reclaimed = [], 0
+        for suffix in self.suffixes('frame', end = cutoff):
+            if self.bounds(suffix)[1] > cutoff:
+                continue
+            for name in ('frame_%s', 'result_%s', 'fs_%s.files', 'fs_%s.chunks'):
+                name = name % suffix
+                try:
+                    reclaimed += db.command('collstats', name).get('storageSize', 0)
+                except Exception:
+                    pass # not there, or not supported (mim)
+                db.drop_collection(name)
+                self._indexed.discard(name)
+            dropped.append(suffix)
+        if dropped:
+            log.info('Dropped partitions %s, %d bytes', ', '.join(dropped), reclaimed)
+        return dropped, reclaimed
+
+def time_range(query):
+    '''The (start, end) of a query's capturetime condition, either may be None'''
+    cond = query.get('capturetime')
+    if isinstance(cond, datetime):
+        return cond, cond
+    if not isinstance(cond, dict):
+        return None, None
+    return (cond.get('$gte', cond.get('$gt')),
+            cond.get('$lte', cond.get('$lt')))
+
+_router = None
+
+def get_router():
+    '''The configured Partitioner, or None if collections aren't partitioned'''
+    global _router
+    config = Session().partitions
+    if not config:
+        return None
+    if _router is None:
+        _router = Partitioner(config.get('period', 'day'))
+    return _router
@@ -0,0 +1,140 @@
+import time
+import logging
+import threading
+from Queue import Queue, Empty
+from multiprocessing.pool import ThreadPool
+
+from . import models as M
+from .metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+class _Stop(object): pass
+
+class FrameWriter(object):
+    """
+    Saves frames in the background, so the capture thread only has to
+    queue them.  Frames are collected into batches (up to batch_size frames,
+    or whatever has arrived after interval seconds), their images are encoded
+    on a pool of encoders threads, and the batch is written with
+    Frame.bulk_save.
+
+    The queue holds at most queue_size frames; once it is full put() blocks,
+    which slows capture down rather than letting memory run away.
+
+    A batch that fails to write (mongo going away, say) is retried up to
+    retries times, waiting backoff seconds and doubling that each time (to
+    at most max_backoff).  Frames keep queueing meanwhile, so a long outage
+    pushes back on capture as above; a batch is only dropped once all its
+    retries have failed.
+
+    "writer": { "queue": 64, "batch": 16, "interval": 1.0, "encoders": 2,
+                "retries": 5, "backoff": 0.5, "max_backoff": 8.0 }
+    """
+
+    def __init__(self, queue_size = 64, batch_size = 16, interval = 1.0, encoders = 2,
+                 retries = 5, backoff = 0.5, max_backoff = 8.0):
+        self.queue = Queue(maxsize = queue_size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool = ThreadPool(encoders)
+        self.frames = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_write = 0.0
+        self.total_write = 0.0
+        self.thread = threading.Thread(target = self.run, name = 'frame-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            queue_size = config.get('queue', 64),
+            batch_size = config.get('batch', 16),
+            interval = config.get('interval', 1.0),
+            encoders = config.get('encoders', 2),
+            retries = config.get('retries', 5),
+            backoff = config.get('backoff', 0.5),
+            max_backoff = config.get('max_backoff', 8.0))
+
+    def put(self, frame):
+        self.queue.put(frame)
+
+    def stop(self):
+        '''Write out everything that is queued, then stop the writer'''
+        if not self.thread.is_alive():
+            return
+        self.queue.put(_Stop)
+        self.thread.join()
+        self.pool.close()
+
+    def run(self):
+        batch = []
+        deadline = time.time() + self.interval
+        while True:
+            try:
+                item = self.queue.get(timeout = max(0, deadline - time.time()))
+            except Empty:
+                item = None
+            if item is _Stop:
+                self._write(batch)
+                break
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.time() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.time() + self.interval
+
+    def _write(self, batch):
+        if not batch:
+            return
+        timer_start = time.time()
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                # frames from a failed attempt keep their encoding (and
+                # the files stored from it) until they are written
+                self.pool.map(_encode, [ f for f in batch if f._encoded is None ])
+                M.Frame.bulk_save(batch)
+                break
+            except Exception:
+                if attempt >= self.retries:
+                    log.exception('Failed to write %d frames, dropping them', len(batch))
+                    self.failed += len(batch)
+                    Metrics().incr('writer.failed', len(batch))
+                    return
+                log.exception('Failed to write %d frames, retrying in %.1fs',
+                              len(batch), delay)
+                attempt += 1
+                self.retried += 1
+                Metrics().incr('writer.retries')
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        elapsed = time.time() - timer_start
+        self.frames += len(batch)
+        self.batches += 1
+        self.last_write = elapsed
+        self.total_write += elapsed
+        Metrics().observe('writer.write', elapsed)
+        Metrics().incr('writer.frames', len(batch))
+
+    def stats(self):
+        return dict(
+            queued = self.queue.qsize(),
+            depth = self.queue.maxsize,
+            frames = self.frames,
+            batches = self.batches,
+            retried = self.retried,
+            failed = self.failed,
+            last_write = self.last_write,
+            mean_write = self.batches and self.total_write / self.batches or 0.0)
+
+def _encode(frame):
+    frame._encode()
@@ -0,0 +1,129 @@
+import time
+import logging
+import threading
+from Queue import Queue
+
+log = logging.getLogger(__name__)
+
+class _Stop(object):
+    '''Sentinel passed down the pipeline to shut the stages down in order'''
+    pass
+
+class Stage(object):
+    """
+    A single pipeline stage: a thread that takes items off its input queue,
+    hands them to func, and puts the result on its output queue.  Since each
+    stage is a single thread reading a FIFO, item order is preserved end to end.
+
+    Stages keep running totals of how long func takes so that the pipeline
+    can report per-stage latency.
+    """
+
+    def __init__(self, name, func, inqueue, outqueue=None):
+        self.name = name
+        self.func = func
+        self.inqueue = inqueue
+        self.outqueue = outqueue
+        self.count = 0
+        self.total_time = 0.0
+        self.last_time = 0.0
+        self.max_time = 0.0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name='pipeline-' + self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.inqueue.get()
+            if item is _Stop:
+                if self.outqueue is not None:
+                    self.outqueue.put(_Stop)
+                break
+            timer_start = time.time()
+            try:
+                result = self.func(item)
+            except Exception:
+                log.exception('Pipeline stage %s failed', self.name)
+                result = item
+            self.record(time.time() - timer_start)
+            if self.outqueue is not None:
+                self.outqueue.put(result)
+
+    def record(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        self.last_time = elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def stats(self):
+        ret = dict(
+            count=self.count,
+            last=self.last_time,
+            max=self.max_time,
+            mean=self.count and self.total_time / self.count or 0.0)
+        if self.inqueue is not None:
+            ret['queued'] = self.inqueue.qsize()
+            ret['depth'] = self.inqueue.maxsize
+        return ret
+
+class Pipeline(object):
+    """
+    Runs capture -> inspect -> check -> persist as separate threads joined
+    by bounded queues.  The capture stage is the source and is driven by
+    the caller (see SimpleSeer.run); when a downstream queue is full the
+    capture stage blocks, so a slow stage applies back-pressure rather than
+    letting memory grow without bound.
+
+    p = Pipeline(depth=4)
+    p.add_stage('inspect', seer.inspect_frames)
+    p.add_stage('persist', seer.persist_frames)
+    p.start()
+    p.put(frames)
+    p.stop()
+    """
+
+    def __init__(self, depth=4):
+        self.depth = depth
+        self.stages = []
+        self.source = Stage('capture', None, None)
+        self._inqueue = Queue(maxsize=depth)
+        self._tail = self._inqueue
+
+    def add_stage(self, name, func):
+        inqueue = self._tail
+        outqueue = Queue(maxsize=self.depth)
+        stage = Stage(name, func, inqueue, outqueue)
+        self.stages.append(stage)
+        self._tail = outqueue
+        return stage
+
+    def start(self):
+        # the last stage has nowhere to send its output
+        if self.stages:
+            self.stages[-1].outqueue = None
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, item, elapsed=None):
+        '''Push an item from the source stage. elapsed is the time the
+        source took to produce it, used for the capture stage latency.'''
+        if elapsed is not None:
+            self.source.record(elapsed)
+        self._inqueue.put(item)
+
+    def stop(self):
+        '''Drain the pipeline and wait for every stage to finish'''
+        self._inqueue.put(_Stop)
+        for stage in self.stages:
+            stage.thread.join()
+
+    def stats(self):
+        ret = dict(capture=self.source.stats())
+        for stage in self.stages:
+            ret[stage.name] = stage.stats()
+        return ret
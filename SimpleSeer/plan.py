@@ -0,0 +1,83 @@
+from . import models as M
+
+class InspectionPlan(object):
+    """
+    An in-memory snapshot of the inspection tree, built once by
+    SimpleSeer.reloadInspections() rather than re-queried for every frame.
+
+    It answers the questions the per-frame code used to ask mongo:
+    Inspection.children, Inspection.measurements, the inspection name for
+    Measurement.toResults and the measurement name for Watcher.check, and
+    keeps one instantiated plugin per inspection/measurement.  Every lookup
+    that would have been a query bumps queries_saved.
+
+    plan = InspectionPlan.load()
+    for inspection in plan.roots_for("Default Camera"):
+        features = inspection.execute(image, plan=plan)
+    """
+
+    def __init__(self, inspections, measurements, watchers):
+        self.inspections = list(inspections)
+        self.measurement_list = list(measurements)
+        self.watchers = list(watchers)
+        self.queries_saved = 0
+
+        self._inspections = dict((i.id, i) for i in self.inspections)
+        self._measurement_index = dict((m.id, m) for m in self.measurement_list)
+        self.roots = [ i for i in self.inspections if not i.parent ]
+        self._children = {}
+        for i in self.inspections:
+            if i.parent:
+                self._children.setdefault(i.parent, []).append(i)
+        self._measurements = {}
+        for m in self.measurement_list:
+            self._measurements.setdefault(m.inspection, []).append(m)
+        self._by_camera = {}
+        self._plugins = {}
+
+    @classmethod
+    def load(cls):
+        return cls(M.Inspection.objects, M.Measurement.objects, M.Watcher.objects)
+
+    def roots_for(self, camera):
+        '''Root inspections that apply to the named camera, in plan order'''
+        roots = self._by_camera.get(camera)
+        if roots is None:
+            roots = [ i for i in self.roots
+                      if not i.camera or i.camera == camera ]
+            self._by_camera[camera] = roots
+        return roots
+
+    def inspection(self, id):
+        return self._inspections[id]
+
+    def children(self, inspection):
+        self.queries_saved += 1
+        return self._children.get(inspection.id, [])
+
+    def measurements(self, inspection):
+        self.queries_saved += 1
+        return self._measurements.get(inspection.id, [])
+
+    def inspection_name(self, id):
+        self.queries_saved += 1
+        inspection = self._inspections.get(id)
+        if inspection is None:
+            return M.Inspection.objects.get(id=id).name
+        return inspection.name
+
+    def measurement_name(self, id):
+        self.queries_saved += 1
+        measurement = self._measurement_index.get(id)
+        if measurement is None:
+            return M.Measurement.objects.get(id=id).name
+        return measurement.name
+
+    def plugin(self, doc):
+        '''The instantiated plugin for an inspection or measurement'''
+        key = (doc.__class__.__name__, doc.id)
+        plugin = self._plugins.get(key)
+        if plugin is None or doc.id is None:
+            plugin = doc.get_plugin(doc.method)
+            self._plugins[key] = plugin
+        return plugin
@@ -85,7 +85,8 @@ class KeypointTemplate(base.InspectionPlugin):
         #print type(f._minRect)
         f.contour = [f._minRect[0],f._minRect[1],f._minRect[2],f._minRect[3]]
         ff = M.FrameFeature()
-        ff.setFeature(f)
+        # crop and the rest need _minRect, which isn't in featuredata
+        ff.setFeature(f, keep_pickle = True)
         retVal.append(ff)
 
     if( params.has_key("saveFile") ):
@@ -37,6 +37,9 @@ class MotionFeature(SimpleCV.Feature):
     self.y = top + self.height() / 2
 
 class Motion(base.InspectionPlugin):
+  # compares against the seer's previous frames, which only exist in the
+  # capture process
+  parallel = False
   
   @classmethod
   def coffeescript(cls):
@@ -57,9 +60,10 @@ plugin this, MotionFeature:MotionFeature
 
   def __call__(self, image):
     SS = util.get_seer()
-    if len(SS.lastframes) > 1:
+    previous = SS.previous_frames()
+    if previous:
       #TODO, find the index of the named camera
-      lastframe = SS.lastframes[-2][0]
+      lastframe = previous[0]
       lastimage = lastframe.image
     else:
       return None
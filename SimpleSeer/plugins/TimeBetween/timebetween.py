@@ -39,7 +39,7 @@ class TimeBetweenMeasurement(base.MeasurementPlugin):
         else:
             insp2 = insp #we test time between measurements from the same inspection
                     
-        results1 = M.Result.objects(inspection = insp2).order_by("-capturetime")
+        results1 = M.Result.latest(1, inspection = insp2)
         if not len(results1):
             return []
             
@@ -50,7 +50,7 @@ class TimeBetweenMeasurement(base.MeasurementPlugin):
         if not showneg or insp == insp2:
             r2param["capturetime__lt"] = r1.capturetime
             
-        results2 = M.Result.objects(**r2param).order_by("-capturetime")
+        results2 = M.Result.latest(1, **r2param)
         if not len(results2):
             return []
             
@@ -59,7 +59,7 @@ class TimeBetweenMeasurement(base.MeasurementPlugin):
         maxtime = max(r2.capturetime, r1.capturetime)
         if self.measurement.id:
             #TODO, we can check the SS.results array as well
-            if len(M.Result.objects(measurement = self.measurement.id, capturetime__gte = maxtime)):
+            if len(M.Result.latest(1, measurement = self.measurement.id, capturetime__gte = maxtime)):
                 return [] 
         
         if r1.capturetime > r2.capturetime:
@@ -1,6 +1,9 @@
 import os as os
 
 class InspectionPlugin(object):
+    # plugins that depend on state in the capture process (lastframes, etc)
+    # must set this to False so they are never sent to a worker process
+    parallel = True
 
     def __init__(self, inspection):
         self.inspection = inspection
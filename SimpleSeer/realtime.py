@@ -7,6 +7,7 @@ from socketio.namespace import BaseNamespace
 
 from .Session import Session
 from .base import jsonencode, jsondecode
+from .metrics import timed
 
 log = logging.getLogger(__name__)
 
@@ -32,6 +33,7 @@ class ChannelManager(object):
                 l.append('    %r' % qs)
         return '\n'.join(l)
 
+    @timed('publish')
     def publish(self, channel, message):
         '''Publish a JSON message over the channel. Note that while it would be
         nice to use a compact and fast encoding like BSON, these messages need to
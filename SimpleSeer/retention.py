@@ -0,0 +1,200 @@
+import time
+import calendar
+import logging
+from datetime import datetime, timedelta
+
+import bson
+
+from . import models as M
+from . import imagestore
+from .partition import get_router
+from .metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+# what each tier takes off the frames older than its age
+DROPS = dict(
+    thumbnails=('imgfile', 'layerfile', 'imgref', 'layerref'),
+    metadata=('imgfile', 'layerfile', 'imgref', 'layerref',
+              'thumbnail_file', 'thumbnails'))
+
+class Retention(object):
+    """
+    Tiered retention for the scrubber.  Configured under "retention":
+
+    "retention": {
+        "interval": 600.0,
+        "tiers": [
+            { "age": 86400, "keep": "thumbnails" },
+            { "age": 2592000, "keep": "metadata" },
+            { "age": 31536000, "keep": "nothing" } ],
+        "batch": 500,
+        "max_bytes_per_second": 20971520
+    }
+
+    Frames older than a tier's age (in seconds) keep only:
+      - thumbnails: the thumbnails; the image and overlay are deleted
+      - metadata: the frame document; all of its files are deleted
+      - nothing: the frame and its results are deleted outright
+
+    "maxframes" (the old policy) still works: every frame but the newest
+    maxframes loses its image and overlay, as before, and keeps its
+    thumbnails.
+
+    Files are deleted batch frames at a time, with one remove each on
+    fs.files and fs.chunks and one update of the frames, and frames by
+    capturetime range.  With max_bytes_per_second set, the scrubber sleeps
+    between batches to stay under it.  Segment store files are deleted a
+    whole segment at a time: image and overlay segments once everything in
+    them is past the newest tier, thumbnail segments once it's past the
+    metadata tier.  With time partitioned collections, the nothing tier
+    drops the partitions that are entirely past it.
+    """
+
+    def __init__(self, config):
+        self.interval = config.get('interval', 0)
+        self.tiers = config.get('tiers', [])
+        self.maxframes = config.get('maxframes', 0)
+        self.batch = config.get('batch', 500)
+        self.max_bytes_per_second = config.get('max_bytes_per_second', 0)
+
+    def cutoffs(self, now):
+        '''(keep, capturetime cutoff) for each tier, oldest cutoff first'''
+        result = [
+            (tier['keep'], now - timedelta(seconds=tier['age']))
+            for tier in self.tiers ]
+        if self.maxframes:
+            # by way of search, so frames in every partition are counted
+            total, oldest = M.Frame.search(
+                {}, [('capturetime', -1)], self.maxframes, 1, 'summary')
+            if oldest:
+                result.append(
+                    ('thumbnails', oldest[0].capturetime + timedelta(milliseconds=1)))
+        return sorted(result, key=lambda (keep, cutoff): cutoff)
+
+    def run(self, now=None):
+        '''One pass over every tier.  Returns what was reclaimed.'''
+        now = now or datetime.utcnow()
+        self._started = time.time()
+        self._reclaimed = 0
+        self._dropped = []
+        tiers = []
+        # newest cutoff past which frames lose images, and thumbnails
+        cutoffs = dict(images=None, thumbnails=None)
+        for keep, cutoff in self.cutoffs(now):
+            if keep == 'nothing':
+                frames = self._delete(cutoff)
+            else:
+                frames = self._strip(cutoff, DROPS[keep])
+            cutoffs['images'] = cutoff
+            if keep != 'thumbnails':
+                cutoffs['thumbnails'] = cutoff
+            tiers.append(dict(
+                keep=keep, before=cutoff, frames=frames,
+                bytes=self._reclaimed - sum(t['bytes'] for t in tiers)))
+
+        segments = []
+        store = imagestore.get_store()
+        if store is not None:
+            for kind, cutoff in (('', cutoffs['images']),
+                                 ('thumbnails', cutoffs['thumbnails'])):
+                if cutoff is None:
+                    continue
+                deleted, reclaimed = store.delete_before(
+                    calendar.timegm(cutoff.timetuple()), kind)
+                segments.extend(deleted)
+                self._reclaimed += reclaimed
+
+        report = dict(
+            tiers=tiers, segments=len(segments), partitions=self._dropped,
+            bytes=self._reclaimed,
+            seconds=time.time() - self._started)
+        Metrics().incr('retention.bytes', self._reclaimed)
+        log.info('Retention reclaimed %d bytes in %.1fs: %s',
+                 self._reclaimed, report['seconds'],
+                 ', '.join('%(frames)d frames to %(keep)s' % t for t in tiers))
+        return report
+
+    def _frame_collections(self, cutoff):
+        '''(collection, GridFS bucket name) for frames captured before cutoff'''
+        router = get_router()
+        if router is None:
+            return [ (M.Frame._get_collection(), 'fs') ]
+        return [ (collection, suffix and 'fs_' + suffix or 'fs')
+                 for suffix, collection in router.collections('frame', end=cutoff) ]
+
+    def _strip(self, cutoff, fields):
+        '''Delete fields' files from every frame captured before cutoff'''
+        return sum(
+            self._strip_collection(collection, bucket, cutoff, fields)
+            for collection, bucket in self._frame_collections(cutoff))
+
+    def _strip_collection(self, collection, bucket, cutoff, fields):
+        query = {
+            'capturetime': { '$lt': cutoff },
+            '$or': [ { f: { '$nin': [ None, {} ] } } for f in fields ] }
+        frames = 0
+        while True:
+            docs = list(collection.find(query, fields=fields)
+                        .sort('capturetime', 1).limit(self.batch))
+            if not docs:
+                break
+            grid_ids = []
+            for doc in docs:
+                for field in fields:
+                    value = doc.get(field)
+                    if field == 'thumbnails':
+                        grid_ids.extend(
+                            v for v in (value or {}).values()
+                            if isinstance(v, bson.ObjectId))
+                    elif isinstance(value, bson.ObjectId):
+                        grid_ids.append(value)
+            self._reclaimed += self._delete_files(grid_ids, bucket)
+            # segment refs just go; the segments are deleted whole in run()
+            collection.update(
+                { '_id': { '$in': [ doc['_id'] for doc in docs ] } },
+                { '$unset': dict((field, 1) for field in fields) },
+                multi=True)
+            frames += len(docs)
+            self._throttle()
+        return frames
+
+    def _delete(self, cutoff):
+        '''Delete the frames captured before cutoff, their files and results'''
+        frames = 0
+        router = get_router()
+        result_collections = [ M.Result._get_collection() ]
+        if router is not None:
+            dropped, reclaimed = router.drop_before(cutoff)
+            self._dropped.extend(dropped)
+            self._reclaimed += reclaimed
+            result_collections = [
+                c for s, c in router.collections('result', end=cutoff) ]
+        self._strip(cutoff, DROPS['metadata'])
+        query = { 'capturetime': { '$lt': cutoff } }
+        for collection, bucket in self._frame_collections(cutoff):
+            frames += collection.find(query).count()
+            collection.remove(query)
+        for collection in result_collections:
+            collection.remove(query)
+        return frames
+
+    def _delete_files(self, grid_ids, bucket='fs'):
+        '''Delete GridFS files in bulk, returning their total size'''
+        if not grid_ids:
+            return 0
+        db = M.Frame._get_db()
+        query = { '_id': { '$in': grid_ids } }
+        files, chunks = db[bucket + '.files'], db[bucket + '.chunks']
+        size = sum(f.get('length', 0) for f in files.find(query, fields=['length']))
+        files.remove(query)
+        chunks.remove({ 'files_id': { '$in': grid_ids } })
+        return size
+
+    def _throttle(self):
+        if not self.max_bytes_per_second:
+            return
+        ahead = (self._reclaimed / float(self.max_bytes_per_second)
+                 - (time.time() - self._started))
+        if ahead > 0:
+            time.sleep(ahead)
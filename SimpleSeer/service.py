@@ -18,11 +18,15 @@ class SeerProxy2(object):
 
     @property
     def lastframes(self):
+        return self.get_lastframes()
+
+    def get_lastframes(self, projection='full'):
+        '''The seer's last frames, with only the fields of projection loaded'''
         frame_ids = self.get_last_frame_ids()
         all_ids = [ id for id in chain(*frame_ids)
                     if id is not None ]
-        frame_index = dict(
-            (f.id, f) for f in M.Frame.objects(id__in=all_ids))
+        found = M.Frame.by_ids(all_ids, projection)
+        frame_index = dict((f.id, f) for f in found if f is not None)
         frames = [
             [ frame_index.get(id) for id in ids ]
             for ids in frame_ids ]
@@ -31,9 +35,7 @@ class SeerProxy2(object):
     def get_frame(self, index=-1, camera=0):
         id = self.get_frame_id(index, camera)
         if id is None: return None
-        objs = M.Frame.objects(id=id)
-        if objs: return objs[0]
-        return None
+        return M.Frame.by_id(id)
 
     def register_plugins(self):
         '''Plugins must be registered 'locally' to work right'''
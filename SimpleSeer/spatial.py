@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+import numpy as np
+
+def points_in_polygon(points, polygon):
+    """
+    Which of points (an N x 2 array-like) are inside polygon (a list of
+    (x, y) vertices), by ray casting over every edge at once.  Returns a
+    boolean array of N; polygons with fewer than three vertices contain
+    nothing.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    if len(poly) < 3:
+        return np.zeros(len(points), dtype=bool)
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = poly[:, 0], poly[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    dy = y2 - y1
+    vertical = x1 == x2
+    horizontal = dy == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xinters = (y - y1) * (x2 - x1) / np.where(horizontal, 1, dy) + x1
+    crosses = ((y > np.minimum(y1, y2)) & (y <= np.maximum(y1, y2))
+               & (x <= np.maximum(x1, x2))
+               & (vertical | (x <= xinters)))
+    return np.logical_xor.reduce(crosses, axis=1)
+
+def points_in_polygons(points, polygons):
+    '''A (points x polygons) boolean array: which polygons hold each point'''
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    result = np.zeros((len(points), len(polygons)), dtype=bool)
+    for i, polygon in enumerate(polygons):
+        result[:, i] = points_in_polygon(points, polygon)
+    return result
+
+def bounds(polygon):
+    '''(xmin, ymin, xmax, ymax) of a list of points, None if there are none'''
+    if polygon is None or not len(polygon):
+        return None
+    poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    xmin, ymin = poly.min(axis=0)
+    xmax, ymax = poly.max(axis=0)
+    return xmin, ymin, xmax, ymax
+
+class FeatureIndex(object):
+    """
+    A bounding box grid over a frame's features (anything with points),
+    so that finding the features at a point or in a region looks only at
+    the features in the grid cells it touches, not at every feature.
+
+    cell is the grid size in pixels; features bigger than a few cells
+    cover more of them, which is fine unless most features are that big.
+    """
+
+    def __init__(self, features, cell=64):
+        self.features = list(features)
+        self.cell = float(cell)
+        self.bounds = [ bounds(f.points) for f in self.features ]
+        self.grid = defaultdict(list)
+        for i, box in enumerate(self.bounds):
+            if box is None:
+                continue
+            for key in self._cells(box):
+                self.grid[key].append(i)
+
+    def _cells(self, box):
+        xmin, ymin, xmax, ymax = [ int(v // self.cell) for v in box ]
+        for cx in xrange(xmin, xmax + 1):
+            for cy in xrange(ymin, ymax + 1):
+                yield cx, cy
+
+    def _candidates(self, box):
+        result = set()
+        for key in self._cells(box):
+            result.update(self.grid.get(key, ()))
+        return sorted(result)
+
+    def at(self, point):
+        '''The features whose polygons hold point'''
+        x, y = point
+        return [ self.features[i] for i in self._candidates((x, y, x, y))
+                 if points_in_polygon([point], self.features[i].points)[0] ]
+
+    def hits(self, points):
+        """
+        For many points (clicks, or a child feature's centres) at once: a
+        list, for each point, of the indexes of the features holding it.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        keys = np.floor(points / self.cell).astype(int).tolist()
+        near = defaultdict(list)
+        for j, key in enumerate(keys):
+            for i in self.grid.get(tuple(key), ()):
+                near[i].append(j)
+        result = [ [] for p in points ]
+        for i in sorted(near):
+            js = np.array(near[i])
+            inside = points_in_polygon(points[js], self.features[i].points)
+            for j in js[inside]:
+                result[j].append(i)
+        return result
+
+    def overlapping(self, box):
+        '''The features whose bounding boxes overlap box (xmin, ymin, xmax, ymax)'''
+        xmin, ymin, xmax, ymax = box
+        result = []
+        for i in self._candidates(box):
+            fxmin, fymin, fxmax, fymax = self.bounds[i]
+            if fxmin <= xmax and fxmax >= xmin and fymin <= ymax and fymax >= ymin:
+                result.append(self.features[i])
+        return result
+
+    def within(self, polygon):
+        '''The features with every point inside polygon (a parent region, say)'''
+        result = []
+        for feature in self.overlapping(bounds(polygon)):
+            if points_in_polygon(feature.points, polygon).all():
+                result.append(feature)
+        return result
@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime
+
+import mock
+import numpy as np
+from SimpleCV import Image
+
+from SimpleSeer import models as M
+from SimpleSeer.executor import InspectionExecutor
+from SimpleSeer.plan import InspectionPlan
+from .. import utils
+
+class _Applied(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+class _Pool(object):
+    '''Runs work items in this process, remembering what was sent'''
+
+    def __init__(self, *args):
+        self.sent = []
+
+    def apply_async(self, func, args):
+        self.sent.append(args)
+        return _Applied(func(*args))
+
+class _Plugin(object):
+
+    def __init__(self, parallel, x):
+        self.parallel = parallel
+        self.x = x
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        return [ M.FrameFeature(
+                featuretype='Blob', x=self.x, y=float(image.height),
+                points=[(0, 0), (4, 0), (4, 4)]) ]
+
+class TestInspectionExecutor(unittest.TestCase):
+
+    def setUp(self):
+        utils.register_mim_connection()
+        M.Inspection.objects.delete()
+        M.Measurement.objects.delete()
+        self.local = M.Inspection(name='local', method='local')
+        self.local.save()
+        self.remote = M.Inspection(name='remote', method='remote')
+        self.remote.save()
+        self.plugins = dict(
+            local=_Plugin(False, 1.0), remote=_Plugin(True, 2.0))
+        patches = [
+            mock.patch.object(
+                InspectionPlan, 'plugin',
+                lambda plan, doc: self.plugins[doc.method]),
+            mock.patch('SimpleSeer.executor.multiprocessing.Pool', _Pool),
+            mock.patch('SimpleSeer.executor.Session'),
+            # a fresh worker, which loads the plan on its first work item
+            mock.patch.dict(
+                'SimpleSeer.executor._worker', version=None, plan=None) ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.executor = InspectionExecutor(2)
+        self.plan = InspectionPlan.load()
+
+    def _frames(self, n):
+        frames = []
+        for i in range(n):
+            frame = M.Frame(camera='test', capturetime=datetime.utcnow())
+            frame.image = Image(np.zeros((8, 6, 3), dtype=np.uint8))
+            frames.append(frame)
+        return frames
+
+    def test_parallel_split(self):
+        frames = self._frames(2)
+        self.executor.inspect(frames, self.plan)
+        # only the parallel plugin's work goes to the pool, once per frame
+        self.assertEqual(
+            [ args[4] for args in self.executor.pool.sent ],
+            [ self.remote.id ] * 2)
+        self.assertEqual(self.plugins['local'].calls, 2)
+        self.assertEqual(self.plugins['remote'].calls, 2)
+        for frame in frames:
+            self.assertEqual(
+                [ f.inspection for f in frame.features ],
+                [ self.local.id, self.remote.id ])
+
+    def test_skip(self):
+        frames = self._frames(1)
+        self.executor.inspect(frames, self.plan, skip=('remote',))
+        self.assertEqual(self.executor.pool.sent, [])
+        self.assertEqual(
+            [ f.inspection for f in frames[0].features ], [ self.local.id ])
+
+    def test_worker_features_rebuilt(self):
+        frames = self._frames(1)
+        self.executor.inspect(frames, self.plan)
+        feature = frames[0].features[1]
+        # features come back from the worker as SON, through _from_son
+        self.assertIsInstance(feature, M.FrameFeature)
+        self.assertEqual(feature.featuretype, 'Blob')
+        self.assertEqual(feature.x, 2.0)
+        self.assertEqual(feature.y, 6.0)
+        self.assertEqual(feature.plainpoints, [(0, 0), (4, 0), (4, 4)])
+
+    def test_worker_queries_saved(self):
+        frames = self._frames(2)
+        # each worker item asks its plan for children and measurements
+        self.assertEqual(self.executor.inspect(frames, self.plan), 4)
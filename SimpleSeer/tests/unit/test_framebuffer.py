@@ -0,0 +1,52 @@
+import unittest
+
+from SimpleSeer.framebuffer import FrameBuffer
+
+class _Frame(object):
+
+    def __init__(self, width=10, height=10):
+        self.width, self.height = width, height
+
+class TestFrameBuffer(unittest.TestCase):
+
+    def test_capacity(self):
+        buf = FrameBuffer(3)
+        for x in xrange(5):
+            buf.append([x])
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(list(buf), [[2], [3], [4]])
+
+    def test_indexing(self):
+        buf = FrameBuffer(3)
+        for x in xrange(4):
+            buf.append([x])
+        self.assertEqual(buf[0], [1])
+        self.assertEqual(buf[-1], [3])
+        self.assertEqual(buf[-2], [2])
+        self.assertEqual(buf[1:], [[2], [3]])
+        self.assertRaises(IndexError, buf.__getitem__, 3)
+        self.assertRaises(IndexError, buf.__getitem__, -4)
+
+    def test_max_bytes(self):
+        buf = FrameBuffer(10, max_bytes=1000)
+        for x in xrange(5):
+            buf.append([_Frame()])
+        # 300 bytes per frameset
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(buf.nbytes, 900)
+
+    def test_keeps_newest(self):
+        buf = FrameBuffer(10, max_bytes=100)
+        big = [_Frame(100, 100)]
+        buf.append([_Frame()])
+        buf.append(big)
+        self.assertEqual(len(buf), 1)
+        assert buf[-1] is big
+
+    def test_snapshot_is_stable(self):
+        buf = FrameBuffer(2)
+        buf.append([0])
+        buf.append([1])
+        snap = buf.snapshot()
+        buf.append([2])
+        self.assertEqual(snap, ([0], [1]))
@@ -0,0 +1,57 @@
+import unittest
+
+import mock
+import numpy as np
+from SimpleCV.ImageClass import Image
+
+from SimpleSeer import imagecodec
+
+class TestPackArray(unittest.TestCase):
+
+    def setUp(self):
+        self.arr = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+
+    def test_roundtrip(self):
+        for compress in (None, 'zlib'):
+            result = imagecodec.unpack_array(
+                imagecodec.pack_array(self.arr, compress))
+            self.assertEqual(result.dtype, self.arr.dtype)
+            self.assertEqual(result.shape, self.arr.shape)
+            assert (result == self.arr).all()
+
+    def test_not_packed(self):
+        self.assertRaises(ValueError, imagecodec.unpack_array, 'garbage!')
+        self.assertRaises(ValueError, imagecodec.unpack_array, 'SP')
+
+class TestCodecs(unittest.TestCase):
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, imagecodec.get_codec, 'gif')
+
+    def test_raw_is_lossless(self):
+        img = Image('lenna')
+        codec = imagecodec.get_codec('raw', compress='zlib')
+        result = codec.decode(codec.encode(img))
+        self.assertEqual(result.size(), img.size())
+        assert (result.getNumpy() == img.getNumpy()).all()
+
+    def test_jpeg_quality(self):
+        img = Image('lenna')
+        big = imagecodec.get_codec('jpeg', quality=100).encode(img)
+        small = imagecodec.get_codec('jpeg', quality=50).encode(img)
+        assert len(small) < len(big)
+
+    def test_png_roundtrip(self):
+        img = Image('lenna')
+        codec = imagecodec.get_codec('png', compress_level=1)
+        self.assertEqual(codec.decode(codec.encode(img)).size(), img.size())
+
+    @mock.patch('SimpleSeer.imagecodec.Session')
+    def test_camera_codec_reload(self, Session):
+        Session().cameras = [ dict(name='a', codec=dict(name='png')) ]
+        codec = imagecodec.codec_for_camera('a')
+        self.assertEqual(codec.name, 'png')
+        assert imagecodec.codec_for_camera('a') is codec
+        # a reloaded config is a new cameras list
+        Session().cameras = [ dict(name='a', codec=dict(name='raw')) ]
+        self.assertEqual(imagecodec.codec_for_camera('a').name, 'raw')
@@ -0,0 +1,69 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from SimpleSeer.imagestore import SegmentStore, segment_kind
+
+class TestSegmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = SegmentStore(self.path, segment_bytes = 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_put_get(self):
+        a = self.store.put('hello', 'text/plain')
+        b = self.store.put('world')
+        self.assertEqual(self.store.get(a), 'hello')
+        self.assertEqual(self.store.get(b), 'world')
+        self.assertEqual(a['content_type'], 'text/plain')
+        self.assertEqual(a['segment'], b['segment'])
+
+    def test_rolls_over(self):
+        a = self.store.put('x' * 10)
+        b = self.store.put('y')
+        self.assertNotEqual(a['segment'], b['segment'])
+        self.assertEqual(self.store.get(a), 'x' * 10)
+        self.assertEqual(len(self.store.segments()), 2)
+
+    def test_delete_before(self):
+        a = self.store.put('x' * 10)
+        time.sleep(0.002)
+        b = self.store.put('y')
+        deleted, reclaimed = self.store.delete_before(time.time() + 1)
+        # the segment being written to is kept
+        self.assertEqual(deleted, [ a['segment'] ])
+        self.assertEqual(reclaimed, 10)
+        self.assertEqual(self.store.get(a), None)
+        self.assertEqual(self.store.get(b), 'y')
+
+    def test_kinds(self):
+        image = self.store.put('x' * 10)
+        thumbnail = self.store.put('t', 'image/jpeg', 'thumbnails')
+        self.assertNotEqual(image['segment'], thumbnail['segment'])
+        self.assertEqual(segment_kind(thumbnail['segment']), 'thumbnails')
+        time.sleep(0.002)
+        self.store.put('y') # so the first image segment isn't being written
+        self.store.put('u' * 10, kind = 'thumbnails')
+        time.sleep(0.002)
+        self.store.put('v', kind = 'thumbnails')
+        deleted, reclaimed = self.store.delete_before(time.time() + 1)
+        # only image segments go; thumbnails are kept until their own cutoff
+        self.assertEqual(deleted, [ image['segment'] ])
+        self.assertEqual(self.store.get(thumbnail), 't')
+        deleted, reclaimed = self.store.delete_before(time.time() + 1, 'thumbnails')
+        self.assertEqual(deleted, [ thumbnail['segment'] ])
+        self.assertEqual(self.store.get(thumbnail), None)
+
+    def test_unique_segments(self):
+        # another store (a restarted core, say) writing to the same path
+        other = SegmentStore(self.path, segment_bytes = 1)
+        refs = [ store.put('z') for i in range(20) for store in (self.store, other) ]
+        refs = [ r for r in refs if r['offset'] == 0 ]
+        self.assertEqual(len(set(r['segment'] for r in refs)), len(refs))
+        for ref in refs:
+            self.assertEqual(self.store.get(ref), 'z')
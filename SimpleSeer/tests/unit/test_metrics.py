@@ -0,0 +1,49 @@
+import unittest
+
+from SimpleSeer.metrics import Histogram, Metrics, timed
+
+class TestHistogram(unittest.TestCase):
+
+    def test_observe(self):
+        hist = Histogram()
+        for x in xrange(100):
+            hist.observe(0.001)
+        hist.observe(3.0)
+        self.assertEqual(hist.count, 101)
+        self.assertEqual(hist.max, 3.0)
+        self.assertEqual(hist.quantile(0.5), 0.001)
+        self.assertEqual(hist.quantile(1.0), 5.0)
+
+    def test_empty(self):
+        self.assertEqual(Histogram().quantile(0.99), 0.0)
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        Metrics().reset()
+
+    def test_timer(self):
+        with Metrics().timer('test.block'):
+            pass
+        self.assertEqual(Metrics().timers['test.block'].count, 1)
+
+    def test_timed(self):
+        @timed('test.func')
+        def f(x):
+            return x + 1
+        self.assertEqual(f(1), 2)
+        self.assertEqual(Metrics().timers['test.func'].count, 1)
+
+    def test_render(self):
+        Metrics().observe('frame.save', 0.002)
+        Metrics().incr('frames', 3)
+        text = Metrics().render()
+        assert 'seer_frame_save_count 1\n' in text
+        assert 'seer_frame_save_bucket{le="+Inf"} 1\n' in text
+        assert 'seer_frames 3\n' in text
+
+    def test_render_gauges(self):
+        text = Metrics().render({
+                'writer.queued': 4, 'capture.latency{camera="a"}': 0.5 })
+        assert 'seer_writer_queued 4\n' in text
+        assert 'seer_capture_latency{camera="a"} 0.5\n' in text
@@ -1,12 +1,22 @@
+import sys
+import calendar
 import unittest
-from datetime import datetime
+from cStringIO import StringIO
+from datetime import datetime, timedelta
 
+import bson
 import mock
+import numpy as np
 from SimpleCV.ImageClass import Image
 
 from SimpleSeer import models as M
+from SimpleSeer.models.FrameFeature import _pack, _plain, _numpy_save, _numpy_load
 from .. import utils
 
+# SimpleSeer.models.Frame is the class; these are the modules
+frame_module = sys.modules['SimpleSeer.models.Frame']
+olap_module = sys.modules['SimpleSeer.models.OLAP']
+
 class TestFrame(unittest.TestCase):
 
     @mock.patch('SimpleSeer.realtime.ChannelManager')
@@ -33,3 +43,238 @@ class TestFrame(unittest.TestCase):
         assert result['content_type'] in ('image/webp', 'image/jpeg')
         
         
+
+    def test_thumbnail_smallest(self):
+        frame = self.frame
+        jpegs = {}
+        for width in (200, 50):
+            s = StringIO()
+            frame.image.scale(width / float(frame.image.width)).save(s, 'jpeg')
+            jpegs[width] = s.getvalue()
+            frame.thumbnails[str(width)] = frame._fs().put(jpegs[width])
+        self.assertEqual(frame.thumbnail.width, 50)
+        self.assertEqual(frame.thumbnail_data(100), jpegs[200])
+        self.assertEqual(frame.thumbnail_data(500), jpegs[200])
+
+    @mock.patch('SimpleSeer.realtime.ChannelManager')
+    def test_degraded_roundtrip(self, cm):
+        frame = M.Frame(capturetime=datetime.utcnow(), camera='test')
+        frame.image = Image('lenna')
+        width, height = frame.width, frame.height
+        frame._save_width = width / 4
+        frame.save()
+        # the frame in memory keeps its full image
+        self.assertEqual(frame.image.size(), (width, height))
+        saved = M.Frame.objects.get(id=frame.id)
+        self.assertEqual((saved.width, saved.height), (width, height))
+        self.assertAlmostEqual(saved.imgscale, 0.25, 2)
+        stored = saved.codec.decode(saved.image_data())
+        self.assertEqual(stored.width, width / 4)
+        self.assertEqual(saved.image.size(), (width, height))
+
+    @mock.patch('SimpleSeer.realtime.ChannelManager')
+    @mock.patch.object(frame_module, 'get_router')
+    def test_partition_without_image(self, get_router, cm):
+        router = get_router.return_value
+        router.suffix.return_value = '20120601'
+        frame = M.Frame(capturetime=datetime(2012, 6, 1), camera='test')
+        frame.save()
+        self.assertEqual(frame.partition, '20120601')
+        router.collection.assert_called_with('frame', '20120601')
+
+    def test_result_mongo_query(self):
+        m, t = bson.ObjectId(), datetime(2012, 6, 1)
+        self.assertEqual(
+            M.Result.mongo_query(
+                measurement=m, capturetime__gt=t, capturetime__lte=t,
+                id__in=[ m ]),
+            { 'measurement': m, 'capturetime': { '$gt': t, '$lte': t },
+              '_id': { '$in': [ m ] } })
+
+    @mock.patch.object(olap_module, 'RealtimeOLAP')
+    def test_save_results(self, olap):
+        frame = M.Frame.objects[0]
+        frame.results = [
+            M.ResultEmbed(result_id=bson.ObjectId(), numeric=float(i), string=str(i))
+            for i in range(3) ]
+        frame._save_results()
+        frame.results[0].numeric = 10.0
+        frame._save_results() # saving again replaces the results
+        self.assertEqual(M.Result.objects(frame=frame.id).count(), 3)
+        self.assertEqual(
+            M.Result.objects.get(id=frame.results[0].result_id).numeric, 10.0)
+        self.assertEqual(olap().realtime_batch.call_count, 2)
+
+    @mock.patch.object(olap_module, 'RealtimeOLAP')
+    def test_resave_results_upserts(self, olap):
+        from pymongo.errors import DuplicateKeyError
+        result = M.Result(id=bson.ObjectId(), numeric=1.0)
+        collection = mock.Mock()
+        collection.insert.side_effect = DuplicateKeyError('dup')
+        with mock.patch.object(M.Result, '_get_collection', return_value=collection):
+            M.Result.bulk_save([ result ])
+        # earlier copies are replaced in place, never removed first
+        self.assertFalse(collection.remove.called)
+        collection.update.assert_called_once_with(
+            { '_id': result.id }, mock.ANY, upsert=True, safe=True)
+
+    def test_search_query(self):
+        query = M.Frame.search_query({
+                'camera': 'test',
+                'capturetime': {},
+                'results.numeric': {'$gt': 5},
+                'results.inspection_name': 'blobs' })
+        self.assertEqual(query, {
+                'camera': 'test',
+                'results': {'$elemMatch': {
+                        'numeric': {'$gt': 5},
+                        'inspection_name': 'blobs' } } })
+
+    def test_summary_projection(self):
+        total, frames = M.Frame.search(
+            {'camera': 'test'}, [('capturetime', -1)], 0, 10, 'summary')
+        assert total >= 1
+        state = frames[0].state('summary')
+        self.assertEqual(
+            sorted(state),
+            ['camera', 'capturetime', 'id', 'passed', 'thumbnail'])
+        self.assertRaises(ValueError, M.Frame.projection_fields, 'everything')
+
+class TestRealtimeOLAP(unittest.TestCase):
+
+    @mock.patch.object(olap_module, 'Measurement')
+    @mock.patch.object(olap_module, 'OLAP')
+    def test_batch_crosses_windows(self, OLAP, Measurement):
+        measurement = mock.Mock(id=bson.ObjectId())
+        Measurement.objects.return_value = [ measurement ]
+        olap = mock.Mock(
+            queryInfo=dict(objType='measurement', objName='area'),
+            descInfo=dict(formula='mean', window=60))
+        olap.execute.return_value = dict(data=[])
+        OLAP.objects = [ olap ]
+        start = calendar.timegm(datetime(2012, 6, 1, 12).timetuple())
+        results = [
+            M.Result(measurement=measurement.id,
+                     capturetime=datetime(2012, 6, 1, 12) + timedelta(seconds=s))
+            for s in (10, 70, 80, 130) ]
+        realtime = olap_module.RealtimeOLAP()
+        with mock.patch.object(realtime, 'lastResult', return_value=start + 5):
+            realtime.realtime_batch(results)
+        # 12:01 is crossed part way through the batch, 12:02 at its end
+        self.assertEqual(olap.execute.call_args_list, [
+                mock.call(sincetime=start), mock.call(sincetime=start + 60) ])
+
+class TestFrameFeature(unittest.TestCase):
+
+    def setUp(self):
+        img = Image('lenna')
+        self.blob = img.findBlobs()[-1]
+
+    def test_compact(self):
+        ff = M.FrameFeature()
+        ff.setFeature(self.blob)
+        son = ff.to_mongo()
+        assert isinstance(son['points'], bson.Binary)
+        assert isinstance(son['featuredata']['mContour'], bson.Binary)
+        assert 'featurepickle' not in son and 'featurepickle_b64' not in son
+
+    def test_rehydrate(self):
+        ff = M.FrameFeature()
+        ff.setFeature(self.blob)
+        loaded = M.FrameFeature._from_son(ff.to_mongo())
+        feature = loaded.feature
+        self.assertEqual(feature.__class__, self.blob.__class__)
+        self.assertEqual(feature.mContour, list(self.blob.mContour))
+        self.assertEqual(loaded.__getstate__()['points'], list(self.blob.points))
+
+    def test_equal_length_contours(self):
+        contours = [ [(0, 0), (4, 0), (4, 4)], [(1, 1), (5, 1), (5, 5)] ]
+        packed = _pack(contours)
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(
+            [ _plain(c) for c in packed ], contours)
+        # short Binaries aren't packed arrays, they aren't errors
+        self.assertEqual(_plain(bson.Binary('abc')), bson.Binary('abc'))
+
+    def test_plan(self):
+        ff = M.FrameFeature()
+        ff.setFeature(self.blob)
+        plan = M.FrameFeature._plans[self.blob.__class__]
+        self.assertEqual(plan['mContour'], _pack)
+        self.assertEqual(plan['points'], None) # a field of its own
+        self.assertEqual(plan['image'], None)
+        self.assertEqual(sorted(ff.featuredata),
+                         sorted(k for k, v in plan.items() if v is not None))
+
+def _round_trip(feature, keep_pickle = False):
+    '''feature as it comes back from the database (or an inspection worker)'''
+    ff = M.FrameFeature()
+    ff.setFeature(feature, keep_pickle)
+    return M.FrameFeature._from_son(ff.to_mongo()).feature
+
+class TestPluginFeatures(unittest.TestCase):
+    """
+    The feature methods callers use after a round trip: the histogram view
+    and Inspection's child ROIs crop with the frame's image put back,
+    BlobRadius calls radius(), the Motion and OCR measurements read their
+    attributes.
+    """
+
+    def setUp(self):
+        self.image = Image('lenna')
+
+    def test_blob(self):
+        blob = self.image.findBlobs()[-1]
+        blob.image = self.image
+        loaded = _round_trip(blob)
+        self.assertAlmostEqual(loaded.radius(), blob.radius())
+        loaded.image = self.image
+        self.assertEqual(loaded.crop().size(), blob.crop().size())
+
+    def test_motion(self):
+        from SimpleSeer.plugins.Motion.motion import MotionFeature
+        loaded = _round_trip(MotionFeature(self.image, 12.5, bson.ObjectId()))
+        self.assertEqual(loaded.movement, 12.5)
+        loaded.image = self.image
+        self.assertEqual(loaded.crop().size(), self.image.size())
+
+    def test_ocr(self):
+        from SimpleSeer.plugins.OCR.ocr import OCRFeature
+        loaded = _round_trip(OCRFeature(self.image, 'SimpleSeer'))
+        self.assertEqual(loaded.text, 'SimpleSeer')
+        loaded.image = self.image
+        self.assertEqual(loaded.crop().size(), self.image.size())
+
+    def test_pickle_kept(self):
+        # for features whose state isn't all in their attributes
+        blob = self.image.findBlobs()[-1]
+        ff = M.FrameFeature()
+        ff.setFeature(blob, keep_pickle = True)
+        loaded = M.FrameFeature._from_son(ff.to_mongo())
+        assert loaded.featurepickle
+        self.assertEqual(loaded.feature.mContour, blob.mContour)
+
+class TestNumpyBintype(unittest.TestCase):
+
+    def _roundtrip(self, arr):
+        data = bson.Binary(_numpy_save(arr, None), 0x81)
+        return data, _numpy_load(data, None)
+
+    def test_small(self):
+        arr = np.arange(12, dtype=np.float32).reshape(3, 4)
+        data, result = self._roundtrip(arr)
+        assert (result == arr).all()
+        assert not result.flags.writeable # a view of data, not a copy
+
+    def test_compressed(self):
+        arr = np.zeros((512, 512), dtype=np.uint8)
+        data, result = self._roundtrip(arr)
+        assert len(data) < arr.nbytes
+        assert (result == arr).all()
+
+    def test_legacy(self):
+        arr = np.arange(10)
+        sio = StringIO()
+        np.save(sio, arr)
+        result = _numpy_load(bson.Binary(sio.getvalue(), 0x81), None)
+        assert (result == arr).all()
@@ -0,0 +1,71 @@
+import unittest
+
+import pygame
+from SimpleCV.ImageClass import Image
+
+from SimpleSeer import overlay
+
+class TestOverlay(unittest.TestCase):
+
+    def setUp(self):
+        overlay.install()
+        self.img = Image('lenna')
+
+    def _surfaces_equal(self, a, b):
+        return (pygame.image.tostring(a._mSurface, "RGBA")
+                == pygame.image.tostring(b._mSurface, "RGBA"))
+
+    def test_no_layers(self):
+        self.assertEqual(overlay.encode(self.img), None)
+
+    def test_vector_roundtrip(self):
+        dl = self.img.dl()
+        dl.circle((100, 100), 20, (255, 0, 0))
+        dl.lines([(0, 0), (50, 50), (100, 0)], (0, 255, 0))
+        data = overlay.encode(self.img)
+        # three calls' worth of primitives, not width * height * 4 bytes
+        assert len(data) < 1000
+        layers = overlay.layers(data, self.img.size())
+        self.assertEqual(len(layers), 1)
+        self.assertEqual(len(layers[0]._seer_ops), 2)
+        assert self._surfaces_equal(layers[0], dl)
+
+    def test_raster_roundtrip(self):
+        dl = self.img.dl()
+        dl.blit(Image((10, 10)).invert(), (30, 40))
+        data = overlay.encode(self.img)
+        layers = overlay.layers(data, self.img.size())
+        assert 'ops' not in overlay.bson.BSON(data).decode()['layers'][0]
+        assert self._surfaces_equal(layers[0], dl)
+
+    def test_direct_blit(self):
+        dl = self.img.dl()
+        dl.circle((100, 100), 20, (255, 0, 0))
+        # drawn past the recorder, so the circle alone won't do
+        dl._mSurface.blit(Image((10, 10)).invert().getPGSurface(), (30, 40))
+        data = overlay.encode(self.img)
+        assert 'ops' not in overlay.bson.BSON(data).decode()['layers'][0]
+        layers = overlay.layers(data, self.img.size())
+        assert self._surfaces_equal(layers[0], dl)
+
+    def test_legacy_rgba(self):
+        dl = self.img.dl()
+        dl.circle((100, 100), 20, (255, 0, 0))
+        data = pygame.image.tostring(dl._mSurface, "RGBA")
+        layers = overlay.layers(data, self.img.size(), None)
+        assert self._surfaces_equal(layers[0], dl)
+
+    def test_clear(self):
+        dl = self.img.dl()
+        dl.blit(Image((10, 10)).invert(), (30, 40))
+        dl.clear()
+        dl.circle((100, 100), 20, (255, 0, 0))
+        self.assertEqual(len(dl._seer_ops), 1)
+
+    def test_max_ops(self):
+        dl = self.img.dl()
+        for i in range(overlay.MAX_OPS + 1):
+            dl.circle((100, 100), 1 + i % 20, (255, 0, 0))
+        self.assertEqual(dl._seer_ops, None)
+        data = overlay.encode(self.img)
+        assert 'ops' not in overlay.bson.BSON(data).decode()['layers'][0]
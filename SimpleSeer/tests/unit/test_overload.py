@@ -0,0 +1,71 @@
+import unittest
+
+import mock
+
+from SimpleSeer.metrics import Metrics
+from SimpleSeer.overload import OverloadPolicy
+
+class _Frame(object):
+    passed = True
+    width = 100
+
+class TestOverloadPolicy(unittest.TestCase):
+
+    def setUp(self):
+        Metrics().reset()
+        self.policy = OverloadPolicy(dict(
+            policies=['drop_frames', 'every_nth', 'skip_passing_saves'],
+            every_nth=3, expensive=['blobs'], recover=2))
+
+    def test_idle(self):
+        self.policy.record(0.5, 1.0)
+        assert not self.policy.overloaded
+        assert not self.policy.drop_frame(1.0)
+        self.assertEqual(self.policy.skip_inspections(1), ())
+        assert not self.policy.skip_save(_Frame())
+
+    def test_overrun(self):
+        self.policy.record(3.5, 1.0)
+        assert self.policy.overloaded
+        self.assertEqual(self.policy.overruns, 1)
+        self.assertEqual(Metrics().counters['overload.overruns'], 1)
+        # 2.5s behind: drop two frames, then keep up
+        assert self.policy.drop_frame(1.0)
+        assert self.policy.drop_frame(1.0)
+        assert not self.policy.drop_frame(1.0)
+        self.assertEqual(self.policy.fired['drop_frames'], 2)
+
+    def test_every_nth(self):
+        self.policy.record(2.0, 1.0)
+        self.assertEqual(self.policy.skip_inspections(3), ())
+        self.assertEqual(self.policy.skip_inspections(4), set(['blobs']))
+
+    def test_skip_passing_saves(self):
+        self.policy.record(2.0, 1.0)
+        failed = _Frame()
+        failed.passed = False
+        assert self.policy.skip_save(_Frame())
+        assert not self.policy.skip_save(failed)
+
+    def test_recover(self):
+        self.policy.record(2.0, 1.0)
+        self.policy.record(0.1, 1.0)
+        assert self.policy.overloaded
+        self.policy.record(0.1, 1.0)
+        assert not self.policy.overloaded
+
+    def test_no_interval(self):
+        self.policy.record(2.0, 0)
+        assert not self.policy.overloaded
+
+    def test_degrade(self):
+        policy = OverloadPolicy(dict(policies=['thumbnails'], thumbnail_width=50))
+        frame = mock.Mock(width=100)
+        image = frame.image
+        assert not policy.degrade(frame)
+        policy.record(2.0, 1.0)
+        assert policy.degrade(frame)
+        # the frame is only marked; it is encoded when it is saved
+        self.assertEqual(frame._save_width, 50)
+        assert not frame._encode.called
+        assert frame.image is image
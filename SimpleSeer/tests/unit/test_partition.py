@@ -0,0 +1,81 @@
+import unittest
+from datetime import datetime
+
+import mock
+import bson
+
+from SimpleSeer import partition
+from SimpleSeer.partition import Partitioner, time_range, register_indexes
+
+class TestPartitioner(unittest.TestCase):
+
+    def test_day(self):
+        p = Partitioner('day')
+        when = datetime(2012, 6, 1, 13, 30)
+        self.assertEqual(p.suffix(when), 'd20120601')
+        self.assertEqual(p.bounds('d20120601'),
+                         (datetime(2012, 6, 1), datetime(2012, 6, 2)))
+
+    def test_week(self):
+        p = Partitioner('week')
+        # a Friday goes in the week starting on Monday the 28th
+        self.assertEqual(p.suffix(datetime(2012, 6, 1)), 'w20120528')
+        self.assertEqual(p.bounds('w20120528')[1], datetime(2012, 6, 4))
+
+    def test_not_a_partition(self):
+        p = Partitioner('day')
+        self.assertRaises(ValueError, p.bounds, 'w20120528')
+        self.assertRaises(ValueError, p.bounds, 'dfiles')
+
+    def test_bad_period(self):
+        self.assertRaises(ValueError, Partitioner, 'month')
+
+    def test_time_range(self):
+        start, end = datetime(2012, 6, 1), datetime(2012, 6, 3)
+        self.assertEqual(
+            time_range({'capturetime': {'$gte': start, '$lt': end}}), (start, end))
+        self.assertEqual(time_range({'capturetime': start}), (start, start))
+        self.assertEqual(time_range({'camera': 'a'}), (None, None))
+
+class TestPartitionReads(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.p = Partitioner('day')
+        self.p._db = lambda: self.db
+        self._indexes = partition.INDEXES.copy()
+
+    def tearDown(self):
+        partition.INDEXES.clear()
+        partition.INDEXES.update(self._indexes)
+
+    def test_indexes_once(self):
+        register_indexes('thing', ["capturetime", ('camera', '-capturetime')])
+        collection = self.db.__getitem__.return_value
+        self.p.collection('thing', 'd20120601')
+        self.p.collection('thing', 'd20120601')
+        self.assertEqual(collection.ensure_index.call_args_list, [
+                mock.call([('capturetime', 1)]),
+                mock.call([('camera', 1), ('capturetime', -1)])])
+
+    def test_find_ids_everywhere(self):
+        # one id from its own day, one moved to a partition far from its time
+        near = bson.ObjectId.from_datetime(datetime(2012, 6, 1, 12))
+        far = bson.ObjectId.from_datetime(datetime(2012, 6, 1, 13))
+        self.db.collection_names.return_value = [
+            'frame', 'frame_d20120601', 'frame_d20120101']
+        queried = []
+        def find(name):
+            collection = mock.Mock()
+            def found(query, fields = None):
+                queried.append(name)
+                ids = query['_id']['$in']
+                held = dict(frame_d20120601=near, frame_d20120101=far)
+                return [ { '_id': id } for id in ids if held.get(name) == id ]
+            collection.find = found
+            return collection
+        self.db.__getitem__.side_effect = find
+        found = self.p.find_ids('frame', [ near, far ])
+        self.assertEqual(found[near]['partition'], 'd20120601')
+        self.assertEqual(found[far]['partition'], 'd20120101')
+        self.assertEqual(queried, ['frame_d20120601', 'frame', 'frame_d20120101'])
@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime
+
+import mock
+
+from SimpleSeer.persistence import FrameWriter
+
+class TestFrameWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = FrameWriter(batch_size = 2, interval = 0.01, encoders = 1,
+                                  retries = 2, backoff = 0.5)
+        self.frames = [ mock.Mock(_encoded = None) for i in range(2) ]
+
+    def tearDown(self):
+        self.writer.stop()
+
+    @mock.patch('time.sleep')
+    @mock.patch('SimpleSeer.persistence.M')
+    def test_retry(self, M, sleep):
+        M.Frame.bulk_save.side_effect = [ IOError('mongo went away'), None ]
+        self.writer._write(self.frames)
+        self.assertEqual(M.Frame.bulk_save.call_count, 2)
+        sleep.assert_called_once_with(0.5)
+        stats = self.writer.stats()
+        self.assertEqual((stats['frames'], stats['retried'], stats['failed']), (2, 1, 0))
+
+    @mock.patch('time.sleep')
+    @mock.patch('SimpleSeer.persistence.M')
+    def test_gives_up(self, M, sleep):
+        M.Frame.bulk_save.side_effect = IOError('mongo went away')
+        self.writer._write(self.frames)
+        # the first try and two retries, backing off
+        self.assertEqual(M.Frame.bulk_save.call_count, 3)
+        self.assertEqual(sleep.call_args_list, [ mock.call(0.5), mock.call(1.0) ])
+        stats = self.writer.stats()
+        self.assertEqual((stats['frames'], stats['retried'], stats['failed']), (0, 2, 2))
+
+    @mock.patch('time.sleep')
+    @mock.patch('SimpleSeer.realtime.ChannelManager')
+    def test_retry_stores_files_once(self, cm, sleep):
+        from SimpleCV import Image
+        from SimpleSeer import models as M
+        from .. import utils
+        utils.register_mim_connection()
+        frames = []
+        for i in range(2):
+            frame = M.Frame(capturetime = datetime.utcnow(), camera = 'test')
+            frame.image = Image('lenna')
+            frames.append(frame)
+        files = M.Frame._get_db()['fs.files']
+        before = files.count()
+        collection = M.Frame._get_collection()
+        inserts = []
+        def insert(docs, **kwargs):
+            inserts.append(len(docs))
+            if len(inserts) == 1:
+                raise IOError('mongo went away')
+            return collection.insert(docs, **kwargs)
+        with mock.patch.object(
+                M.Frame, '_collection', return_value = mock.Mock(insert = insert)):
+            self.writer._write(frames)
+        # both attempts insert the whole batch
+        self.assertEqual(inserts, [2, 2])
+        self.assertEqual(self.writer.stats()['retried'], 1)
+        self.assertEqual(M.Frame.objects(id__in = [ f.id for f in frames ]).count(), 2)
+        # one image per frame, plus its thumbnails, stored once
+        stored = 2 + sum(len(f.thumbnails) for f in frames)
+        self.assertEqual(files.count() - before, stored)
@@ -0,0 +1,111 @@
+import unittest
+
+import mock
+
+from SimpleSeer.pipeline import Pipeline
+
+class TestPipeline(unittest.TestCase):
+
+    def test_order_preserved(self):
+        seen = []
+        p = Pipeline(depth=2)
+        p.add_stage('double', lambda x: x * 2)
+        p.add_stage('record', seen.append)
+        p.start()
+        for x in xrange(50):
+            p.put(x)
+        p.stop()
+        self.assertEqual(seen, [ x * 2 for x in xrange(50) ])
+
+    def test_stats(self):
+        p = Pipeline(depth=3)
+        p.add_stage('noop', lambda x: x)
+        p.start()
+        p.put(1, 0.5)
+        p.stop()
+        stats = p.stats()
+        self.assertEqual(stats['capture']['count'], 1)
+        self.assertEqual(stats['capture']['last'], 0.5)
+        self.assertEqual(stats['noop']['count'], 1)
+        self.assertEqual(stats['noop']['depth'], 3)
+        self.assertEqual(stats['noop']['queued'], 0)
+
+    def test_failed_stage_passes_item(self):
+        seen = []
+        def fail(x):
+            raise ValueError, x
+        p = Pipeline(depth=2)
+        p.add_stage('fail', fail)
+        p.add_stage('record', seen.append)
+        p.start()
+        p.put(1)
+        p.stop()
+        self.assertEqual(seen, [1])
+
+class TestPipelinedSeer(unittest.TestCase):
+
+    def test_lastframes_after_pipeline(self):
+        from SimpleSeer.SimpleSeer import SimpleSeer
+        from SimpleSeer.framebuffer import FrameBuffer
+        seer = object.__new__(SimpleSeer)
+        seer.lastframes = FrameBuffer(10)
+        seer.pipeline = object()
+        seer._previousframes = None
+        seer.framecount = 0
+        seer.overload = mock.Mock()
+        seer.config = mock.Mock(record_all = False)
+        seen = []
+        def inspect(frames, skip = ()):
+            seen.append((seer.previous_frames(), list(seer.lastframes)))
+        seer.inspect_frames = inspect
+        first, second = ['a'], ['b']
+        seer._inspect_stage(first)
+        seer._inspect_stage(second)
+        self.assertEqual(len(seer.lastframes), 0)
+        seer._persist_stage(first)
+        self.assertEqual(list(seer.lastframes), [ first ])
+        # each inspection saw the frameset before it, before it was done
+        self.assertEqual(seen, [ (None, []), (first, []) ])
+
+    def test_watchers_once_per_frameset(self):
+        from SimpleSeer.SimpleSeer import SimpleSeer
+        seer = object.__new__(SimpleSeer)
+        seer.pipeline = object()
+        seer.framecount = 0
+        seer.overload = mock.Mock()
+        watchers = [ mock.Mock(), mock.Mock() ]
+        for watcher in watchers:
+            watcher.check.return_value = False
+        seer.plan = mock.Mock(watchers = watchers)
+        def inspect(frames, skip = ()):
+            for frame in frames:
+                frame.results = [ frame.camera ]
+        seer.inspect_frames = inspect
+        framesets = [ [ mock.Mock(camera = 'a') ], [ mock.Mock(camera = 'b') ] ]
+        for frames in framesets:
+            seer._check_stage(seer._inspect_stage(frames))
+        for watcher in watchers:
+            self.assertEqual(watcher.check.call_args_list, [
+                    mock.call(['a'], seer.plan), mock.call(['b'], seer.plan) ])
+        self.assertTrue(framesets[0][0].passed)
+
+    @mock.patch('SimpleSeer.SimpleSeer.Metrics')
+    def test_queries_saved_gauge(self, metrics):
+        from SimpleSeer.SimpleSeer import SimpleSeer
+        seer = object.__new__(SimpleSeer)
+        seer.plan = mock.Mock(queries_saved = 0, watchers = [])
+        def inspect(frames, plan, skip):
+            plan.queries_saved += 1
+            return 2 # answered by the workers' plans
+        seer.executor = mock.Mock()
+        seer.executor.inspect.side_effect = inspect
+        seer.inspect_frames([ mock.Mock(), mock.Mock() ])
+        self.assertEqual(seer.plan_queries_saved, 1.5)
+        metrics().incr.assert_called_with('plan.queries_saved', 3)
+        seer.capture_stats = mock.Mock(return_value = dict(skew = 0, latency = {}))
+        seer.overload_stats = mock.Mock(
+            return_value = dict(overloaded = False, behind = 0.0))
+        seer.writer_stats = mock.Mock(return_value = {})
+        seer.get_metrics()
+        gauges = metrics().render.call_args[0][0]
+        self.assertEqual(gauges['plan.queries_saved_per_frame'], 1.5)
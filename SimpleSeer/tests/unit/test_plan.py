@@ -0,0 +1,40 @@
+import unittest
+
+import bson
+
+from SimpleSeer.plan import InspectionPlan
+
+class _Doc(object):
+
+    def __init__(self, **kwargs):
+        self.id = bson.ObjectId()
+        self.__dict__.update(kwargs)
+
+class TestInspectionPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.root = _Doc(name='root', parent=None, camera='')
+        self.cam = _Doc(name='cam', parent=None, camera='Camera 1')
+        self.child = _Doc(name='child', parent=self.root.id, camera='')
+        self.meas = _Doc(name='area', inspection=self.child.id)
+        self.plan = InspectionPlan(
+            [self.root, self.cam, self.child], [self.meas], [])
+
+    def test_roots_for_camera(self):
+        self.assertEqual(self.plan.roots_for('Camera 1'), [self.root, self.cam])
+        self.assertEqual(self.plan.roots_for('Camera 2'), [self.root])
+
+    def test_tree(self):
+        self.assertEqual(self.plan.children(self.root), [self.child])
+        self.assertEqual(self.plan.children(self.child), [])
+        self.assertEqual(self.plan.measurements(self.child), [self.meas])
+
+    def test_names(self):
+        self.assertEqual(self.plan.inspection_name(self.child.id), 'child')
+        self.assertEqual(self.plan.measurement_name(self.meas.id), 'area')
+
+    def test_queries_saved(self):
+        self.plan.children(self.root)
+        self.plan.measurements(self.root)
+        self.plan.inspection_name(self.root.id)
+        self.assertEqual(self.plan.queries_saved, 3)
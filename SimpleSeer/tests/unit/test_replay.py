@@ -0,0 +1,122 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+import mock
+import numpy as np
+from SimpleCV import Image
+
+from SimpleSeer.SimpleSeer import SimpleSeer, DirectoryCamera, RawFrameFile
+
+def _write_images(directory, base = 0):
+    '''Three images, saved out of name order, each a solid grey we can tell apart'''
+    for i in (2, 0, 1):
+        arr = np.zeros((8, 6, 3), dtype=np.uint8)
+        arr[:] = base + 10 * (i + 1)
+        Image(arr).save(os.path.join(directory, 'frame%d.png' % i))
+    return os.path.join(directory, '*.png')
+
+def _value(image):
+    if image is None:
+        return None
+    return int(image.getNumpy()[0, 0, 0])
+
+def _seer(cameras, names, concurrent = False):
+    seer = object.__new__(SimpleSeer)
+    seer.cameras = cameras
+    seer.config = mock.Mock(
+        cameras=[ dict(name=name) for name in names ],
+        concurrent_capture=concurrent)
+    seer.framecount = 0
+    seer.capture_latency = {}
+    seer.capture_skew = 0
+    seer._capture_pool = None
+    return seer
+
+class TestDirectoryReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.glob = _write_images(self.tmp)
+
+    def _replay(self, camera, n):
+        return [ _value(camera.getImage()) for i in range(n) ]
+
+    def test_order_and_loop(self):
+        camera = DirectoryCamera(self.glob, prefetch=2, cache=2)
+        self.assertEqual(self._replay(camera, 7), [10, 20, 30] * 2 + [10])
+
+    def test_end_of_input(self):
+        camera = DirectoryCamera(self.glob, prefetch=2, loop=False)
+        self.assertEqual(self._replay(camera, 5), [10, 20, 30, None, None])
+
+    def test_rawfile(self):
+        rawfile = os.path.join(self.tmp, 'replay.raw')
+        camera = DirectoryCamera(self.glob, rawfile=rawfile, loop=False)
+        self.assertEqual(self._replay(camera, 4), [10, 20, 30, None])
+        self.assertEqual(camera.getImage(), None)
+        self.assertEqual(
+            [ entry[0] for entry in camera.raw.index ], camera.filelist)
+        # a second replay maps the same raw file without rebuilding it
+        with mock.patch.object(RawFrameFile, '_build') as build:
+            camera = DirectoryCamera(self.glob, rawfile=rawfile)
+            self.assertFalse(build.called)
+        self.assertEqual(self._replay(camera, 4), [10, 20, 30, 10])
+
+    def test_capture_timestamps(self):
+        seer = _seer([ DirectoryCamera(self.glob, loop=False) ], ['Replay'])
+        framesets = [ seer.capture(record=False) for i in range(4) ]
+        # once the files run out, the frameset is empty
+        self.assertEqual(framesets[3], [])
+        frames = [ frameset[0] for frameset in framesets[:3] ]
+        self.assertEqual(
+            [ _value(f.image) for f in frames ], [10, 20, 30])
+        self.assertEqual([ f.camera for f in frames ], ['Replay'] * 3)
+        times = [ f.capturetime for f in frames ]
+        self.assertEqual(times, sorted(times))
+
+class TestConcurrentCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.globs = []
+        for base in (0, 100):
+            tmp = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, tmp)
+            self.globs.append(_write_images(tmp, base))
+
+    def _seer(self, concurrent):
+        seer = _seer([ DirectoryCamera(g) for g in self.globs ],
+                     ['A', 'B'], concurrent)
+        if concurrent:
+            self.addCleanup(lambda: seer._capture_pool.terminate())
+        return seer
+
+    def _capture(self, seer, n):
+        return [ [ (f.camera, _value(f.image)) for f in seer.capture(record=False) ]
+                 for i in range(n) ]
+
+    def test_same_framesets(self):
+        serial = self._capture(self._seer(False), 4)
+        self.assertEqual(serial, [
+                [ ('A', 10), ('B', 110) ], [ ('A', 20), ('B', 120) ],
+                [ ('A', 30), ('B', 130) ], [ ('A', 10), ('B', 110) ] ])
+        seer = self._seer(True)
+        # the pool keeps camera order
+        self.assertEqual(self._capture(seer, 4), serial)
+        stats = seer.capture_stats()
+        self.assertEqual(sorted(stats['latency']), ['A', 'B'])
+        for latency in stats['latency'].values():
+            assert 0 <= latency < 5
+        assert 0 <= stats['skew'] < 5
+
+    def test_failed_camera(self):
+        for concurrent in (False, True):
+            seer = self._seer(concurrent)
+            seer.cameras[0].getImage = mock.Mock(side_effect=IOError('unplugged'))
+            with mock.patch('SimpleSeer.SimpleSeer.Metrics'):
+                frames = self._capture(seer, 2)
+            # the other camera's frames are still captured
+            self.assertEqual(frames, [ [ ('B', 110) ], [ ('B', 120) ] ])
+            self.assertEqual(seer.capture_stats()['skew'], 0)
@@ -0,0 +1,94 @@
+import time
+import calendar
+import unittest
+from datetime import datetime, timedelta
+
+import bson
+import mock
+
+from SimpleSeer.retention import Retention, DROPS
+
+class TestRetention(unittest.TestCase):
+
+    def setUp(self):
+        self.retention = Retention(dict(
+                interval=600,
+                tiers=[ dict(age=86400, keep='thumbnails'),
+                        dict(age=2592000, keep='metadata') ]))
+
+    def test_cutoffs(self):
+        now = datetime(2012, 6, 1)
+        self.assertEqual(self.retention.cutoffs(now), [
+                ('metadata', now - timedelta(days=30)),
+                ('thumbnails', now - timedelta(days=1)) ])
+
+    @mock.patch('SimpleSeer.retention.M')
+    def test_maxframes_keeps_thumbnails(self, M):
+        oldest = mock.Mock(capturetime=datetime(2012, 5, 31))
+        M.Frame.search.return_value = (151, [ oldest ])
+        retention = Retention(dict(maxframes=150))
+        cutoff = datetime(2012, 5, 31) + timedelta(milliseconds=1)
+        self.assertEqual(
+            retention.cutoffs(datetime(2012, 6, 1)), [ ('thumbnails', cutoff) ])
+        with mock.patch.object(retention, '_strip', return_value=1) as strip:
+            retention.run(datetime(2012, 6, 1))
+        strip.assert_called_once_with(cutoff, DROPS['thumbnails'])
+        self.assertNotIn('thumbnails', DROPS['thumbnails'])
+        self.assertNotIn('thumbnail_file', DROPS['thumbnails'])
+
+    def test_strip(self):
+        self.retention._started, self.retention._reclaimed = time.time(), 0
+        img, thumb = bson.ObjectId(), bson.ObjectId()
+        docs = [ dict(_id=1, imgfile=img, imgref={}, layerref={ 'segment': 'a' },
+                      thumbnails={ '100': thumb, '200': { 'segment': 'b' } }) ]
+        collection = mock.Mock()
+        collection.find.return_value.sort.return_value.limit.side_effect = [ docs, [] ]
+        cutoff = datetime(2012, 6, 1)
+        with mock.patch.object(
+                self.retention, '_delete_files', return_value=100) as delete_files:
+            frames = self.retention._strip_collection(
+                collection, 'fs', cutoff, DROPS['metadata'])
+        self.assertEqual(frames, 1)
+        delete_files.assert_called_once_with([ img, thumb ], 'fs')
+        self.assertEqual(self.retention._reclaimed, 100)
+        collection.update.assert_called_once_with(
+            { '_id': { '$in': [1] } },
+            { '$unset': dict((f, 1) for f in DROPS['metadata']) }, multi=True)
+
+    @mock.patch('SimpleSeer.retention.get_router', return_value=None)
+    @mock.patch('SimpleSeer.retention.M')
+    def test_delete(self, M, get_router):
+        self.retention._started, self.retention._reclaimed = time.time(), 0
+        frames, results = M.Frame._get_collection(), M.Result._get_collection()
+        frames.find.return_value.sort.return_value.limit.return_value = []
+        frames.find.return_value.count.return_value = 3
+        cutoff = datetime(2012, 6, 1)
+        self.assertEqual(self.retention._delete(cutoff), 3)
+        query = { 'capturetime': { '$lt': cutoff } }
+        frames.remove.assert_called_once_with(query)
+        results.remove.assert_called_once_with(query)
+
+    @mock.patch('SimpleSeer.retention.imagestore')
+    def test_segment_cutoffs(self, imagestore):
+        store = imagestore.get_store.return_value
+        store.delete_before.return_value = ([], 0)
+        now = datetime(2012, 6, 1)
+        with mock.patch.object(self.retention, '_strip', return_value=0):
+            self.retention.run(now)
+        # images go with the thumbnails tier, thumbnails with metadata
+        self.assertEqual(store.delete_before.call_args_list, [
+                mock.call(calendar.timegm((now - timedelta(days=1)).timetuple()), ''),
+                mock.call(calendar.timegm((now - timedelta(days=30)).timetuple()),
+                          'thumbnails') ])
+
+    @mock.patch('time.sleep')
+    def test_throttle(self, sleep):
+        self.retention.max_bytes_per_second = 1000
+        self.retention._started = 0
+        self.retention._reclaimed = 0
+        self.retention._throttle()
+        assert not sleep.called
+        with mock.patch('time.time', return_value=1.0):
+            self.retention._reclaimed = 3000
+            self.retention._throttle()
+        sleep.assert_called_with(2.0)
@@ -0,0 +1,30 @@
+import unittest
+
+import mock
+import mongoengine
+
+from SimpleSeer.Session import connect_mim
+
+class TestConnectMim(unittest.TestCase):
+
+    def setUp(self):
+        # leave whatever connection the other tests use as it was
+        for table in ('_connections', '_connection_settings', '_dbs'):
+            patch = mock.patch.dict(getattr(mongoengine.connection, table))
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_same_database_kept(self):
+        connect_mim('seer_test')
+        db = mongoengine.connection.get_db()
+        db.things.insert({ 'a': 1 })
+        connect_mim('seer_test')
+        self.assertEqual(mongoengine.connection.get_db().things.count(), 1)
+
+    def test_other_database(self):
+        connect_mim('seer_test')
+        mongoengine.connection.get_db().things.insert({ 'a': 1 })
+        connect_mim('seer_perftest')
+        db = mongoengine.connection.get_db()
+        self.assertEqual(db.name, 'seer_perftest')
+        self.assertEqual(db.things.count(), 0)
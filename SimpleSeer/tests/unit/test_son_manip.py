@@ -129,3 +129,24 @@ class TestSonScrub(unittest.TestCase):
             k=bson.ObjectId())
         d = self.scrubber.transform_incoming(obj, None)
         self.assertEqual(obj, d)
+
+    def test_native_not_copied(self):
+        obj = dict(a=1, b=[2, dict(c=3)], d=dict(e=[4.0, 'f']))
+        d = self.scrubber.transform_incoming(obj, None)
+        self.assert_(d is obj)
+
+    def test_only_changed_copied(self):
+        self.scrubber.scrub_type(_Custom)
+        native = dict(c=[1, 2])
+        obj = dict(a=dict(b=_Custom()), native=native)
+        d = self.scrubber.transform_incoming(obj, None)
+        self.assertEqual(d, dict(a={}, native=native))
+        self.assert_(d['native'] is native)
+        self.assertEqual(obj['a'].keys(), ['b'])
+
+    def test_serializer_cache(self):
+        self.scrubber.register_bsonifier(_Custom, lambda v,c: 42)
+        self.scrubber.transform_incoming(dict(a=_Custom1()), None)
+        self.scrubber.register_bsonifier(_Custom1, lambda v,c: 43)
+        d = self.scrubber.transform_incoming(dict(a=_Custom1()), None)
+        self.assertEqual(d, {'a': 43})
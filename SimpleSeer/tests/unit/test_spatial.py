@@ -0,0 +1,76 @@
+import random
+import unittest
+
+import numpy as np
+
+from SimpleSeer import spatial
+
+def _ray_cast(point, poly):
+    '''FrameFeature.contains as it was, to check against'''
+    x, y = point
+    n = len(poly)
+    inside = False
+    p1x, p1y = poly[0]
+    for i in range(n + 1):
+        p2x, p2y = poly[i % n]
+        if y > min(p1y, p2y):
+            if y <= max(p1y, p2y):
+                if x <= max(p1x, p2x):
+                    if p1y != p2y:
+                        xinters = (y - p1y) * (p2x - p1x) / float(p2y - p1y) + p1x
+                    if p1x == p2x or x <= xinters:
+                        inside = not inside
+        p1x, p1y = p2x, p2y
+    return inside
+
+class _Feature(object):
+    def __init__(self, points):
+        self.points = points
+
+def _square(x, y, size):
+    return [ (x, y), (x + size, y), (x + size, y + size), (x, y + size) ]
+
+class TestPointsInPolygon(unittest.TestCase):
+
+    def test_matches_ray_cast(self):
+        rnd = random.Random(42)
+        poly = [ (0, 0), (50, 10), (100, 0), (80, 60), (100, 100), (0, 80), (30, 40) ]
+        points = [ (rnd.uniform(-10, 110), rnd.uniform(-10, 110))
+                   for i in range(500) ]
+        result = spatial.points_in_polygon(points, poly)
+        self.assertEqual(result.tolist(), [ _ray_cast(p, poly) for p in points ])
+
+    def test_degenerate(self):
+        self.assertEqual(
+            spatial.points_in_polygon([(0, 0)], [(0, 0), (1, 1)]).tolist(), [False])
+
+    def test_many_polygons(self):
+        result = spatial.points_in_polygons(
+            [ (5, 5), (15, 5), (50, 50) ],
+            [ _square(0, 0, 10), _square(10, 0, 10) ])
+        self.assertEqual(result.tolist(),
+                         [ [True, False], [False, True], [False, False] ])
+
+class TestFeatureIndex(unittest.TestCase):
+
+    def setUp(self):
+        # a 10x10 grid of 20px squares, 50px apart
+        self.features = [ _Feature(_square(x * 50, y * 50, 20))
+                          for x in range(10) for y in range(10) ]
+        self.index = spatial.FeatureIndex(self.features, cell=32)
+
+    def test_at(self):
+        self.assertEqual(self.index.at((60, 110)), [ self.features[12] ])
+        self.assertEqual(self.index.at((40, 40)), [])
+
+    def test_hits(self):
+        self.assertEqual(self.index.hits([ (60, 110), (40, 40), (455, 5) ]),
+                         [ [12], [], [90] ])
+
+    def test_overlapping(self):
+        found = self.index.overlapping((45, 45, 105, 105))
+        self.assertEqual(found, [ self.features[i] for i in (11, 12, 21, 22) ])
+
+    def test_within(self):
+        found = self.index.within(_square(-5, -5, 80))
+        self.assertEqual(found, [ self.features[i] for i in (0, 1, 10, 11) ])
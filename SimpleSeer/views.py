@@ -3,6 +3,7 @@ import re
 import json
 import logging
 from datetime import datetime
+from cStringIO import StringIO
 
 import bson.json_util
 import gevent
@@ -94,12 +95,15 @@ def frame():
 @util.jsonify
 def lastframes():
     params = request.values.to_dict()
-    frames = M.Frame.objects().order_by("-capturetime")
+    projection = params.get('projection', 'summary')
+    filters = {}
     if 'before' in params:
-        frames = frames.filter(capturetime__lte=datetime.fromtimestamp(int(params['before'])))
-    total_frames = frames.count()
-    frames = frames.skip((int(params.get('page', 1))-1)*20).limit(20)
-    return dict(frames=list(frames), total_frames=total_frames)
+        filters['capturetime'] = {'$lte': datetime.fromtimestamp(int(params['before']))}
+    total_frames, frames = M.Frame.search(
+        filters, [('capturetime', -1)], (int(params.get('page', 1))-1)*20, 20,
+        projection)
+    return dict(frames=[ f.state(projection) for f in frames ],
+                total_frames=total_frames)
 
 @route('/frames', methods=['GET'])
 @util.jsonify
@@ -113,24 +117,58 @@ def frames():
         object_hook=bson.json_util.object_hook)
     skip = int(params.get('skip', 0))
     limit = int(params.get('limit', 20))
-    total_frames, frames = M.Frame.search(f_params, s_params, skip, limit)
-    return dict(frames=frames, total_frames=total_frames)
+    projection = params.get('projection', 'full')
+    total_frames, frames = M.Frame.search(
+        f_params, s_params, skip, limit, projection)
+    return dict(frames=[ f.state(projection) for f in frames ],
+                total_frames=total_frames)
 
 #TODO, abstract this for layers and thumbnails        
 @route('/grid/imgfile/<frame_id>', methods=['GET'])
 def imgfile(frame_id):
     params = request.values.to_dict()
-    frame = M.Frame.objects(id = bson.ObjectId(frame_id))
-    if not frame or not frame[0].imgfile:
+    frame = M.Frame.by_id(frame_id)
+    if not frame:
         return "Image not found", 404
-    frame = frame[0]
-    resp = make_response(frame.imgfile.read(), 200)
-    resp.headers['Content-Type'] = frame.imgfile.content_type
+    data = frame.image_data()
+    if data is None:
+        return "Image not found", 404
+    codec = frame.codec
+    if codec.content_type.startswith('image/'):
+        # from GridFS or the segment store, whichever it was saved to
+        resp = make_response(data, 200)
+        resp.headers['Content-Type'] = codec.content_type
+        extension = codec.extension
+    else:
+        # browsers can't show raw frames, send them a jpeg
+        s = StringIO()
+        frame.image.getPIL().save(s, "jpeg", quality = 100)
+        resp = make_response(s.getvalue(), 200)
+        resp.headers['Content-Type'] = 'image/jpeg'
+        extension = 'jpg'
     if 'download' in params:
-        resp.headers['Content-disposition'] = 'attachment; filename="%s-%s.jpg"' % \
-            (frame.camera.replace(' ','_'), frame.capturetime.strftime("%Y-%m-%d_%H_%M_%S"))
+        resp.headers['Content-disposition'] = 'attachment; filename="%s-%s.%s"' % \
+            (frame.camera.replace(' ','_'), frame.capturetime.strftime("%Y-%m-%d_%H_%M_%S"), extension)
     return resp    
     
+@route('/grid/thumbnails/<frame_id>/<int:width>', methods=['GET'])
+def thumbnail(frame_id, width):
+    frame = M.Frame.by_id(frame_id)
+    if not frame:
+        return "Image not found", 404
+    data = frame.thumbnail_data(width)
+    if data is None:
+        # saved before thumbnails were built at capture time
+        img = frame.image_at(width)
+        if img is None:
+            return "Image not found", 404
+        s = StringIO()
+        img.save(s, "jpeg", quality = 75)
+        data = s.getvalue()
+    resp = make_response(data, 200)
+    resp.headers['Content-Type'] = 'image/jpeg'
+    return resp
+
 @route('/videofeed-width<int:width>-camera<int:camera>.mjpeg', methods=['GET'])
 def videofeed(width=0, camera=0):    
     params = {
@@ -272,7 +310,7 @@ def inspection_remove():
     M.Watcher.objects.delete() #todo narrow by measurement
 
     M.Measurement.objects(inspection = bson.ObjectId(params["id"])).delete()
-    M.Result.objects(inspection = bson.ObjectId(params["id"])).delete()
+    M.Result.purge(inspection = bson.ObjectId(params["id"]))
     seer.reloadInspections()
     seer.inspect()
     #util.get_seer().update()
@@ -301,6 +339,7 @@ def inspection_update():
 
         #TODO, add sorts, filters etc
         insp.save()
+        util.get_seer().reloadInspections()
         return util.get_seer().inspections
     except:
         return dict(status = "fail")
@@ -338,7 +377,7 @@ def measurement_remove():
     try:
         params = request.values.to_dict()
         M.Measurement.objects(id = bson.ObjectId(params["id"])).delete()
-        M.Result.objects(measurement = bson.ObjectId(params["id"])).delete()
+        M.Result.purge(measurement = bson.ObjectId(params["id"]))
         M.Watcher.objects.delete() #todo narrow by measurement
 
         util.get_seer().reloadInspections()
@@ -353,10 +392,17 @@ def measurement_remove():
 def measurement_results(self, **params):
     try:
         params = request.values.to_dict()
-        return list(M.Result.objects(measurement = bson.ObjectId(params["id"])).order_by("-capturetime"))
+        return M.Result.latest(measurement = bson.ObjectId(params["id"]))
     except:
         return dict(status = "fail")
 
+@route('/metrics', methods=['GET'])
+def metrics():
+    seer = SeerProxy2()
+    resp = make_response(seer.get_metrics(), 200)
+    resp.headers['Content-Type'] = 'text/plain'
+    return resp
+
 @route('/ping', methods=['GET', 'POST'])
 @util.jsonify
 def ping():